@@ -75,7 +75,7 @@ OPTIONAL.add_argument("-T", "--prediction_threshold",
                       help='Threshold/cutoff for predictions [0.95]',
                       metavar='<float>',
                       default=0.95,
-                      type=int
+                      type=float
                       )
 
 OPTIONAL.add_argument("-c", "--chunk_size",
@@ -91,6 +91,44 @@ OPTIONAL.add_argument("-O", "--output_fasta",
                       action='store_true'
                       )
 
+OPTIONAL.add_argument("-S", "--small_model",
+                      help='Fast model (e.g. a distilled cnn) of a two-stage cascade, trained with the same tokenizer. Only the reads it predicts below --cascade_confidence are predicted with the full model [None]',
+                      metavar='<model>',
+                      default=None
+                      )
+
+OPTIONAL.add_argument("--cascade_confidence",
+                      help='Reads predicted by the small model below this probability are predicted with the full model [0.99]',
+                      metavar='<float>',
+                      default=0.99,
+                      type=float
+                      )
+
+OPTIONAL.add_argument("--cascade_audit",
+                      help='Fraction of the reads predicted by the small model above --cascade_confidence also predicted with the full model, to estimate the agreement of the cascade with it [0.01]',
+                      metavar='<float>',
+                      default=0.01,
+                      type=float
+                      )
+
+OPTIONAL.add_argument("-P", "--save_probabilities",
+                      help='If this option is "True", the class probabilities of every read are saved as float16 in the input order, to recompute the report at other thresholds with pacific_summary.py resummarize [False]',
+                      default=False,
+                      action='store_true'
+                      )
+
+OPTIONAL.add_argument("-b", "--length_buckets",
+                      help='Comma separated read lengths, every read is truncated to the largest length it reaches and predicted with the reads of that length, reads shorter than the smallest length are discarded (e.g. 75,100,125,150) [150]',
+                      metavar='<ints>',
+                      default='150'
+                      )
+
+OPTIONAL.add_argument("-F", "--fused",
+                      help='If this option is "True", the embedding and first convolution are replaced by the fused table of the model (see fused_inference.py) [False]',
+                      default=False,
+                      action='store_true'
+                      )
+
 OPTIONAL.add_argument('-v', '--version', 
                         action='version', 
                         version='%(prog)s')
@@ -113,100 +151,23 @@ FILE_TYPE = ARGS.file_type
 OUTPUTDIR = ARGS.outputdir
 THRESHOLD_PREDICTION = ARGS.prediction_threshold
 OUTPUT_FASTA = ARGS.output_fasta
+SAVE_PROBABILITIES = ARGS.save_probabilities
 CHUNK_SIZE = ARGS.chunk_size
+FUSED = ARGS.fused
+SMALL_MODEL = ARGS.small_model
+CASCADE_CONFIDENCE = ARGS.cascade_confidence
+CASCADE_AUDIT = ARGS.cascade_audit
+LENGTH_BUCKETS = sorted(set(int(i) for i in ARGS.length_buckets.split(',')))
 
 # import other packages
-from Bio import SeqIO
-
-import pickle
-from keras.models import load_model
 import random
 import numpy as np
-import pandas as pd
 import tensorflow as tf
-import os
 import sys
 
-# hardcode paths to tokenizer and label maker
-dirname = os.path.dirname(__file__)
-#TOKENIZER = os.path.join(dirname, '../model', 'tokenizer.01.pacific_9mers.pickle')
-#LABEL_MAKER = os.path.join(dirname, '../model', 'label_maker.01.pacific_9mers.pickle')
-
-
-def process_reads(sequences, kmer, names):
-    '''
-    '''
-    r_reads = []
-    new_names = []
-    for i in enumerate(sequences):
-        # check the reads does not contain weird characters
-        if all(c in 'AGCT' for c in i[1].upper()) and len(i[1]) >= 150:
-            read = i[1][:150]
-            r_reads.append(' '.join(read[x:x+kmer].upper() for x in range(len(read) - kmer + 1)))
-            new_names.append(names[i[0]])
-    return r_reads, new_names
-
-
-def main(all_transcripts, names, k_mer_size):
-    '''
-    '''
-    reads, names_p = process_reads(all_transcripts, 
-                                   k_mer_size,
-                                   names)
-
-    return all_transcripts, reads, names_p
-
-def accuracy(labels, predictions):
-    '''
-    calculate accuracy
-    '''
-    try:
-        if labels.shape != predictions.shape:
-            print('labels and predictions does not have same dimentions')
-            return False
-        
-        correct = 0
-        for i in range(len(labels)):
-            if labels[i] == predictions[i]:
-                correct +=1
-    except:
-        return 0
-    
-    return correct/len(labels)
-
-def predict_chunk(sequences,
-                 names,
-                 K_MERS,
-                 FILE_TYPE,
-                 total_results,
-                 total_sequences):
-    '''
-    Predicting and write a chunk of reads
-    '''
-    
-    total_sequences += len(sequences)
-    
-    reads, kmer_sequences, names = main(sequences,
-                                        names,
-                                        K_MERS,
-                                        )
-    
-    kmer_sequences = tokenizer.texts_to_sequences(kmer_sequences)
-       
-    predictions = model.predict(np.array(kmer_sequences))
-    labels = label_maker.inverse_transform(np.array(predictions), threshold=THRESHOLD_PREDICTION)
-        
-    if OUTPUT_FASTA is True:
-        print()
-        fasta_name_out = OUTPUTDIR+'/tmp_output_'+str(counter)
-        print('writting temporary output file '+fasta_name_out)
-        with open(fasta_name_out,'w') as output:
-            for i in enumerate(names):
-                print('>'+i[1]+':'+str(max(predictions[i[0]]))+':'+labels[i[0]], file=output)
-                print(reads[i[0]], file=output)
-                total_results[labels[i[0]]] += [max(predictions[i[0]])]
-                
-    return total_results, total_sequences
+from pacific import Classifier
+from pacific_summary import save_summary, summary_report, bucket_report, cascade_report
+from pacific_summary import write_probabilities, PROBABILITIES_FILE, NAMES_FILE
 
 
 if __name__ == '__main__':
@@ -223,86 +184,62 @@ if __name__ == '__main__':
     config.gpu_options.allow_growth = True
     sess = tf.compat.v1.Session(config=config)
     
-    K_MERS = 9
-    
-    model = load_model(MODEL)
-    
-    # Keras loading sequences tokenizer 
-    with open(TOKENIZER, 'rb') as handle:
-        tokenizer = pickle.load(handle)
-        
-    # loading label maker
-    with open(LABEL_MAKER, 'rb') as handle:
-        label_maker = pickle.load(handle)
+    try:
+        classifier = Classifier(MODEL,
+                                TOKENIZER,
+                                LABEL_MAKER,
+                                threshold=THRESHOLD_PREDICTION,
+                                length_buckets=LENGTH_BUCKETS,
+                                fused=FUSED,
+                                small_model=SMALL_MODEL,
+                                cascade_confidence=CASCADE_CONFIDENCE,
+                                cascade_audit=CASCADE_AUDIT)
+    except ValueError as error:
+        parser.error(str(error))
     
     print()    
     print('Reading input file...')
     print()
     
-    total_results = {'Sars_cov_2': [],
-                     'Coronaviridae': [],
-                     'Influenza': [],
-                     'Metapneumovirus': [],
-                     'Rhinovirus': [],
-                     'Human': []
-                     }
-    
-    total_sequences = 0
-    fasta_sequences = SeqIO.parse(open(FILE_IN), FILE_TYPE)
-    sequences = []
-    names = []
-    counter = 0
-    for fasta in fasta_sequences:
-        name, sequence = fasta.id, str(fasta.seq)
-        sequences.append(sequence)
-        names.append(name)
-        counter +=1
-        if counter%CHUNK_SIZE == 0:
-            
-            total_results, total_sequences = predict_chunk(sequences,
-                                                           names,
-                                                           K_MERS,
-                                                           FILE_TYPE,
-                                                           total_results,
-                                                           total_sequences)
-            sequences = []
-            names = []
-            print()
-            print('predictig reads: '+str(counter-CHUNK_SIZE)+' '+str(counter))
-            
-    total_results, total_sequences = predict_chunk(sequences,
-                                                   names,
-                                                   K_MERS,
-                                                   FILE_TYPE,
-                                                   total_results,
-                                                   total_sequences)
-    
-    tmp_files = os.listdir(OUTPUTDIR)
-    tmp_files = [i for i in tmp_files if i.startswith('tmp_output')]
-    import shutil
+    # raw counts of the run, mergeable with the summaries of other shards
+    summary = classifier.new_summary()
     
+    if SAVE_PROBABILITIES is True:
+        probabilities_handle = open(OUTPUTDIR+'/'+PROBABILITIES_FILE, 'wb')
+        names_handle = open(OUTPUTDIR+'/'+NAMES_FILE, 'w')
     if OUTPUT_FASTA is True:
+        fasta_handle = open(OUTPUTDIR+'/output_PACIFIC.fasta', 'w')
+    
+    counter = 0
+    for names, reads, results in classifier.classify_file(FILE_IN, FILE_TYPE, CHUNK_SIZE, summary):
+        print()
+        print('predictig reads: '+str(counter)+' '+str(counter+len(reads)))
+        counter += len(reads)
+        if SAVE_PROBABILITIES is True:
+            write_probabilities(probabilities_handle, names_handle, results['probabilities'], names)
+        if OUTPUT_FASTA is True:
+            for i in np.flatnonzero(results['length'] > 0):
+                print('>'+names[i]+':'+str(results['scores'][i])+':'+classifier.class_names[results['predicted'][i]],
+                      file=fasta_handle)
+                print(reads[i], file=fasta_handle)
+    
+    if SAVE_PROBABILITIES is True:
+        probabilities_handle.close()
+        names_handle.close()
         print()
-        print('Writting final output FASTA '+OUTPUTDIR+'/output_pacific.fasta')
-        with open('output_PACIFIC.fasta','wb') as wfd:
-            for f in tmp_files:
-                with open(OUTPUTDIR+'/'+f,'rb') as fd:
-                    shutil.copyfileobj(fd, wfd)
-
-    for delete_file in tmp_files:
-        os.remove(OUTPUTDIR+'/'+delete_file)
+        print('Class probabilities of every read in '+OUTPUTDIR+'/'+PROBABILITIES_FILE)
+    if OUTPUT_FASTA is True:
+        fasta_handle.close()
         print()
-        print('Deleting temporary file '+delete_file)
+        print('Writting final output FASTA '+OUTPUTDIR+'/output_PACIFIC.fasta')
     
     
-    processed_reads = len(total_results['Influenza'])+\
-                      len(total_results['Coronaviridae'])+\
-                      len(total_results['Metapneumovirus'])+\
-                      len(total_results['Rhinovirus'])+\
-                      len(total_results['Sars_cov_2'])+\
-                      len(total_results['Human'])
+    save_summary(OUTPUTDIR+'/summary_PACIFIC.json', summary)
+    
+    total_sequences = summary['total_reads']
+    processed_reads = total_sequences - summary['discarded_reads']
                       
-    if len(processed_reads) == 0:
+    if processed_reads == 0:
         print('None processed reads')
         sys.exit()
     
@@ -311,60 +248,24 @@ if __name__ == '__main__':
     print('From a total of '+str(total_sequences)+' reads, '+str(total_sequences - processed_reads)+\
           ' were discarded, (probabbly due to non-standart nucleotides or too short reads)')
     
-    df_results = pd.DataFrame()
-    
-    df_results['Class'] = ['SARS-CoV-2', 'Coronaviridae', 
-                           'Influenza', 'Metapneumovirus', 
-                           'Rhinovirus','Human']
-
-    df_results['# predicted reads'] = [len(total_results['Sars_cov_2']),
-                                       len(total_results['Coronaviridae']),
-                                       len(total_results['Influenza']),
-                                       len(total_results['Metapneumovirus']),
-                                       len(total_results['Rhinovirus']),
-                                       len(total_results['Human'])
-                                          ]
-    
-    percentage = {}
-    for classes in total_results:
-        number_class = len(total_results[classes])
-        percentage[classes] = (number_class/processed_reads) *100
-    
-    df_results['# predicted reads (%)'] = [percentage['Sars_cov_2'],
-                                           percentage['Coronaviridae'],
-                                           percentage['Influenza'],
-                                           percentage['Metapneumovirus'],
-                                           percentage['Rhinovirus'],
-                                           percentage['Human']
-                                          ]
-    threshold_reads = {}
-    total_threshold_reads = 0
-    for classes in total_results:
-        numpy_class = np.array(total_results[classes])
-        threshold_reads[classes] = len(numpy_class[numpy_class > THRESHOLD_PREDICTION])
-        total_threshold_reads +=threshold_reads[classes]
-    
-    df_results['# predicted reads above '+str(THRESHOLD_PREDICTION)] = [threshold_reads['Sars_cov_2'],
-                                                                        threshold_reads['Coronaviridae'],
-                                                                        threshold_reads['Influenza'],
-                                                                        threshold_reads['Metapneumovirus'],
-                                                                        threshold_reads['Rhinovirus'],
-                                                                        threshold_reads['Human']
-                                                                       ]
-    
-    df_results['# predicted reads above '+str(THRESHOLD_PREDICTION)+' (%)'] = \
-               [threshold_reads['Sars_cov_2']/total_threshold_reads*100 ,
-                threshold_reads['Coronaviridae']/total_threshold_reads*100,
-                threshold_reads['Influenza']/total_threshold_reads*100,
-                threshold_reads['Metapneumovirus']/total_threshold_reads*100,
-                threshold_reads['Rhinovirus']/total_threshold_reads*100,
-                threshold_reads['Human']/total_threshold_reads*100
-               ]
-    
+    df_results = summary_report(summary)
     
     print()
     print(df_results)
     df_results.to_csv(OUTPUTDIR+'/output_PACIFIC.txt')
+    
+    # classified and discarded reads per read length bucket
+    df_buckets = bucket_report(summary)
+    print()
+    print(df_buckets)
+    df_buckets.to_csv(OUTPUTDIR+'/output_PACIFIC_buckets.txt')
+    
+    if 'cascade' in summary:
+        # escalation rate and agreement of the cascade with the full model
+        df_cascade = cascade_report(summary)
+        print()
+        print(df_cascade)
+        df_cascade.to_csv(OUTPUTDIR+'/output_PACIFIC_cascade.txt')
     print()
     print('Thank you for using PACIFIC =^)')
     
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Vectorized bootstrap of the false positive rates of limit_detection.py and
+of the precision/recall experiments of precision_recall.py.
+
+Every prediction matrix is reduced once to the predicted class (argmax)
+and its probability (max) of each read. For one class and threshold a
+read then falls in one of three categories:
+
+    0: probability below the threshold
+    1: above the threshold and predicted as the class (false positive)
+    2: above the threshold and predicted as another class
+
+and a bootstrap sample only needs the counts of each category. The counts
+are drawn either from batched index arrays, the same random numbers as
+sampling reads one experiment at a time with np.random.randint, or
+directly from a multinomial distribution, which does not depend on the
+sample size at all. Large numbers of iterations can be split over a pool
+of processes, each with its own random seed.
+
+The precision/recall experiments work the same way on the confusion
+counts: every experiment draws a number of reads per true class and only
+the number of them predicted as each class matters, so an experiment is a
+(true class x predicted class) count table drawn from the table of all
+the reads, and precision and recall follow from its diagonal and sums.
+"""
+
+import multiprocessing
+
+import numpy as np
+
+
+METHODS = ('index', 'multinomial')
+
+
+def summarize_predictions(predictions):
+    '''
+    predicted class and its probability of every read
+    '''
+    predictions = np.asarray(predictions)
+    return np.argmax(predictions, axis=1).astype(np.int8), np.max(predictions, axis=1)
+
+
+def concatenate_summaries(summaries):
+    '''
+    concatenate the summaries of several prediction matrices
+    '''
+    return (np.concatenate([i[0] for i in summaries]),
+            np.concatenate([i[1] for i in summaries]))
+
+
+def threshold_categories(summary, label, threshold):
+    '''
+    category of every read for one class and threshold (see module docstring)
+    '''
+    predicted, scores = summary
+    above = scores >= threshold
+    categories = np.zeros(len(predicted), dtype=np.int8)
+    categories[above & (predicted == label)] = 1
+    categories[above & (predicted != label)] = 2
+    return categories
+
+
+def category_counts(categories):
+    '''
+    number of reads per category
+    '''
+    return np.bincount(categories, minlength=3)
+
+
+def proportion_from_counts(counts):
+    '''
+    percentage of false positives relative to the reads of other classes
+    above the threshold, as percentile_proportion (inf when there are none)
+    '''
+    counts = np.asarray(counts, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (100/counts[..., 2])*counts[..., 1]
+
+
+def resample_counts(categories,
+                    iterations,
+                    sample_size,
+                    population=None,
+                    method='index',
+                    random_state=None,
+                    batch_size=100):
+    '''
+    category counts of iterations bootstrap samples of sample_size reads
+    drawn with replacement from the first population reads
+    '''
+    if method not in METHODS:
+        raise ValueError('method should be one of '+', '.join(METHODS))
+    if random_state is None:
+        random_state = np.random
+    if population is None:
+        population = len(categories)
+
+    if method == 'multinomial':
+        frequencies = category_counts(categories[:population])/population
+        return random_state.multinomial(sample_size, frequencies, size=iterations)
+
+    counts = np.zeros((iterations, 3), dtype=np.int64)
+    for start in range(0, iterations, batch_size):
+        end = min(start + batch_size, iterations)
+        sample = categories[random_state.randint(population, size=(end - start, sample_size))]
+        for category in (1, 2):
+            counts[start:end, category] = (sample == category).sum(axis=1)
+        counts[start:end, 0] = sample_size - counts[start:end, 1:].sum(axis=1)
+    return counts
+
+
+def resample_job(job):
+    '''
+    resample_counts with its own seed, runs in a worker process
+    '''
+    categories, iterations, sample_size, population, method, seed, batch_size = job
+    return resample_counts(categories,
+                           iterations,
+                           sample_size,
+                           population,
+                           method,
+                           np.random.RandomState(seed),
+                           batch_size)
+
+
+def bootstrap_proportions(categories,
+                          iterations,
+                          sample_size,
+                          population=None,
+                          method='index',
+                          random_state=None,
+                          processes=1,
+                          batch_size=100):
+    '''
+    false positive percentage of every bootstrap sample
+
+    with one process the index method gives the same values as drawing
+    np.random.randint(population, size=sample_size) once per iteration
+    from random_state
+    '''
+    if random_state is None:
+        random_state = np.random
+    if processes <= 1 or iterations < 2*processes:
+        counts = resample_counts(categories,
+                                 iterations,
+                                 sample_size,
+                                 population,
+                                 method,
+                                 random_state,
+                                 batch_size)
+        return proportion_from_counts(counts)
+
+    seeds = random_state.randint(2**31 - 1, size=processes)
+    jobs = [(categories, len(i), sample_size, population, method, seed, batch_size)
+            for i, seed in zip(np.array_split(np.arange(iterations), processes), seeds)]
+    pool = multiprocessing.get_context('spawn').Pool(processes)
+    try:
+        counts = np.concatenate(pool.map(resample_job, jobs))
+    finally:
+        pool.close()
+        pool.join()
+    return proportion_from_counts(counts)
+
+
+def confusion_table(predicted_per_class, n_classes=6):
+    '''
+    number of reads of every true class (rows) predicted as every class
+    '''
+    return np.stack([np.bincount(i, minlength=n_classes) for i in predicted_per_class])
+
+
+def multinomial_counts(n, probabilities, random_state):
+    '''
+    one multinomial draw per entry of n, as a chain of binomials so all
+    the draws are vectorized
+    '''
+    n = np.asarray(n, dtype=np.int64)
+    counts = np.zeros(n.shape+(len(probabilities),), dtype=np.int64)
+    remaining = n.copy()
+    left = 1.0
+    for i, probability in enumerate(probabilities[:-1]):
+        if left > 0:
+            counts[..., i] = random_state.binomial(remaining, min(probability/left, 1.0))
+        remaining -= counts[..., i]
+        left -= probability
+    counts[..., -1] = remaining
+    return counts
+
+
+def experiment_sizes(experiments, n_true, max_size, size_random):
+    '''
+    reads per true class of every experiment, drawn like precision_recall.py
+    with random.randrange(max_size) in experiment then class order
+    '''
+    return np.array([[size_random.randrange(max_size) for _ in range(n_true)]
+                     for _ in range(experiments)], dtype=np.int64)
+
+
+def resample_confusion(predicted_per_class,
+                       sizes,
+                       method='index',
+                       random_state=None,
+                       n_classes=6):
+    '''
+    confusion table of every experiment (experiments x true x predicted)
+
+    sizes is the number of reads drawn with replacement from every true
+    class in every experiment. The index method draws the same indices as
+    np.random.randint(len(class), size=size) per experiment and class, the
+    multinomial method only uses the confusion table of all the reads.
+    '''
+    if method not in METHODS:
+        raise ValueError('method should be one of '+', '.join(METHODS))
+    if random_state is None:
+        random_state = np.random
+    sizes = np.asarray(sizes, dtype=np.int64)
+
+    if method == 'multinomial':
+        table = confusion_table(predicted_per_class, n_classes)
+        frequencies = table/table.sum(axis=1, keepdims=True)
+        return np.stack([multinomial_counts(sizes[:, j], frequencies[j], random_state)
+                         for j in range(len(predicted_per_class))], axis=1)
+
+    confusion = np.zeros(sizes.shape+(n_classes,), dtype=np.int64)
+    for experiment in range(len(sizes)):
+        for j, predicted in enumerate(predicted_per_class):
+            sample = predicted[random_state.randint(len(predicted), size=sizes[experiment, j])]
+            confusion[experiment, j] = np.bincount(sample, minlength=n_classes)
+    return confusion
+
+
+def precision_recall(confusion, labels):
+    '''
+    precision and recall of every true class in every experiment
+    (experiments x true classes), labels is the output index of every true
+    class. Recall is the fraction of the reads of a class predicted as it,
+    precision the fraction of the reads predicted as a class, among all the
+    sampled classes, that belong to it.
+    '''
+    confusion = np.asarray(confusion, dtype=np.float64)
+    labels = np.asarray(labels)
+    rows = np.arange(len(labels))
+    correct = confusion[:, rows, labels]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        recall = correct/confusion.sum(axis=2)
+        precision = correct/confusion[:, :, labels].sum(axis=1)
+    return precision, recall
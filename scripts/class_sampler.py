@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Class-balanced sampling of training reads.
+
+Every class folder is streamed read by read and only a uniform reservoir
+sample of at most a per-class cap is kept in memory, so the size of the
+majority class (Human) no longer drives memory or training time. The
+training order then interleaves the classes so every chunk has the target
+class proportions, oversampling the classes with fewer reads.
+"""
+
+import math
+import os
+
+import numpy as np
+from Bio import SeqIO
+
+
+def stream_reads(directory, file_type):
+    '''
+    yield the reads of every file in a folder, one at a time
+    reads with non-standard nucleotides are skipped as in process_reads
+    '''
+    for file in sorted(os.listdir(directory)):
+        with open(directory+'/'+file) as handle:
+            for fasta in SeqIO.parse(handle, file_type):
+                sequence = str(fasta.seq).upper()
+                if all(c in 'AGCT' for c in sequence):
+                    yield sequence
+
+
+def reservoir_sample(reads, cap, random_state):
+    '''
+    uniform sample of at most cap reads from a stream of unknown length
+    (algorithm L, random numbers are only drawn when a read is kept)
+
+    returns the sampled reads and the number of reads in the stream
+    '''
+    reservoir = []
+    if cap is None:
+        reservoir = list(reads)
+        return reservoir, len(reservoir)
+    if cap <= 0:
+        return reservoir, sum(1 for _ in reads)
+
+    w = math.exp(math.log(random_state.random_sample())/cap)
+    next_index = cap + int(math.floor(math.log(random_state.random_sample())/math.log(1 - w)))
+    seen = 0
+    for read in reads:
+        if seen < cap:
+            reservoir.append(read)
+        elif seen == next_index:
+            reservoir[random_state.randint(cap)] = read
+            w *= math.exp(math.log(random_state.random_sample())/cap)
+            next_index += int(math.floor(math.log(random_state.random_sample())/math.log(1 - w))) + 1
+        seen += 1
+    return reservoir, seen
+
+
+def parse_class_weights(class_weights, class_names):
+    '''
+    parse "Human:1,Sars_cov_2:2" into a weight per class, missing classes get 1
+    '''
+    weights = dict.fromkeys(class_names, 1.0)
+    if class_weights:
+        for item in class_weights.split(','):
+            name, weight = item.split(':')
+            if name not in weights:
+                raise ValueError('Unknown class '+name+' in class weights, classes are '+', '.join(class_names))
+            weights[name] = float(weight)
+    return np.array([weights[i] for i in class_names])
+
+
+def class_caps(cap, weights):
+    '''
+    per-class cap, the class with the largest weight gets cap reads
+    '''
+    if cap is None:
+        return [None]*len(weights)
+    return [int(round(cap*i/weights.max())) for i in weights]
+
+
+def balanced_order(classes, weights, n_reads, random_state):
+    '''
+    order of the reads for one epoch of n_reads, with class proportions
+    following weights everywhere in the epoch
+
+    classes is the class index of every read. Each class is drawn without
+    replacement and cycled when it has fewer reads than its share, then the
+    classes are interleaved by their relative position in the epoch, so any
+    chunk of the order has the target proportions.
+    '''
+    classes = np.asarray(classes)
+    weights = np.asarray(weights, dtype=np.float64)
+    present = np.array([np.any(classes == i) for i in range(len(weights))])
+    shares = np.where(present, weights, 0)
+    shares = shares/shares.sum()
+    n_class = np.floor(shares*n_reads).astype(np.int64)
+    # give the reads left by the rounding to the largest remainders
+    remainder = n_reads - n_class.sum()
+    n_class[np.argsort(-(shares*n_reads - n_class), kind='stable')[:remainder]] += 1
+
+    indices = []
+    keys = []
+    for class_index, n in enumerate(n_class):
+        if n == 0:
+            continue
+        members = np.nonzero(classes == class_index)[0]
+        repeats = int(np.ceil(n/len(members)))
+        drawn = np.concatenate([random_state.permutation(members) for _ in range(repeats)])[:n]
+        indices.append(drawn)
+        keys.append((np.arange(n) + random_state.random_sample(n))/n)
+    indices = np.concatenate(indices)
+    return indices[np.argsort(np.concatenate(keys), kind='stable')]
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+ROC and precision-recall curves of every class over all thresholds.
+
+The thresholds are t = b/bins for b = 0..bins. A read predicted as class c
+with probability p is counted in bin b of class c, the number of
+thresholds strictly below p, as a positive when its true class is c and as
+a negative otherwise, so the reads above threshold b/bins (p > t, as in
+PACIFIC.py -T) are the sum of the bins > b. The thresholds are compared in
+the precision of the probabilities, so a float32 probability of 0.95 is
+not above -T 0.95 here either. The histograms of one pass over the (argmax, max)
+summaries of the predictions give every point of the curves at once, and
+since histograms of different chunks or files just add up, the curves of
+inputs larger than memory are built chunk by chunk and merged.
+
+Besides the histogram, every class keeps its number of positive and
+negative reads (whatever their prediction) for the recall and the false
+positive rate.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def empty_histogram(n_classes=6, bins=1000):
+    '''
+    histogram without reads: counts (class x negative/positive x bin) and
+    totals (class x negative/positive)
+    '''
+    return {'counts': np.zeros((n_classes, 2, bins + 1), dtype=np.int64),
+            'totals': np.zeros((n_classes, 2), dtype=np.int64)}
+
+
+def add_to_histogram(histogram, summary, true_label):
+    '''
+    add the reads of an (argmax, max) summary whose true class is
+    true_label (-1 for reads outside every class) to the histogram
+    '''
+    predicted, scores = summary
+    predicted = np.asarray(predicted, dtype=np.int64)
+    n_classes, _, n_bins = histogram['counts'].shape
+    scores = np.asarray(scores)
+    if not np.issubdtype(scores.dtype, np.floating):
+        scores = scores.astype(np.float64)
+    thresholds = (np.arange(n_bins)/(n_bins - 1)).astype(scores.dtype)
+    # number of thresholds strictly below every score
+    bins = np.minimum(np.searchsorted(thresholds, scores, side='left'), n_bins - 1)
+    positive = (predicted == true_label).astype(np.int64)
+    flat = (predicted*2 + positive)*n_bins + bins
+    histogram['counts'] += np.bincount(flat, minlength=n_classes*2*n_bins).reshape(n_classes, 2, n_bins)
+    histogram['totals'][:, 0] += len(predicted)
+    if 0 <= true_label < n_classes:
+        histogram['totals'][true_label, 0] -= len(predicted)
+        histogram['totals'][true_label, 1] += len(predicted)
+    return histogram
+
+
+def merge_histograms(histograms):
+    '''
+    histogram of the reads of several histograms
+    '''
+    histograms = list(histograms)
+    return {'counts': np.sum([i['counts'] for i in histograms], axis=0),
+            'totals': np.sum([i['totals'] for i in histograms], axis=0)}
+
+
+def save_histogram(path, histogram):
+    np.savez_compressed(path, counts=histogram['counts'], totals=histogram['totals'])
+
+
+def load_histogram(path):
+    with np.load(path) as handle:
+        return {'counts': handle['counts'], 'totals': handle['totals']}
+
+
+def class_curves(histogram, class_names):
+    '''
+    tidy table of the curves, one row per class and threshold with the
+    true and false positives above it, recall (TPR), FPR and precision
+    '''
+    counts = histogram['counts']
+    n_bins = counts.shape[2]
+    # reads strictly above every threshold, cumulated from the highest bin
+    above = np.zeros_like(counts)
+    above[:, :, :-1] = np.cumsum(counts[:, :, :0:-1], axis=2)[:, :, ::-1]
+    true_positives = above[:, 1]
+    false_positives = above[:, 0]
+    totals = histogram['totals'].astype(np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        recall = true_positives/totals[:, 1:]
+        fpr = false_positives/totals[:, :1]
+        precision = true_positives/(true_positives + false_positives)
+
+    n_classes = len(class_names)
+    return pd.DataFrame({'class': np.repeat(class_names, n_bins),
+                         'threshold': np.tile(np.arange(n_bins)/(n_bins - 1), n_classes),
+                         'true_positives': true_positives[:n_classes].ravel(),
+                         'false_positives': false_positives[:n_classes].ravel(),
+                         'recall': recall[:n_classes].ravel(),
+                         'FPR': fpr[:n_classes].ravel(),
+                         'precision': precision[:n_classes].ravel()
+                         })
+
+
+def area_under_curves(curves):
+    '''
+    area under the ROC and precision-recall curves of every class, the
+    curves end at threshold 0 with the reads predicted as the class
+    '''
+    areas = []
+    for name, curve in curves.groupby('class', sort=False):
+        # from the highest threshold (no reads) to the lowest
+        curve = curve.iloc[::-1]
+        fpr = np.concatenate(([0], curve['FPR'].values))
+        recall = np.concatenate(([0], curve['recall'].values))
+        precision = curve['precision'].fillna(1).values
+        areas.append({'class': name,
+                      'ROC_AUC': np.sum(np.diff(fpr)*(recall[1:] + recall[:-1])/2),
+                      'PR_AUC': np.sum(np.diff(recall)*precision)})
+    return pd.DataFrame(areas)
+
+
+def select_thresholds(curves, max_fpr=None, min_precision=None):
+    '''
+    lowest threshold of every class with FPR <= max_fpr and precision >=
+    min_precision, counting the reads strictly above it like PACIFIC.py,
+    so the maximum over the classes is the -T value that satisfies all of
+    them
+    '''
+    selected = []
+    for name, curve in curves.groupby('class', sort=False):
+        valid = np.ones(len(curve), dtype=bool)
+        if max_fpr is not None:
+            valid &= (curve['FPR'] <= max_fpr).values
+        if min_precision is not None:
+            valid &= (curve['precision'].fillna(1) >= min_precision).values
+        # every threshold above a valid one is kept only if it stays valid
+        valid = np.cumprod(valid[::-1])[::-1].astype(bool)
+        if valid.any():
+            row = curve[valid].iloc[0]
+        else:
+            row = curve.iloc[-1]
+        selected.append(row)
+    return pd.DataFrame(selected).reset_index(drop=True)
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Analytic false positive rates and limits of detection.
+
+limit_detection.py resamples 100000 reads 1000 times from the reads of the
+other classes and takes the largest percentage of false positives (reads
+predicted as the class above the threshold, over the reads predicted as
+another class above it) as the limit of detection. With the category
+counts of threshold_categories (bootstrap.py) the same numbers follow
+from the binomial distribution: in a sample of depth reads the false
+positives are Binomial(depth, rate), so their quantile gives the limit
+directly for any depth and confidence level. Rates are taken at their
+exact (Clopper-Pearson) upper bound so the limits stay conservative when
+few false positives were measured. Poisson quantiles are a close
+approximation for small rates.
+
+The minimum spike-in fraction detected with a given power follows the
+same way from the rate of reads of the virus itself called above the
+threshold.
+"""
+
+import numpy as np
+from scipy import stats
+
+
+DISTRIBUTIONS = ('binomial', 'poisson')
+
+
+def clopper_pearson(k, n, confidence=0.95):
+    '''
+    exact two-sided confidence interval of a binomial proportion k/n
+    '''
+    k = np.asarray(k, dtype=np.float64)
+    n = np.asarray(n, dtype=np.float64)
+    alpha = 1 - confidence
+    with np.errstate(divide='ignore', invalid='ignore'):
+        lower = np.where(k > 0, stats.beta.ppf(alpha/2, k, n - k + 1), 0.0)
+        upper = np.where(k < n, stats.beta.ppf(1 - alpha/2, k + 1, n - k), 1.0)
+    return lower, upper
+
+
+def count_quantile(rate, depth, quantile, distribution='binomial'):
+    '''
+    quantile of the number of reads with probability rate in depth reads
+    '''
+    if distribution not in DISTRIBUTIONS:
+        raise ValueError('distribution should be one of '+', '.join(DISTRIBUTIONS))
+    if distribution == 'poisson':
+        return stats.poisson.ppf(quantile, np.asarray(depth)*rate)
+    return stats.binom.ppf(quantile, depth, rate)
+
+
+def false_positive_rates(counts, confidence=0.95):
+    '''
+    false positive rate of a class from its category counts (below the
+    threshold, false positives, other classes) with its exact interval,
+    and the rate of reads predicted as other classes above the threshold
+    '''
+    counts = np.asarray(counts, dtype=np.int64)
+    total = counts.sum(axis=-1)
+    lower, upper = clopper_pearson(counts[..., 1], total, confidence)
+    return {'rate': counts[..., 1]/total,
+            'lower': lower,
+            'upper': upper,
+            'other_rate': counts[..., 2]/total}
+
+
+def detection_limit(counts,
+                    depth,
+                    quantile=0.999,
+                    confidence=0.95,
+                    distribution='binomial',
+                    conservative=True):
+    '''
+    limit of detection of a class in samples of depth reads
+
+    critical_reads is the quantile of the false positives: more reads
+    predicted as the class above the threshold are not explained by false
+    positives. limit is the same number as a percentage of the reads
+    predicted as other classes above the threshold, the statistic of
+    limit_detection.py, and limit_fraction as a percentage of all reads.
+    With conservative the upper bound of the rate at confidence is used.
+    '''
+    rates = false_positive_rates(counts, confidence)
+    rate = rates['upper'] if conservative else rates['rate']
+    critical = count_quantile(rate, depth, quantile, distribution)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        limit = 100*critical/(np.asarray(depth)*rates['other_rate'])
+    rates.update({'depth': depth,
+                  'quantile': quantile,
+                  'critical_reads': critical,
+                  'limit': limit,
+                  'limit_fraction': 100*critical/np.asarray(depth, dtype=np.float64)})
+    return rates
+
+
+def detection_probability(false_positive_rate, sensitivity, fraction, depth, critical, distribution='binomial'):
+    '''
+    probability that a sample of depth reads with a fraction of virus reads,
+    called above the threshold with probability sensitivity, has more than
+    critical reads predicted as the virus
+    '''
+    rate = np.asarray(fraction)*sensitivity + (1 - np.asarray(fraction))*false_positive_rate
+    if distribution == 'poisson':
+        return stats.poisson.sf(critical, np.asarray(depth)*rate)
+    return stats.binom.sf(critical, depth, rate)
+
+
+def minimum_fraction(false_positive_rate, sensitivity, depth, critical, power=0.95, distribution='binomial', iterations=60):
+    '''
+    smallest fraction of virus reads detected with probability power,
+    bisection in log scale between 1e-9 and 1
+    '''
+    low = np.full(np.broadcast(false_positive_rate, sensitivity, depth, critical).shape, -9.0)
+    high = np.zeros_like(low)
+    for _ in range(iterations):
+        middle = (low + high)/2
+        detected = detection_probability(false_positive_rate, sensitivity, 10**middle, depth, critical, distribution) >= power
+        high = np.where(detected, middle, high)
+        low = np.where(detected, low, middle)
+    return 10**high
@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Evaluation of a PACIFIC model from a JSON config file.
+
+Every dataset of the config is predicted once (through the prediction
+cache of prediction_cache.py) and reduced to the predicted class and its
+probability of every read. From these shared summaries a single run
+computes the benchmarks of precision_recall.py, limit_detection.py and
+human_virus_in_silico_mix.py, writing their CSV files and plots to
+out_folder:
+
+    precision_recall: precision and recall of random experiments
+    false_positives:  bootstrap of the false positive rate of every class
+                      over the reads of the other datasets, and its limit
+                      of detection (quantile of the bootstrap), with the
+                      analytic limits for any depth (bootstrap: false to
+                      skip the simulation)
+    mixtures:         spike-in of every virus in a background dataset
+    curves:           ROC and precision-recall curves of every class over
+                      all thresholds and the lowest threshold meeting a
+                      maximum FPR or minimum precision (PACIFIC.py -T)
+
+Sections missing from the config are skipped. Dataset names are the class
+names of the label maker, other datasets (e.g. rest_virus) only count as
+reads outside every class. See evaluation_config.json for an example.
+"""
+
+import argparse
+
+parser = argparse.ArgumentParser(description=
+                                 """
+                                 This script evaluates a PACIFIC model: precision, recall,
+                                 false positive rates, limits of detection and spike-in mixtures,
+                                 predicting every dataset of the config file only once.
+                                 """)
+
+OPTIONAL = parser._action_groups.pop()
+REQUIRED = parser.add_argument_group('required arguments')
+
+#Inputs
+REQUIRED.add_argument("-c", "--config",
+                      help="JSON file with the model, datasets and benchmarks to run",
+                      required=True)
+
+#arguments
+OPTIONAL.add_argument("-o", "--out_folder",
+                      help='path to the output folder, overrides out_folder of the config',
+                      default=None)
+
+parser._action_groups.append(OPTIONAL)
+
+ARGS = parser.parse_args()
+
+import json
+
+with open(ARGS.config) as handle:
+    CONFIG = json.load(handle)
+
+# Inputs
+MODEL = CONFIG['model']
+TOKENIZER = CONFIG['tokenizer']
+LABEL_MAKER = CONFIG['label_maker']
+DATASETS = CONFIG['datasets']
+
+# Arguments
+OUT_FOLDER = ARGS.out_folder if ARGS.out_folder is not None else CONFIG.get('out_folder', './')
+CACHE_DIR = CONFIG.get('cache_dir', OUT_FOLDER+'/prediction_cache')
+PREFIX = CONFIG.get('prefix', 'pacific')
+READ_LENGTH = CONFIG.get('read_length', 150)
+FILE_TYPE = CONFIG.get('file_type', 'fastq')
+THRESHOLD = CONFIG.get('threshold', 0.95)
+METHOD = CONFIG.get('method', 'index')
+SEED = CONFIG.get('seed', 42)
+PROCESSES = CONFIG.get('processes', 1)
+
+
+import os
+import pickle
+import random
+
+import numpy as np
+import pandas as pd
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import seaborn as sns
+
+from prediction_cache import cached_predict
+from bootstrap import summarize_predictions, concatenate_summaries, threshold_categories, category_counts
+from bootstrap import bootstrap_proportions, experiment_sizes, resample_confusion, precision_recall
+from mixture import simulate_mixtures
+from detection import detection_limit, minimum_fraction
+from curves import empty_histogram, add_to_histogram, save_histogram
+from curves import class_curves, area_under_curves, select_thresholds
+
+
+def output_path(name):
+    return OUT_FOLDER+'/'+PREFIX+'_'+name
+
+
+def save_plot(name):
+    plt.savefig(output_path(name),
+                format='pdf',
+                dpi=1200,
+                bbox_inches='tight', pad_inches=0)
+    plt.close()
+
+
+def boxplot(df, column, title, ylabel, name):
+    '''
+    boxplot per class of one metric, as the evaluation scripts
+    '''
+    f, ax = plt.subplots(figsize=(13,9))
+    b = sns.boxplot(x='virus', y=column, data=df)
+    b.axes.set_title(title, fontsize = 25)
+    b.tick_params(axis='y', labelsize=25)
+    b.tick_params(axis='x', labelsize=25, rotation=45)
+    b.set_ylabel(ylabel, fontsize=25)
+    save_plot(name)
+
+
+def load_summaries(datasets):
+    '''
+    predict every dataset once, returns the (argmax, max) summary per dataset
+    '''
+    summaries = {}
+    for name, dataset in datasets.items():
+        predictions = cached_predict(dataset['path'],
+                                     MODEL,
+                                     TOKENIZER,
+                                     dataset.get('number_reads', 500000),
+                                     CACHE_DIR,
+                                     READ_LENGTH,
+                                     dataset.get('file_type', FILE_TYPE))
+        summaries[name] = summarize_predictions(predictions)
+        print('Loaded '+str(len(predictions))+' '+name+' reads')
+    return summaries
+
+
+def run_precision_recall(settings, summaries, class_labels):
+    '''
+    precision and recall of random experiments drawing up to max_size reads
+    of every class, as precision_recall.py
+    '''
+    classes = settings.get('classes', [i for i in summaries if i in class_labels])
+    experiments = settings.get('experiments', 100)
+    max_size = settings.get('max_size', 500000)
+
+    sizes = experiment_sizes(experiments, len(classes), max_size, random)
+    confusion = resample_confusion([summaries[i][0] for i in classes],
+                                   sizes,
+                                   METHOD,
+                                   np.random,
+                                   len(class_labels))
+    precision, recall = precision_recall(confusion, [class_labels[i] for i in classes])
+
+    virus = np.repeat(classes, experiments)
+    df_precision = pd.DataFrame({'precision': precision.T.ravel(), 'virus': virus})
+    df_recall = pd.DataFrame({'recall': recall.T.ravel(), 'virus': virus})
+    df_precision.to_csv(output_path('precision.csv'))
+    df_recall.to_csv(output_path('recall.csv'))
+
+    boxplot(df_precision, 'precision', 'Precision per class', 'Precision', 'precision.pdf')
+    boxplot(df_recall, 'recall', 'Recall per class', 'Recall', 'recall.pdf')
+
+
+def run_false_positives(settings, summaries, class_labels):
+    '''
+    bootstrap of the false positive rate of every class over the reads of
+    the other datasets and its limit of detection, as limit_detection.py,
+    and the analytic limits of detection.py for every depth
+    '''
+    classes = settings.get('classes', [i for i in summaries if i in class_labels and i != 'Human'])
+    iterations = settings.get('iterations', 1000)
+    sample_size = settings.get('sample_size', 100000)
+    population = settings.get('population', None)
+    quantile = settings.get('quantile', 1.0)
+    depths = settings.get('depths', [sample_size])
+    analytic_quantile = settings.get('analytic_quantile', 0.999)
+    confidence = settings.get('confidence', 0.95)
+    distribution = settings.get('distribution', 'binomial')
+    power = settings.get('power', 0.95)
+
+    distributions = []
+    limits = []
+    analytic = []
+    for name in classes:
+        label = class_labels[name]
+        outside = concatenate_summaries([summaries[i] for i in summaries if i != name])
+
+        if settings.get('plot_distributions', False):
+            predicted, scores = summaries[name]
+            true_positives = scores[predicted == label]
+            predicted, scores = outside
+            false_positives = scores[predicted == label]
+            f, ax = plt.subplots(figsize=(13,9))
+            plt.title('True positives vs false positives '+name)
+            sns.distplot(true_positives, kde=False, bins=50, label='True positives')
+            sns.distplot(false_positives, kde=False, bins=50, label='false positives')
+            plt.xlabel('Predicted probabilities')
+            plt.legend()
+            plt.ylim(0, 100)
+            plt.xlim(0.3, 1)
+            save_plot('FPR_'+name+'_distributions.pdf')
+
+        categories = threshold_categories(outside, label, THRESHOLD)
+        own = threshold_categories(summaries[name], label, THRESHOLD)
+        sensitivity = np.mean(own == 1)
+        for depth in depths:
+            limit = detection_limit(category_counts(categories),
+                                    depth,
+                                    quantile=analytic_quantile,
+                                    confidence=confidence,
+                                    distribution=distribution)
+            analytic.append({'virus': name,
+                             'threshold': THRESHOLD,
+                             'depth': depth,
+                             'quantile': analytic_quantile,
+                             'confidence': confidence,
+                             'FPR': limit['rate'],
+                             'FPR_lower': limit['lower'],
+                             'FPR_upper': limit['upper'],
+                             'critical_reads': limit['critical_reads'],
+                             'limit_of_detection': limit['limit'],
+                             'limit_fraction': limit['limit_fraction'],
+                             'sensitivity': sensitivity,
+                             'minimum_fraction': 100*minimum_fraction(limit['upper'],
+                                                                      sensitivity,
+                                                                      depth,
+                                                                      limit['critical_reads'],
+                                                                      power,
+                                                                      distribution)})
+
+        if settings.get('bootstrap', True) is False:
+            continue
+        proportions = bootstrap_proportions(categories,
+                                            iterations,
+                                            sample_size,
+                                            population=population,
+                                            method=METHOD,
+                                            processes=PROCESSES)
+        distributions.append(pd.DataFrame({'virus': name, 'FPR': proportions}))
+        limits.append({'virus': name,
+                       'threshold': THRESHOLD,
+                       'iterations': iterations,
+                       'sample_size': sample_size,
+                       'quantile': quantile,
+                       'limit_of_detection': np.quantile(proportions, quantile)})
+
+    pd.DataFrame(analytic).to_csv(output_path('analytic_limits_of_detection.csv'), index=False)
+    print(pd.DataFrame(analytic))
+    if len(distributions) == 0:
+        return
+
+    df_proportions = pd.concat(distributions, ignore_index=True)
+    df_proportions.to_csv(output_path('FPR_'+str(THRESHOLD)+'_distributions.csv'))
+    pd.DataFrame(limits).to_csv(output_path('limits_of_detection.csv'), index=False)
+    print(pd.DataFrame(limits))
+
+    f, ax = plt.subplots(figsize=(13,9))
+    sns.boxplot(x='virus', y='FPR', data=df_proportions)
+    b = sns.swarmplot(x='virus', y='FPR', data=df_proportions, color=".25")
+    b.axes.set_title('False positive rates for '+str(iterations)+' experiments', fontsize = 25)
+    b.tick_params(axis='y', labelsize=25)
+    b.tick_params(axis='x', labelsize=25, rotation=45)
+    b.set_ylabel("False positive rate",fontsize=25)
+    save_plot('FPR_'+str(THRESHOLD)+'_distributions_boxplots.pdf')
+
+
+def run_mixtures(settings, summaries, class_labels):
+    '''
+    spike-in of every virus in the background dataset, as
+    human_virus_in_silico_mix.py
+    '''
+    background = settings.get('background', 'Human')
+    viruses = settings.get('viruses', [i for i in summaries if i in class_labels and i != background])
+    reported = settings.get('classes', viruses)
+    pool_reads = settings.get('pool_reads', None)
+    percentages = settings.get('percentages', [10, 5, 2.5, 1, 0.5, 0.1, 0.03])
+    depths = settings.get('depths', [len(summaries[background][0])])
+
+    pools = {background: summaries[background]}
+    for virus in viruses:
+        pools[virus] = tuple(i[:pool_reads] for i in summaries[virus])
+
+    mixtures = simulate_mixtures(pools,
+                                 background,
+                                 {i: class_labels[i] for i in reported},
+                                 percentages,
+                                 depths,
+                                 replicates=settings.get('replicates', 1),
+                                 threshold=THRESHOLD,
+                                 method=METHOD,
+                                 random_state=np.random,
+                                 n_classes=len(class_labels))
+    mixtures.to_csv(output_path('mixtures.csv'), index=False)
+
+    for virus in viruses:
+        for depth in depths:
+            df_virus = mixtures[(mixtures['virus'] == virus) & (mixtures['depth'] == depth)]
+            f, ax = plt.subplots(figsize=(13,9))
+            plt.title(virus+' + '+background+' different proportions, '+str(depth)+' reads')
+            for name in reported:
+                df_class = df_virus[df_virus['class'] == name].groupby('percentage')['proportion'].mean()
+                sns.lineplot(df_class.index.values, df_class.values, label=name)
+            plt.xticks(sorted(percentages))
+            plt.yticks(sorted(percentages))
+            save_plot('mixture_proportions_'+virus+'_'+str(depth)+'.pdf')
+
+            df_temp = df_virus.pivot_table(index='class', columns='percentage', values='proportion', aggfunc='mean')
+            df_temp = df_temp.loc[reported, sorted(percentages, reverse=True)]
+            df_temp.columns = ['{:g}%'.format(i) for i in df_temp.columns]
+            plt.figure(figsize=(13,9))
+            ax = sns.heatmap(df_temp,
+                             annot=True,
+                             cmap = sns.color_palette("Blues"))
+            ax.tick_params(labelsize=25)
+            ax.axes.set_title('Percentage of '+virus+' in the sample', fontsize = 25)
+            for text in ax.texts:
+                text.set_size(18)
+            save_plot('mixture_heatmap_'+virus+'_'+str(depth)+'.pdf')
+
+
+def run_curves(settings, summaries, class_labels):
+    '''
+    ROC and precision-recall curves of every class from one histogram of
+    all the datasets, and the thresholds meeting the targets
+    '''
+    class_names = list(class_labels)
+    histogram = empty_histogram(len(class_names), settings.get('bins', 1000))
+    for name, summary in summaries.items():
+        add_to_histogram(histogram, summary, class_labels.get(name, -1))
+    save_histogram(output_path('histogram.npz'), histogram)
+
+    curves = class_curves(histogram, class_names)
+    curves.to_csv(output_path('curves.csv'), index=False)
+    areas = area_under_curves(curves)
+    areas.to_csv(output_path('curves_AUC.csv'), index=False)
+    print(areas)
+
+    thresholds = select_thresholds(curves,
+                                   max_fpr=settings.get('max_fpr', None),
+                                   min_precision=settings.get('min_precision', None))
+    thresholds.to_csv(output_path('thresholds.csv'), index=False)
+    print(thresholds)
+    print('Threshold meeting the targets for every class: PACIFIC.py -T '+str(thresholds['threshold'].max()))
+
+    for x, y, name in (('FPR', 'recall', 'ROC'), ('recall', 'precision', 'PR')):
+        f, ax = plt.subplots(figsize=(13,9))
+        for class_name, curve in curves.groupby('class', sort=False):
+            plt.plot(curve[x], curve[y], label=class_name)
+        plt.xlabel(x)
+        plt.ylabel(y)
+        plt.legend()
+        plt.title(name+' curves per class')
+        save_plot(name+'_curves.pdf')
+
+
+if __name__ == '__main__':
+
+    seed_value = SEED
+    random.seed(seed_value)
+    np.random.seed(seed_value)
+
+    if os.path.isdir(OUT_FOLDER) is False:
+        os.makedirs(OUT_FOLDER)
+
+    with open(LABEL_MAKER, 'rb') as handle:
+        label_maker = pickle.load(handle)
+    class_labels = {name: i for i, name in enumerate(label_maker.classes_)}
+
+    sns.set()
+    summaries = load_summaries(DATASETS)
+
+    if 'precision_recall' in CONFIG:
+        print('Precision and recall')
+        run_precision_recall(CONFIG['precision_recall'], summaries, class_labels)
+
+    if 'false_positives' in CONFIG:
+        print('False positive rates and limits of detection')
+        run_false_positives(CONFIG['false_positives'], summaries, class_labels)
+
+    if 'mixtures' in CONFIG:
+        print('Spike-in mixtures')
+        run_mixtures(CONFIG['mixtures'], summaries, class_labels)
+
+    if 'curves' in CONFIG:
+        print('ROC and precision-recall curves')
+        run_curves(CONFIG['curves'], summaries, class_labels)
+
+    print('Results written to '+OUT_FOLDER)
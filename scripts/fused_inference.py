@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Inference with the embedding and the first convolution fused in a table.
+
+In every PACIFIC architecture the k-mer Embedding (with Dropout, the
+identity at inference) feeds a Conv1D with 'same' padding, so the
+convolution output at position i is
+
+    relu(bias + sum over taps t of embedding[token[i + t*dilation - pad]] . kernel[t])
+
+and the product of every embedding row with every kernel tap is a table
+of (taps x vocabulary x filters). The fused path gathers one row of the
+table per tap and position instead of the embedding lookup and the
+convolution matmul, then runs the rest of the model (pooling, LSTM, dense
+layers) with Keras.
+
+The table is stored next to the model in <model>.fused.h5 (group
+pacific_fused, float32 or float16) as contiguous datasets, so PACIFIC.py
+memory-maps it instead of loading it. The model file is left untouched,
+so its SHA-256 (the key of the prediction cache and of mergeable
+summaries) does not change. The table keeps the SHA-256 of its model and
+is ignored when the model changed. Models without a stored table get it
+computed in memory.
+
+Store the table of a model and compare the fused path with Keras:
+
+    python fused_inference.py -m model.h5 -t tokenizer.pickle -i reads.fastq -f fastq --store --float16
+"""
+
+import os
+
+import h5py
+import numpy as np
+
+from prediction_cache import file_hash
+
+
+FUSED_GROUP = 'pacific_fused'
+
+
+def first_convolution(model):
+    '''
+    index of the embedding and of the Conv1D it feeds, only Dropout layers
+    can be in between
+    '''
+    from keras.layers import Embedding, Conv1D, Dropout
+
+    layers = model.layers
+    if not isinstance(layers[0], Embedding):
+        raise ValueError('The first layer of the model is not an Embedding')
+    index = 1
+    while isinstance(layers[index], Dropout):
+        index += 1
+    conv = layers[index]
+    if not isinstance(conv, Conv1D) or conv.padding != 'same' or conv.strides[0] != 1:
+        raise ValueError('The embedding does not feed a Conv1D with same padding and stride 1')
+    return 0, index
+
+
+def fused_table(model, dtype=np.float32):
+    '''
+    table (taps x vocabulary x filters), bias, kernel size, dilation rate
+    and activation name of the first convolution of a model
+    '''
+    embedding_index, conv_index = first_convolution(model)
+    embedding = model.layers[embedding_index].get_weights()[0]
+    conv = model.layers[conv_index]
+    kernel, bias = conv.get_weights()
+    table = np.einsum('vd,tdf->tvf', embedding, kernel).astype(dtype)
+    return {'table': table,
+            'bias': bias.astype(np.float32),
+            'kernel_size': conv.kernel_size[0],
+            'dilation_rate': conv.dilation_rate[0],
+            'activation': conv.activation.__name__}
+
+
+def fused_path(model_file):
+    '''
+    file of the table of a model
+    '''
+    return os.path.splitext(model_file)[0]+'.fused.h5'
+
+
+def store_fused_table(model_file, fused):
+    '''
+    write the table of a model in its .fused.h5 file as contiguous datasets
+    '''
+    with h5py.File(fused_path(model_file), 'w') as handle:
+        group = handle.create_group(FUSED_GROUP)
+        group.create_dataset('table', data=fused['table'])
+        group.create_dataset('bias', data=fused['bias'])
+        for key in ('kernel_size', 'dilation_rate', 'activation'):
+            group.attrs[key] = fused[key]
+        group.attrs['model_sha256'] = file_hash(model_file)
+
+
+def load_fused_table(model_file):
+    '''
+    table stored for a model, memory-mapped when possible, None when the
+    model has no stored table or the table was stored for another version
+    of the model file
+    '''
+    path = fused_path(model_file)
+    if os.path.isfile(path) is False:
+        return None
+    with h5py.File(path, 'r') as handle:
+        group = handle[FUSED_GROUP]
+        model_sha256 = group.attrs.get('model_sha256')
+        if isinstance(model_sha256, bytes):
+            model_sha256 = model_sha256.decode()
+        if model_sha256 != file_hash(model_file):
+            print(path+' was stored for another version of '+model_file+', computing the table')
+            return None
+        dataset = group['table']
+        offset = dataset.id.get_offset()
+        if offset is None:
+            table = dataset[()]
+        else:
+            table = np.memmap(path, dtype=dataset.dtype, mode='r', offset=offset, shape=dataset.shape)
+        fused = {'table': table, 'bias': group['bias'][()]}
+        for key in ('kernel_size', 'dilation_rate', 'activation'):
+            value = group.attrs[key]
+            fused[key] = value.decode() if isinstance(value, bytes) else value
+    fused['kernel_size'] = int(fused['kernel_size'])
+    fused['dilation_rate'] = int(fused['dilation_rate'])
+    return fused
+
+
+def fused_convolution(tokens, fused):
+    '''
+    output of the embedding and first convolution for a batch of token ids
+    '''
+    tokens = np.asarray(tokens)
+    table = fused['table']
+    n_reads, length = tokens.shape
+    kernel_size = fused['kernel_size']
+    dilation_rate = fused['dilation_rate']
+    pad = dilation_rate*(kernel_size - 1)//2
+
+    output = np.empty((n_reads, length, table.shape[2]), dtype=np.float32)
+    output[:] = fused['bias']
+    for tap in range(kernel_size):
+        shift = tap*dilation_rate - pad
+        start = max(0, -shift)
+        end = min(length, length - shift)
+        if end <= start:
+            continue
+        output[:, start:end] += table[tap][tokens[:, start+shift:end+shift]]
+    if fused['activation'] == 'relu':
+        np.maximum(output, 0, out=output)
+    elif fused['activation'] != 'linear':
+        raise ValueError('Unsupported activation of the first convolution: '+fused['activation'])
+    return output
+
+
+def tail_model(model):
+    '''
+    Keras model of the layers after the first convolution
+    '''
+    from keras.layers import Input
+    from keras.models import Model
+
+    _, conv_index = first_convolution(model)
+    inputs = Input(shape=model.layers[conv_index].output_shape[1:])
+    x = inputs
+    for layer in model.layers[conv_index+1:]:
+        x = layer(x)
+    return Model(inputs, x)
+
+
+def fused_predict(tail, tokens, fused, batch_size=1024):
+    '''
+    predictions of the model for token ids through the fused table
+    '''
+    predictions = []
+    for start in range(0, len(tokens), batch_size):
+        activations = fused_convolution(tokens[start:start+batch_size], fused)
+        predictions.append(tail.predict(activations, batch_size=batch_size))
+    if len(predictions) == 0:
+        return np.zeros((0, tail.output_shape[-1]), dtype=np.float32)
+    return np.concatenate(predictions)
+
+
+def load_fused(model, model_file):
+    '''
+    tail model and table of a model, the table is read from the .fused.h5
+    file of model_file when it is stored and computed otherwise
+    '''
+    fused = load_fused_table(model_file)
+    if fused is None:
+        fused = fused_table(model)
+    return tail_model(model), fused
+
+
+def benchmark_fused(model, tail, fused, tokens, batch_size=1024, repeats=3):
+    '''
+    reads/sec of the Keras and fused paths (best of repeats) and their
+    agreement on tokens
+    '''
+    import time
+
+    model.predict(tokens[:batch_size], batch_size=batch_size)
+    fused_predict(tail, tokens[:batch_size], fused, batch_size)
+    keras_time = None
+    fused_time = None
+    for _ in range(repeats):
+        start = time.time()
+        keras_predictions = model.predict(tokens, batch_size=batch_size)
+        elapsed = time.time() - start
+        keras_time = elapsed if keras_time is None else min(keras_time, elapsed)
+        start = time.time()
+        fused_predictions = fused_predict(tail, tokens, fused, batch_size)
+        elapsed = time.time() - start
+        fused_time = elapsed if fused_time is None else min(fused_time, elapsed)
+    return {'reads': len(tokens),
+            'keras_reads_per_second': len(tokens)/keras_time,
+            'fused_reads_per_second': len(tokens)/fused_time,
+            'speedup': keras_time/fused_time,
+            'max_abs_difference': float(np.max(np.abs(keras_predictions - fused_predictions))),
+            'argmax_agreement': float(np.mean(np.argmax(keras_predictions, axis=1) ==
+                                              np.argmax(fused_predictions, axis=1)))}
+
+
+if __name__ == '__main__':
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description=
+                                     """
+                                     This script computes the fused embedding and convolution table
+                                     of a PACIFIC model, optionally stores it next to the model file, and
+                                     compares the fused inference with Keras.
+                                     """)
+
+    OPTIONAL = parser._action_groups.pop()
+    REQUIRED = parser.add_argument_group('required arguments')
+
+    #Inputs
+    REQUIRED.add_argument("-m", "--model",
+                          help="PACIFIC model file path",
+                          required=True)
+
+    #arguments
+    OPTIONAL.add_argument("-t", "--tokenizer",
+                          help='Tokenizer file path (required with --input_file)',
+                          default=None)
+
+    OPTIONAL.add_argument("-i", "--input_file",
+                          help='FASTA/FASTQ reads used for the benchmark',
+                          default=None)
+
+    OPTIONAL.add_argument("-f", "--file_type",
+                          help='FASTA or FASTQ file format [fasta]',
+                          default='fasta')
+
+    OPTIONAL.add_argument("--number_reads",
+                          help='Number of reads of the benchmark',
+                          default=20000,
+                          type=int)
+
+    OPTIONAL.add_argument("--batch_size",
+                          help='Batch size of both paths',
+                          default=1024,
+                          type=int)
+
+    OPTIONAL.add_argument("--store",
+                          help='Store the table in <model>.fused.h5 next to the model file',
+                          default=False,
+                          action='store_true')
+
+    OPTIONAL.add_argument("--float16",
+                          help='Store the table as float16 (half the size)',
+                          default=False,
+                          action='store_true')
+
+    parser._action_groups.append(OPTIONAL)
+
+    ARGS = parser.parse_args()
+    if ARGS.input_file is not None and ARGS.tokenizer is None:
+        parser.error('--tokenizer is required with --input_file')
+
+    import pickle
+    from keras.models import load_model
+    from pacific_models import load_metadata
+    from prediction_cache import read_sequences
+    from kmer_vocabulary import encode_reads, tokenize_reads, tokenizer_table
+
+    model = load_model(ARGS.model)
+    fused = fused_table(model, np.float16 if ARGS.float16 else np.float32)
+    print('Fused table '+str(fused['table'].shape)+' '+str(fused['table'].dtype)+', '+
+          str(round(fused['table'].nbytes/1e6, 1))+' MB')
+    if ARGS.store is True:
+        store_fused_table(ARGS.model, fused)
+        fused = load_fused_table(ARGS.model)
+        print('Stored in '+fused_path(ARGS.model))
+
+    if ARGS.input_file is not None:
+        metadata = load_metadata(ARGS.model)
+        k = metadata.get('k_mers', 9)
+        with open(ARGS.tokenizer, 'rb') as handle:
+            tokenizer = pickle.load(handle)
+        reads = read_sequences(ARGS.input_file, ARGS.number_reads, 150, ARGS.file_type)
+        tokens = tokenize_reads(encode_reads(reads, 150),
+                                tokenizer_table(tokenizer, k),
+                                k,
+                                metadata.get('canonical', False))
+        results = benchmark_fused(model, tail_model(model), fused, tokens, ARGS.batch_size)
+        for key, value in results.items():
+            print(key+': '+str(value))
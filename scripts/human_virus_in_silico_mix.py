@@ -6,84 +6,65 @@ Created on Wed Apr 29 10:14:18 2020
 @author: labuser
 """
 
+import argparse
+
+parser = argparse.ArgumentParser(description=
+                                 """
+                                 This script simulates human/virus spike-in mixtures from the
+                                 predictions of the class pools and plots the proportions reported
+                                 by PACIFIC for every spiked virus.
+                                 """)
+
+OPTIONAL = parser._action_groups.pop()
+
+#arguments
+OPTIONAL.add_argument("--percentages",
+                      help='Comma separated spike-in percentages of the human reads [10,5,2.5,1,0.5,0.1,0.03]',
+                      default='10,5,2.5,1,0.5,0.1,0.03')
+
+OPTIONAL.add_argument("--depths",
+                      help='Comma separated numbers of human reads of the mixtures [reads of the human pool]',
+                      default=None)
+
+OPTIONAL.add_argument("--replicates",
+                      help='Mixtures simulated per virus, percentage and depth, the plots show their mean [1]',
+                      default=1,
+                      type=int)
+
+OPTIONAL.add_argument("--method",
+                      help='index or multinomial sampling of the reads of the pools [index]',
+                      default='index',
+                      choices=['index', 'multinomial'])
+
+parser._action_groups.append(OPTIONAL)
+
+ARGS = parser.parse_args()
+
+PERCENTAGES = [float(i) for i in ARGS.percentages.split(',')]
+DEPTHS = [int(i) for i in ARGS.depths.split(',')] if ARGS.depths is not None else None
+REPLICATES = ARGS.replicates
+METHOD = ARGS.method
+
 
-from Bio import SeqIO
 import random
-import os
 
 import numpy as np
-import pandas as pd
 from scipy import stats
 
-from keras.preprocessing.sequence import pad_sequences
 import tensorflow as tf
 
 from numpy.random import seed
 from tensorflow import set_random_seed
 import pickle
 
-from keras.models import load_model
 import matplotlib.pyplot as plt
 import seaborn as sns
 sns.set_style('dark')   
 sns.set()
-##### Functions to test with real illumina reads
-
-def prepare_read_illumina(trancriptome, file_type):
-    '''
-    function will take tranciprtome and make reads
-    '''
-    fasta_sequences = SeqIO.parse(open(trancriptome),file_type)
-    sequences = []
-    names = []
-    for fasta in fasta_sequences:
-        name, sequence = fasta.id, str(fasta.seq)
-        sequences.append(sequence)
-        names.append(name)
-    return sequences
-
-
-def process_reads_illumina(sequences, number_reads, length, kmer):
-    '''
-    '''
-    r_reads = []
-    for i in enumerate(sequences):
-        if len(i[1]) >= length and 'N' not in i[1]:
-            read = i[1][:length]
-            r_reads.append(' '.join(read[x:x+kmer].upper() for x in range(len(read) - kmer + 1)))
-            if len(r_reads) == number_reads:
-                break
-    return r_reads
-
-
-def main_illumina(file, number_reads, size_lenght, k_mer_size, file_type):
-    '''
-    '''
-    all_transcripts = prepare_read_illumina(file, file_type)
-    reads = process_reads_illumina(all_transcripts, 
-                                   number_reads, 
-                                   size_lenght,
-                                   k_mer_size)
-    return reads 
-
-
-def percentile_proportion(virus_class, predictions, threshold):
-    '''
-    '''
-    label = np.argmax(label_maker.transform([virus_class]))
-    false_positives = 0
-    Total = 0
-    for i in enumerate(predictions):
-        if np.max(i[1]) >= threshold:
-            if  np.argmax(i[1]) == label: # if True Negative
-                false_positives += 1
-            else:
-                Total +=1
-    
-   
-    return (100/Total)*false_positives
-
 
+from prediction_cache import cached_predict
+from bootstrap import summarize_predictions
+from mixture import simulate_mixtures
 
 
 if __name__ == '__main__':
@@ -97,11 +78,11 @@ if __name__ == '__main__':
     config.gpu_options.allow_growth = True
     sess = tf.Session(config=config)
     
-    model = load_model('/media/labuser/Data/COVID-19_classifier/pacific/model/pacific.pacific_9mers.01.h5')
-    
-    # Keras loading sequences tokenizer 
-    with open('/media/labuser/Data/COVID-19_classifier/pacific/model/tokenizer.01.pacific_9mers.pickle', 'rb') as handle:
-        tokenizer = pickle.load(handle)
+    # keras model and sequences tokenizer, only loaded when the predictions are not cached
+    model_path = '/media/labuser/Data/COVID-19_classifier/pacific/model/pacific.pacific_9mers.01.h5'
+    tokenizer_path = '/media/labuser/Data/COVID-19_classifier/pacific/model/tokenizer.01.pacific_9mers.pickle'
+    cache_dir = '/media/labuser/Data/COVID-19_classifier/pacific/prediction_cache'
+    results_dir = '/media/labuser/Data/COVID-19_classifier/pacific/results/9-mers/'
         
     # loading label maker
     with open('/media/labuser/Data/COVID-19_classifier/pacific/model/label_maker.01.pacific_9mers.pickle', 'rb') as handle:
@@ -126,297 +107,88 @@ if __name__ == '__main__':
     Human_path = '/media/labuser/Data/COVID-19_classifier/pacific/data/InSilicoSeq_reads/Human/novaseq_reads_Human_1M.fastq'
     '''
     
-    kmer = 9
-    
-    influenza = main_illumina(Influenza_path, 50000, 150, kmer, 'fastq')
-    Coronaviridae = main_illumina(Coronaviridae_path, 50000, 150, kmer, 'fastq')
-    SARS_CoV_2 = main_illumina(SARS_CoV_2_path, 50000, 150, kmer, 'fastq')
-    Metapneumovirus = main_illumina(Metapneumovirus_path, 50000, 150, kmer, 'fastq')
-    Rhinovirus = main_illumina(Rhinovirus_path, 50000, 150, kmer, 'fastq')
-    Human = main_illumina(Human_path, 500000, 150, kmer, 'fastq')
-    
-    classes_dic = {'influenza': influenza,
-                   'Coronaviridae': Coronaviridae, 
-                   'Metapneumovirus': Metapneumovirus, 
-                   'Rhinovirus': Rhinovirus,
-                   'Sars_cov_2': SARS_CoV_2
-                   }
-         
-    classes= ['influenza',
-              'Coronaviridae', 
-              'Metapneumovirus', 
-              'Rhinovirus',
-              'Sars_cov_2'
-               ]
-
-    
-    max_length = 142
-    Human_reads = pad_sequences(tokenizer.texts_to_sequences(Human), maxlen = max_length, padding = 'post')
-    predictinos_Human = model.predict(Human_reads)
-    percentage_results = {}
-    
-    percentages = [10, 5, 2.5, 1, 0.5, 0.1, 0.03]
-
-    for percentage in percentages:
-        for virus in classes:
-            print(virus)
-            virus_amount = int(len(predictinos_Human)/100*percentage)
-            virus_reads = classes_dic[virus][:virus_amount]
-            virus_reads = pad_sequences(tokenizer.texts_to_sequences(virus_reads), maxlen = max_length, padding = 'post')
-            predictions_virus = model.predict(virus_reads)
-            idx_human = np.random.randint(len(predictinos_Human), size=len(predictinos_Human))
-            total_predictions = np.concatenate((predictinos_Human[idx_human,:], predictions_virus), axis=0)
-            
-            ## look at all the proportions of reads per virus 
-            proportion_Coronaviridae = percentile_proportion('Coronaviridae', total_predictions, 0.95)
-            proportion_Influenza = percentile_proportion('Influenza', total_predictions, 0.95)
-            proportion_SARS_CoV_2 = percentile_proportion('Sars_cov_2', total_predictions, 0.95)
-            proportion_Metapneumovirus = percentile_proportion('Metapneumovirus', total_predictions, 0.95)
-            proportion_Rhinovirus = percentile_proportion('Rhinovirus', total_predictions, 0.95)
-            
-            percentage_results[str(percentage)+'_'+virus] = [proportion_Coronaviridae, 
-                                                             proportion_Influenza, 
-                                                             proportion_SARS_CoV_2,
-                                                             proportion_Metapneumovirus,
-                                                             proportion_Rhinovirus
-                                                            ]
-            print([proportion_Coronaviridae, 
-                 proportion_Influenza, 
-                 proportion_SARS_CoV_2,
-                 proportion_Metapneumovirus,
-                 proportion_Rhinovirus
-                ])
-    
-    '
-    # make a heatmap per percentage
-    
-    # Influenza
-    influenza_percentages = [
-                percentage_results['0.03_influenza'],
-                percentage_results['0.1_influenza'],
-                percentage_results['0.5_influenza'],
-                percentage_results['1_influenza'],
-                percentage_results['2.5_influenza'],
-                percentage_results['5_influenza'],
-                percentage_results['10_influenza']
-                ]
-    Corno = []
-    Rhi = []
-    Sars = []
-    Influ = []
-    Metap = []
-    for percentage in enumerate(influenza_percentages):
-        Corno.append(percentage[1][0])
-        Rhi.append(percentage[1][4])
-        Sars.append(percentage[1][2])
-        Influ.append(percentage[1][1])
-        Metap.append(percentage[1][3])
-    
-    f, ax = plt.subplots(figsize=(13,9))
-    plt.title('Novaseq experiments Influenza + Human different proportions')
-    sns.lineplot([0.03, 0.1, 0.5, 1, 2.5, 5, 10], Corno, label='Coronaviridae')
-    sns.lineplot([0.03, 0.1, 0.5, 1, 2.5, 5, 10], Rhi, label= 'Rhinovirus')
-    sns.lineplot([0.03, 0.1, 0.5, 1, 2.5, 5, 10], Sars, label = 'Sars_cov_2')
-    sns.lineplot([0.03, 0.1, 0.5, 1, 2.5, 5, 10], Metap, label = 'Metapneumovirus')
-    sns.lineplot([0.03, 0.1, 0.5, 1, 2.5, 5, 10],Influ, label = 'Influenza')
-    plt.xticks([0.03, 0.1, 0.5, 1, 2.5, 5, 10])
-    plt.yticks([0.03, 0.1, 0.5, 1, 2.5, 5, 10])
-    plt.savefig('/media/labuser/Data/COVID-19_classifier/pacific/results/9-mers/FPR_0.95_Novaseq_experiments_proportions_influenza.pdf',
-                format='pdf',
-                dpi=1200,
-                bbox_inches='tight', pad_inches=0)
-    
-    # Coronaviridae
-    Coronaviridae_percentages = [  
-                percentage_results['0.03_Coronaviridae'],
-                percentage_results['0.1_Coronaviridae'],
-                percentage_results['0.5_Coronaviridae'],
-                percentage_results['1_Coronaviridae'],
-                percentage_results['2.5_Coronaviridae'],
-                percentage_results['5_Coronaviridae'],
-                percentage_results['10_Coronaviridae']
-                ]
-    Corno = []
-    Rhi = []
-    Sars = []
-    Influ = []
-    Metap = []
-    for percentage in enumerate(Coronaviridae_percentages):
-        Corno.append(percentage[1][0])
-        Rhi.append(percentage[1][4])
-        Sars.append(percentage[1][2])
-        Influ.append(percentage[1][1])
-        Metap.append(percentage[1][3])
-    
-    f, ax = plt.subplots(figsize=(13,9))
-    plt.title('Novaseq experiments Coronaviridae + Human different proportions')
-    sns.lineplot([0.03, 0.1, 0.5, 1, 2.5, 5, 10], Corno, label='Coronaviridae')
-    sns.lineplot([0.03, 0.1, 0.5, 1, 2.5, 5, 10], Rhi, label= 'Rhinovirus')
-    sns.lineplot([0.03, 0.1, 0.5, 1, 2.5, 5, 10], Sars, label = 'Sars_cov_2')
-    sns.lineplot([0.03, 0.1, 0.5, 1, 2.5, 5, 10], Metap, label = 'Metapneumovirus')
-    sns.lineplot([0.03, 0.1, 0.5, 1, 2.5, 5, 10],Influ, label = 'Influenza')
-    plt.xticks([0.03, 0.1, 0.5, 1, 2.5, 5, 10])
-    plt.yticks([0.03, 0.1, 0.5, 1, 2.5, 5, 10])
-    plt.savefig('/media/labuser/Data/COVID-19_classifier/pacific/results/9-mers/FPR_0.95_Novaseq_experiments_proportions_Coronaviridae.pdf',
-                format='pdf',
-                dpi=1200,
-                bbox_inches='tight', pad_inches=0)
-    
-    
-    # Sars_cov_2
-    Sars_cov_2_percentages = [
-                percentage_results['0.03_Sars_cov_2'],
-                percentage_results['0.1_Sars_cov_2'],
-                percentage_results['0.5_Sars_cov_2'],
-                percentage_results['1_Sars_cov_2'],
-                percentage_results['2.5_Sars_cov_2'],
-                percentage_results['5_Sars_cov_2'],
-                percentage_results['10_Sars_cov_2']
-                ]
-    Corno = []
-    Rhi = []
-    Sars = []
-    Influ = []
-    Metap = []
-    for percentage in enumerate(Sars_cov_2_percentages):
-        Corno.append(percentage[1][0])
-        Rhi.append(percentage[1][4])
-        Sars.append(percentage[1][2])
-        Influ.append(percentage[1][1])
-        Metap.append(percentage[1][3])
-    
-    f, ax = plt.subplots(figsize=(13,9))
-    plt.title('Novaseq experiments Sars_cov_2 + Human different proportions')
-    sns.lineplot([0.03, 0.1, 0.5, 1, 2.5, 5, 10], Corno, label='Coronaviridae')
-    sns.lineplot([0.03, 0.1, 0.5, 1, 2.5, 5, 10], Rhi, label= 'Rhinovirus')
-    sns.lineplot([0.03, 0.1, 0.5, 1, 2.5, 5, 10], Sars, label = 'Sars_cov_2')
-    sns.lineplot([0.03, 0.1, 0.5, 1, 2.5, 5, 10], Metap, label = 'Metapneumovirus')
-    sns.lineplot([0.03, 0.1, 0.5, 1, 2.5, 5, 10],Influ, label = 'Influenza')
-    plt.xticks([0.03, 0.1, 0.5, 1, 2.5, 5, 10])
-    plt.yticks([0.03, 0.1, 0.5, 1, 2.5, 5, 10])
-    plt.savefig('/media/labuser/Data/COVID-19_classifier/pacific/results/9-mers/FPR_0.95_Novaseq_experiments_proportions_Sars_cov_2.pdf',
-                format='pdf',
-                dpi=1200,
-                bbox_inches='tight', pad_inches=0)
-    
-    # Metapneumovirus
-    Rhinovirus_percentages = [
-               percentage_results['0.03_Rhinovirus'],
-                percentage_results['0.1_Rhinovirus'],
-                percentage_results['0.5_Rhinovirus'],
-                percentage_results['1_Rhinovirus'],
-                percentage_results['2.5_Rhinovirus'],
-                percentage_results['5_Rhinovirus'],
-                percentage_results['10_Rhinovirus']
-                ]
-    Corno = []
-    Rhi = []
-    Sars = []
-    Influ = []
-    Metap = []
-    for percentage in enumerate(Rhinovirus_percentages):
-        Corno.append(percentage[1][0])
-        Rhi.append(percentage[1][4])
-        Sars.append(percentage[1][2])
-        Influ.append(percentage[1][1])
-        Metap.append(percentage[1][3])
-    
-    f, ax = plt.subplots(figsize=(13,9))
-    plt.title('Novaseq experiments Rhinovirus + Human different proportions')
-    sns.lineplot([0.03, 0.1, 0.5, 1, 2.5, 5, 10], Corno, label='Coronaviridae')
-    sns.lineplot([0.03, 0.1, 0.5, 1, 2.5, 5, 10], Rhi, label= 'Rhinovirus')
-    sns.lineplot([0.03, 0.1, 0.5, 1, 2.5, 5, 10], Sars, label = 'Sars_cov_2')
-    sns.lineplot([0.03, 0.1, 0.5, 1, 2.5, 5, 10], Metap, label = 'Metapneumovirus')
-    sns.lineplot([0.03, 0.1, 0.5, 1, 2.5, 5, 10],Influ, label = 'Influenza')
-    plt.xticks([0.03, 0.1, 0.5, 1, 2.5, 5, 10])
-    plt.yticks([0.03, 0.1, 0.5, 1, 2.5, 5, 10])
-    plt.savefig('/media/labuser/Data/COVID-19_classifier/pacific/results/9-mers/FPR_0.95_Novaseq_experiments_proportions_Rhinovirus.pdf',
-                format='pdf',
-                dpi=1200,
-                bbox_inches='tight', pad_inches=0)
-    
-    
-    # Rhinovirus
-    Metapneumovirus_percentages = [
-                percentage_results['0.03_Metapneumovirus'],
-                percentage_results['0.1_Metapneumovirus'],
-                percentage_results['0.5_Metapneumovirus'],
-                percentage_results['1_Metapneumovirus'],
-                percentage_results['2.5_Metapneumovirus'],
-                percentage_results['5_Metapneumovirus'],
-                percentage_results['10_Metapneumovirus']
-                ]
-    Corno = []
-    Rhi = []
-    Sars = []
-    Influ = []
-    Metap = []
-    for percentage in enumerate(Metapneumovirus_percentages):
-        Corno.append(percentage[1][0])
-        Rhi.append(percentage[1][4])
-        Sars.append(percentage[1][2])
-        Influ.append(percentage[1][1])
-        Metap.append(percentage[1][3])
-    
-    f, ax = plt.subplots(figsize=(13,9))
-    plt.title('Novaseq experiments Metapneumovirus + Human different proportions')
-    sns.lineplot([0.03, 0.1, 0.5, 1, 2.5, 5, 10], Corno, label='Coronaviridae')
-    sns.lineplot([0.03, 0.1, 0.5, 1, 2.5, 5, 10], Rhi, label= 'Rhinovirus')
-    sns.lineplot([0.03, 0.1, 0.5, 1, 2.5, 5, 10], Sars, label = 'Sars_cov_2')
-    sns.lineplot([0.03, 0.1, 0.5, 1, 2.5, 5, 10], Metap, label = 'Metapneumovirus')
-    sns.lineplot([0.03, 0.1, 0.5, 1, 2.5, 5, 10],Influ, label = 'Influenza')
-    plt.xticks([0.03, 0.1, 0.5, 1, 2.5, 5, 10])
-    plt.yticks([0.03, 0.1, 0.5, 1, 2.5, 5, 10])
-    plt.savefig('/media/labuser/Data/COVID-19_classifier/pacific/results/9-mers/FPR_0.95_Novaseq_experiments_proportions_Metapneumovirus.pdf',
-                format='pdf',
-                dpi=1200,
-                bbox_inches='tight', pad_inches=0)
-    
-    df_percentages = pd.DataFrame(percentage_results)
-    df_percentages.to_csv('/media/labuser/Data/COVID-19_classifier/pacific/results/9-mers/FPR_0.95_Novaseq_experiments_heatmaps.pdf')
-    
-    for name in classes:
-        name_cols = [col for col in df_percentages.columns if name in col]
-        df_temp = df_percentages[name_cols]
-        df_temp.columns = ['10%', '5%', '2.5%', '1%', '0.5%', '0.1%', '0.03%']
-        df_temp.index = ['Coronaviridae','Influenza','Sars-cov-2','Metapneumovirus','Rhinovirus']
-        plt.figure(figsize=(13,9))
-        ax = sns.heatmap(df_temp,
-                         annot=True,
-                         cmap = sns.color_palette("Blues"))
-
-        ax.tick_params(labelsize=25)
-        ax.axes.set_title('Percentage of '+name+' in the sample', fontsize = 25)
-
-        for text in ax.texts:
-            text.set_size(18)
-            if text.get_position()[1] == 0.5:
-                if float(text.get_text()) >= 0.0072:
-                    text.set_weight('bold')
-                    text.set_size(18)
-            elif text.get_position()[1] == 1.5:
-                if float(text.get_text()) >= 0.0012:
-                    text.set_weight('bold')
-                    text.set_size(18)
-            elif text.get_position()[1] == 2.5:
-                if float(text.get_text()) >= 0.024:
-                    text.set_weight('bold')
-                    text.set_size(18)
-            elif text.get_position()[1] == 3.5:
-                if float(text.get_text()) >= 0.0012:
-                    text.set_weight('bold')
-                    text.set_size(18)
-            elif text.get_position()[1] == 4.5:
-                if float(text.get_text()) >= 0.0264:
+    # every pool is predicted once and cached, the mixtures are simulated from their summaries
+    pools = {'Human': summarize_predictions(cached_predict(Human_path, model_path, tokenizer_path, 500000, cache_dir)),
+             'influenza': summarize_predictions(cached_predict(Influenza_path, model_path, tokenizer_path, 50000, cache_dir)),
+             'Coronaviridae': summarize_predictions(cached_predict(Coronaviridae_path, model_path, tokenizer_path, 50000, cache_dir)),
+             'Metapneumovirus': summarize_predictions(cached_predict(Metapneumovirus_path, model_path, tokenizer_path, 50000, cache_dir)),
+             'Rhinovirus': summarize_predictions(cached_predict(Rhinovirus_path, model_path, tokenizer_path, 50000, cache_dir)),
+             'Sars_cov_2': summarize_predictions(cached_predict(SARS_CoV_2_path, model_path, tokenizer_path, 50000, cache_dir))
+             }
+    
+    # classes reported for every mixture and the name used in the heatmaps
+    reported = {'Coronaviridae': 'Coronaviridae',
+                'Influenza': 'Influenza',
+                'Sars_cov_2': 'Sars-cov-2',
+                'Metapneumovirus': 'Metapneumovirus',
+                'Rhinovirus': 'Rhinovirus'
+                }
+    class_labels = {name: list(label_maker.classes_).index(name) for name in reported}
+    
+    # experiment grid: spike-in percentages of the human reads, number of human reads and replicates
+    percentages = PERCENTAGES
+    depths = DEPTHS if DEPTHS is not None else [len(pools['Human'][0])]
+    replicates = REPLICATES
+    
+    mixtures = simulate_mixtures(pools,
+                                 'Human',
+                                 class_labels,
+                                 percentages,
+                                 depths,
+                                 replicates=replicates,
+                                 threshold=0.95,
+                                 method=METHOD)
+    mixtures.to_csv(results_dir+'FPR_0.95_Novaseq_experiments_mixtures.csv', index=False)
+    
+    viruses = [i for i in pools if i != 'Human']
+    
+    # heatmap of the reported proportions per spiked virus, bold above the detection limit of each class
+    detection_limits = [0.0072, 0.0012, 0.024, 0.0012, 0.0264]
+    
+    for depth in depths:
+        # plots of every depth, mean of the replicates
+        suffix = '' if len(depths) == 1 else '_'+str(depth)+'_reads'
+        
+        # line plot of the reported proportions per spiked virus
+        for virus in viruses:
+            df_virus = mixtures[(mixtures['virus'] == virus) & (mixtures['depth'] == depth)]
+            f, ax = plt.subplots(figsize=(13,9))
+            plt.title('Novaseq experiments '+virus+' + Human different proportions')
+            for name in reported:
+                df_class = df_virus[df_virus['class'] == name].groupby('percentage')['proportion'].mean()
+                sns.lineplot(df_class.index.values, df_class.values, label=name)
+            plt.xticks(sorted(percentages))
+            plt.yticks(sorted(percentages))
+            plt.savefig(results_dir+'FPR_0.95_Novaseq_experiments_proportions_'+virus+suffix+'.pdf',
+                        format='pdf',
+                        dpi=1200,
+                        bbox_inches='tight', pad_inches=0)
+        
+        for name in viruses:
+            df_temp = mixtures[(mixtures['virus'] == name) & (mixtures['depth'] == depth)]
+            df_temp = df_temp.pivot_table(index='class', columns='percentage', values='proportion', aggfunc='mean')
+            df_temp = df_temp.loc[list(reported), sorted(percentages, reverse=True)]
+            df_temp.columns = ['{:g}%'.format(i) for i in df_temp.columns]
+            df_temp.index = list(reported.values())
+            plt.figure(figsize=(13,9))
+            ax = sns.heatmap(df_temp,
+                             annot=True,
+                             cmap = sns.color_palette("Blues"))
+    
+            ax.tick_params(labelsize=25)
+            ax.axes.set_title('Percentage of '+name+' in the sample', fontsize = 25)
+    
+            for text in ax.texts:
+                text.set_size(18)
+                row = int(text.get_position()[1])
+                if float(text.get_text()) >= detection_limits[row]:
                     text.set_weight('bold')
-                    text.set_size(18)
-                    
-          
-        #x.xaxis.tick_top() # x axis on top
-        plt.savefig('/media/labuser/Data/COVID-19_classifier/pacific/results/9-mers/FPR_0.95_Novaseq_experiments_heatmap_'+name+'.pdf',
-                format='pdf',
-                dpi=1200,
-                bbox_inches='tight', pad_inches=0)
+              
+            #x.xaxis.tick_top() # x axis on top
+            plt.savefig(results_dir+'FPR_0.95_Novaseq_experiments_heatmap_'+name+suffix+'.pdf',
+                    format='pdf',
+                    dpi=1200,
+                    bbox_inches='tight', pad_inches=0)
     
     # correlations between real and predicted
     
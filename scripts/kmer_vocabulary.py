@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Deterministic k-mer vocabularies.
+
+Token ids are assigned from the 2-bit code of every k-mer instead of the
+frequency order of Tokenizer.fit_on_texts, so no fit pass over the k-mer
+strings is needed and the ids are reproducible across datasets:
+
+    full:     id = code + 1 for every one of the 4^k k-mers
+    observed: ids 2..n+1 given in code order to the k-mers counted at least
+              min_count times in a streaming pass over the reads, every
+              other k-mer shares the out of vocabulary id 1
+    hashed:   ids 1..buckets from a hash of the code, several k-mers share
+              one embedding row
+
+With canonical k-mers every k-mer and its reverse complement share the
+token of min(code, reverse complement code), which halves the embedding
+table for reads sampled from both strands.
+
+A vocabulary is a table from k-mer code to token id (0 is the padding and
+unknown k-mer id), applied to whole batches of encoded reads with NumPy.
+A Keras Tokenizer with the same word_index is saved next to the model.
+PACIFIC.py turns it back into a table with tokenizer_table and tokenizes
+the reads with tokenize_reads, so older tokenizers fitted with
+fit_on_texts work the same way.
+"""
+
+import numpy as np
+from keras.preprocessing.text import Tokenizer
+
+from synthetic_reads import encode_sequence, kmer_codes, valid_kmers, kmer_lookup
+
+
+VOCABULARIES = ('full', 'observed', 'hashed')
+
+OOV_TOKEN = '<oov>'
+
+
+def encode_reads(reads, length=None):
+    '''
+    encode reads into a matrix of 2-bit codes, reads shorter than length are
+    padded at the end (post padding) and longer reads truncated
+    '''
+    if length is None:
+        length = max([len(i) for i in reads]) if len(reads) > 0 else 0
+    encoded = np.full((len(reads), length), 4, dtype=np.uint8)
+    for i, read in enumerate(reads):
+        read_codes = encode_sequence(read[:length])
+        encoded[i, :len(read_codes)] = read_codes
+    return encoded
+
+
+def count_kmers(encoded, k, counts=None, block_size=100000):
+    '''
+    add the k-mer counts of the encoded reads to counts, block by block
+    '''
+    if counts is None:
+        counts = np.zeros(4**k, dtype=np.int64)
+    for start in range(0, len(encoded), block_size):
+        block = encoded[start:start+block_size]
+        counts += np.bincount(kmer_codes(block, k)[valid_kmers(block, k)], minlength=4**k)
+    return counts
+
+
+def reverse_complement_codes(codes, k):
+    '''
+    code of the reverse complement of every k-mer code
+    '''
+    codes = np.asarray(codes, dtype=np.int64) ^ (4**k - 1)
+    reverse = np.zeros_like(codes)
+    for _ in range(k):
+        reverse = reverse*4 + (codes & 3)
+        codes = codes >> 2
+    return reverse
+
+
+def canonical_codes(codes, k):
+    '''
+    smallest code between every k-mer and its reverse complement
+    '''
+    return np.minimum(codes, reverse_complement_codes(codes, k))
+
+
+def canonical_counts(counts, k):
+    '''
+    add the counts of every k-mer to its canonical k-mer
+    '''
+    return np.bincount(canonical_codes(np.arange(4**k), k), weights=counts, minlength=4**k).astype(np.int64)
+
+
+def full_vocabulary(k, canonical=False):
+    '''
+    token id of every k-mer: its code + 1, or the canonical k-mers in code
+    order
+    '''
+    if canonical is True:
+        codes = np.arange(4**k)
+        return observed_vocabulary((canonical_codes(codes, k) == codes).astype(np.int64))
+    return np.arange(1, 4**k + 1, dtype=np.int32)
+
+
+def observed_vocabulary(counts, min_count=1):
+    '''
+    token ids in code order for the k-mers seen at least min_count times,
+    the rare and unseen k-mers get the out of vocabulary id 1
+    '''
+    present = counts >= max(min_count, 1)
+    table = np.ones(len(counts), dtype=np.int32)
+    table[present] = np.arange(2, present.sum() + 2)
+    return table
+
+
+def grow_vocabulary(table, counts, unknown=0, min_count=1):
+    '''
+    add the k-mers counted at least min_count times that have the unknown id,
+    the new ids follow the largest id in code order so the old ids are kept
+    '''
+    new = (table == unknown) & (counts >= max(min_count, 1))
+    grown = table.copy()
+    grown[new] = np.arange(table.max() + 1, table.max() + 1 + new.sum())
+    return grown
+
+
+def hash_codes(codes):
+    '''
+    64-bit mix of the k-mer codes (MurmurHash3 finalizer)
+    '''
+    hashes = np.asarray(codes, dtype=np.uint64)
+    hashes ^= hashes >> np.uint64(33)
+    hashes *= np.uint64(0xff51afd7ed558ccd)
+    hashes ^= hashes >> np.uint64(33)
+    hashes *= np.uint64(0xc4ceb9fe1a85ec53)
+    hashes ^= hashes >> np.uint64(33)
+    return hashes
+
+
+def hashed_vocabulary(k, buckets, canonical=False):
+    '''
+    token ids 1..buckets from the hash of every k-mer code
+    '''
+    codes = np.arange(4**k)
+    table = (hash_codes(codes) % np.uint64(buckets)).astype(np.int32) + 1
+    if canonical is True:
+        # only canonical codes are looked up
+        table[canonical_codes(codes, k) != codes] = 0
+    return table
+
+
+def tokenize_reads(encoded, table, k, canonical=False, block_size=100000):
+    '''
+    token ids of every k-mer of the encoded reads, k-mers with non-standard
+    nucleotides or padding get 0
+    '''
+    tokens = np.zeros((len(encoded), max(encoded.shape[1] - k + 1, 0)), dtype=np.int32)
+    for start in range(0, len(encoded), block_size):
+        block = encoded[start:start+block_size]
+        codes = kmer_codes(block, k)
+        if canonical is True:
+            codes = canonical_codes(codes, k)
+        block_tokens = table[codes]
+        block_tokens[~valid_kmers(block, k)] = 0
+        tokens[start:start+block_size] = block_tokens
+    return tokens
+
+
+def kmer_strings(codes, k):
+    '''
+    lower case k-mer strings of an array of codes, as stored by Keras tokenizers
+    '''
+    codes = np.asarray(codes, dtype=np.int64)
+    digits = (codes[:, None] >> (2*np.arange(k - 1, -1, -1))) & 3
+    letters = np.frombuffer(b'acgt', dtype=np.uint8)[digits]
+    return [i.decode('ascii') for i in np.ascontiguousarray(letters).view('S'+str(k)).ravel()]
+
+
+def vocabulary_tokenizer(table, k, oov=False):
+    '''
+    Keras tokenizer with the word_index of a vocabulary table, with oov the
+    k-mers with id 1 are left to the out of vocabulary token
+    '''
+    if oov is True:
+        codes = np.nonzero(table > 1)[0]
+        tokenizer = Tokenizer(oov_token=OOV_TOKEN)
+    else:
+        codes = np.nonzero(table)[0]
+        tokenizer = Tokenizer()
+    tokenizer.word_index = dict(zip(kmer_strings(codes, k), table[codes].tolist()))
+    if oov is True:
+        tokenizer.word_index[OOV_TOKEN] = 1
+    # hashed vocabularies give one id to several k-mers, keep the first
+    tokenizer.index_word = {}
+    for word, i in tokenizer.word_index.items():
+        tokenizer.index_word.setdefault(i, word)
+    return tokenizer
+
+
+def tokenizer_table(tokenizer, k):
+    '''
+    vocabulary table of a saved tokenizer, unknown k-mers get the id of its
+    out of vocabulary token (0 without one)
+    '''
+    oov_token = getattr(tokenizer, 'oov_token', None)
+    return kmer_lookup(tokenizer.word_index, k, tokenizer.word_index.get(oov_token, 0))
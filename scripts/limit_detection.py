@@ -7,14 +7,11 @@ This script will take different FASTQ files and plot the porcentage of predicted
 @author: labuser
 """
 
-from Bio import SeqIO
 import random
-import os
 
 import numpy as np
 import pandas as pd
 
-from keras.preprocessing.sequence import pad_sequences
 import tensorflow as tf
 
 import random
@@ -22,48 +19,13 @@ from numpy.random import seed
 from tensorflow import set_random_seed
 import pickle
 
-from keras.models import load_model
 import matplotlib.pyplot as plt
 import seaborn as sns
 sns.set_style('dark')   
 
-##### Functions to test with real illumina reads
-
-def prepare_read_illumina(trancriptome, file_type):
-    '''
-    function will take tranciprtome and make reads
-    '''
-    fasta_sequences = SeqIO.parse(open(trancriptome),file_type)
-    sequences = []
-    for fasta in fasta_sequences:
-        name, sequence = fasta.id, str(fasta.seq)
-        sequences.append(sequence)
-    return sequences
-
-
-def process_reads_illumina(sequences, number_reads, length, kmer):
-    '''
-    '''
-    r_reads = []
-    for i in enumerate(sequences):
-        if len(i[1]) >= length and 'N' not in i[1]:
-            read = i[1][:length]
-            r_reads.append(' '.join(read[x:x+kmer].upper() for x in range(len(read) - kmer + 1)))
-            if len(r_reads) == number_reads:
-                break
-    return r_reads
-
-
-def main_illumina(file, number_reads, size_lenght, k_mer_size, file_type):
-    '''
-    '''
-    all_transcripts = prepare_read_illumina(file, file_type)
-    reads = process_reads_illumina(all_transcripts, 
-                                   number_reads, 
-                                   size_lenght,
-                                   k_mer_size)
-    return reads 
-
+from prediction_cache import cached_predict
+from bootstrap import summarize_predictions, concatenate_summaries, threshold_categories
+from bootstrap import category_counts, proportion_from_counts, bootstrap_proportions
 
 def accuracy(labels, predictions):
     '''
@@ -81,19 +43,17 @@ def accuracy(labels, predictions):
     return correct/len(labels)
 
 
-def test_false_positives(virus_class, predictions_class, predictions_outside_class, plot=False):
+def test_false_positives(virus_class, summary_class, summary_outside_class, plot=False):
     '''
+    probabilities of the true and false positives of a class, the summaries
+    are the (argmax, max) of the predictions of summarize_predictions
     '''
     label = np.argmax(label_maker.transform([virus_class]))
-    true_positives = []
-    for i in enumerate(predictions_class):
-        if  np.argmax(i[1]) == label: # if True positive
-            true_positives.append(max(i[1]))
-    
-    false_positives = []
-    for i in enumerate(predictions_outside_class):
-        if  np.argmax(i[1]) == label: # if True Negative
-            false_positives.append(max(i[1]))
+    predicted, scores = summary_class
+    true_positives = scores[predicted == label] # if True positive
+    
+    predicted, scores = summary_outside_class
+    false_positives = scores[predicted == label] # if True Negative
 
     if plot :
         f, ax = plt.subplots(figsize=(13,9))
@@ -111,34 +71,29 @@ def test_false_positives(virus_class, predictions_class, predictions_outside_cla
     return true_positives, false_positives
 
 
-def percentile_proportion(virus_class, predictions_outside_class, threshold):
+def percentile_proportion(virus_class, summary_outside_class, threshold):
     '''
+    percentage of reads predicted as virus_class over the reads predicted as
+    other classes, among the reads above the threshold
     '''
     label = np.argmax(label_maker.transform([virus_class]))
-    false_positives = 0
-    Total = 0
-    for i in enumerate(predictions_outside_class):
-        if np.max(i[1]) >= threshold:
-            if  np.argmax(i[1]) == label: # if True Negative
-                false_positives += 1
-            else:
-                Total +=1
-
-    return (100/Total)*false_positives
+    categories = threshold_categories(summary_outside_class, label, threshold)
+    return proportion_from_counts(category_counts(categories))
 
  
-def proportion_distribution(virus_label, virus_group, iterations, threshold):
+def proportion_distribution(virus_label, virus_group, iterations, threshold, processes=1):
     '''
+    percentile_proportion of iterations samples of 100000 reads drawn from the
+    first 500000 reads of virus_group, all samples at once
     '''
-    proportions = []
-    for i in range(iterations):
-        #first total number of reads for predictions between 100K and 900K
-        idx = np.random.randint(500000, size=100000)
-        total_reads =  virus_group[idx,:]
-        proportions.append(percentile_proportion(virus_label,
-                                                total_reads,
-                                                 threshold))
-    return proportions
+    label = np.argmax(label_maker.transform([virus_label]))
+    categories = threshold_categories(virus_group, label, threshold)
+    proportions = bootstrap_proportions(categories,
+                                        iterations,
+                                        100000,
+                                        population=500000,
+                                        processes=processes)
+    return list(proportions)
 
 
 if __name__ == '__main__':
@@ -152,12 +107,10 @@ if __name__ == '__main__':
     config.gpu_options.allow_growth = True
     sess = tf.Session(config=config)
 
-    # keras load model
-    model = load_model("/media/labuser/Data/COVID-19_classifier/pacific/model/pacific.01.pacific_9mers.h5")
-    
-    # Keras loading sequences tokenizer 
-    with open('/media/labuser/Data/COVID-19_classifier/pacific/model/tokenizer.01.pacific_9mers.pickle', 'rb') as handle:
-        tokenizer = pickle.load(handle)
+    # keras model and sequences tokenizer, only loaded when the predictions are not cached
+    model_path = "/media/labuser/Data/COVID-19_classifier/pacific/model/pacific.01.pacific_9mers.h5"
+    tokenizer_path = '/media/labuser/Data/COVID-19_classifier/pacific/model/tokenizer.01.pacific_9mers.pickle'
+    cache_dir = '/media/labuser/Data/COVID-19_classifier/pacific/prediction_cache'
         
     # loading label maker
     with open('/media/labuser/Data/COVID-19_classifier/pacific/model/label_maker.01.pacific_9mers.pickle', 'rb') as handle:
@@ -179,159 +132,144 @@ if __name__ == '__main__':
     SARS_CoV_2_path = '/media/labuser/Data/COVID-19_classifier/pacific/data/InSilicoSeq_reads/Sars-CoV-2/miseq/miseq_reads_sars-cov-2.fastq'
     Human_path = '/media/labuser/Data/COVID-19_classifier/pacific/data/InSilicoSeq_reads/Human/miseq/miseq_reads_human.fastq'
     
-    kmer= 9 
-    
-    influenza = main_illumina(Influenza_path, 500000, 150, kmer, 'fastq')
-    Coronaviridae = main_illumina(Coronaviridae_path, 500000, 150, kmer, 'fastq')
-    Metapneumovirus = main_illumina(Metapneumovirus_path, 500000, 150, kmer, 'fastq')
-    Rhinovirus = main_illumina(Rhinovirus_path, 500000, 150, kmer, 'fastq')
-    SARS_CoV_2 = main_illumina(SARS_CoV_2_path, 500000, 150, kmer, 'fastq')
-    Human = main_illumina(Human_path, 500000, 150, kmer,'fastq')
-    
-    max_length = 142
-
-    influenza_reads = pad_sequences(tokenizer.texts_to_sequences(influenza), maxlen = max_length, padding = 'post')
-    Coronaviridae_reads = pad_sequences(tokenizer.texts_to_sequences(Coronaviridae), maxlen = max_length, padding = 'post')
-    Metapneumovirus_reads = pad_sequences(tokenizer.texts_to_sequences(Metapneumovirus), maxlen = max_length, padding = 'post' )
-    Rhinovirus_reads = pad_sequences(tokenizer.texts_to_sequences(Rhinovirus), maxlen = max_length, padding = 'post')
-    SARS_CoV_2_reads = pad_sequences(tokenizer.texts_to_sequences(SARS_CoV_2), maxlen = max_length, padding = 'post')
-    Human_reads = pad_sequences(tokenizer.texts_to_sequences(Human), maxlen = max_length, padding = 'post')
+    # first 500000 reads of 150 bp per class, predicted once and cached
+    predictinos_influenza = cached_predict(Influenza_path, model_path, tokenizer_path, 500000, cache_dir)
+    predictinos_Coronaviridae = cached_predict(Coronaviridae_path, model_path, tokenizer_path, 500000, cache_dir)
+    predictinos_Metapneumovirus = cached_predict(Metapneumovirus_path, model_path, tokenizer_path, 500000, cache_dir)
+    predictinos_Rhinovirus = cached_predict(Rhinovirus_path, model_path, tokenizer_path, 500000, cache_dir)
+    predictinos_SARS_CoV_2 = cached_predict(SARS_CoV_2_path, model_path, tokenizer_path, 500000, cache_dir)
+    predictinos_Human = cached_predict(Human_path, model_path, tokenizer_path, 500000, cache_dir)
     
-    predictinos_influenza = model.predict(influenza_reads)
-    predictinos_Coronaviridae = model.predict(Coronaviridae_reads)
-    predictinos_Metapneumovirus = model.predict(Metapneumovirus_reads)
-    predictinos_Rhinovirus = model.predict(Rhinovirus_reads)
-    predictinos_SARS_CoV_2 = model.predict(SARS_CoV_2_reads)
-    predictinos_Human = model.predict(Human_reads)
+    # argmax and max of every prediction matrix, computed once
+    summary_influenza = summarize_predictions(predictinos_influenza)
+    summary_Coronaviridae = summarize_predictions(predictinos_Coronaviridae)
+    summary_Metapneumovirus = summarize_predictions(predictinos_Metapneumovirus)
+    summary_Rhinovirus = summarize_predictions(predictinos_Rhinovirus)
+    summary_SARS_CoV_2 = summarize_predictions(predictinos_SARS_CoV_2)
+    summary_Human = summarize_predictions(predictinos_Human)
     
     
     # Make plots True positive vs False positives
     true_influenza, false_influenza = test_false_positives('Influenza', 
-                                                           predictinos_influenza, 
-                                                           np.concatenate((
-                                                                           predictinos_Coronaviridae,
-                                                                           predictinos_Metapneumovirus,
-                                                                           predictinos_Rhinovirus,
-                                                                           predictinos_SARS_CoV_2,
-                                                                           predictinos_Human),axis=0),
+                                                           summary_influenza, 
+                                                           concatenate_summaries((
+                                                                           summary_Coronaviridae,
+                                                                           summary_Metapneumovirus,
+                                                                           summary_Rhinovirus,
+                                                                           summary_SARS_CoV_2,
+                                                                           summary_Human)),
                                                            'plot')
     
     true_Coronaviridae, false_Coronaviridae = test_false_positives('Coronaviridae', 
-                                                                       predictinos_Coronaviridae, 
-                                                                       np.concatenate((
-                                                                           predictinos_influenza,
-                                                                           predictinos_Metapneumovirus,
-                                                                           predictinos_Rhinovirus,
-                                                                           predictinos_SARS_CoV_2,
-                                                                           predictinos_Human),axis=0),
+                                                                       summary_Coronaviridae, 
+                                                                       concatenate_summaries((
+                                                                           summary_influenza,
+                                                                           summary_Metapneumovirus,
+                                                                           summary_Rhinovirus,
+                                                                           summary_SARS_CoV_2,
+                                                                           summary_Human)),
                                                                         'plot')
     
     true_Metapneumovirus, false_Metapneumovirus = test_false_positives('Metapneumovirus', 
-                                                                       predictinos_Metapneumovirus, 
-                                                                       np.concatenate((
-                                                                           predictinos_influenza,
-                                                                           predictinos_Coronaviridae,
-                                                                           predictinos_Rhinovirus,
-                                                                           predictinos_SARS_CoV_2,
-                                                                           predictinos_Human),axis=0),
+                                                                       summary_Metapneumovirus, 
+                                                                       concatenate_summaries((
+                                                                           summary_influenza,
+                                                                           summary_Coronaviridae,
+                                                                           summary_Rhinovirus,
+                                                                           summary_SARS_CoV_2,
+                                                                           summary_Human)),
                                                                                'plot')
     
     true_Rhinovirus, false_Rhinovirus = test_false_positives('Rhinovirus', 
-                                                              predictinos_Rhinovirus, 
-                                                              np.concatenate((
-                                                                           predictinos_influenza,
-                                                                           predictinos_Coronaviridae,
-                                                                           predictinos_Metapneumovirus,
-                                                                           predictinos_SARS_CoV_2,
-                                                                           predictinos_Human),axis=0),
+                                                              summary_Rhinovirus, 
+                                                              concatenate_summaries((
+                                                                           summary_influenza,
+                                                                           summary_Coronaviridae,
+                                                                           summary_Metapneumovirus,
+                                                                           summary_SARS_CoV_2,
+                                                                           summary_Human)),
                                                                       'plot')
     
     true_SARS_CoV_2, false_SARS_CoV_2 = test_false_positives('Sars_cov_2',
-                                                             predictinos_SARS_CoV_2,
-                                                             np.concatenate((
-                                                                           predictinos_influenza,
-                                                                           predictinos_Coronaviridae,
-                                                                           predictinos_Metapneumovirus,
-                                                                           predictinos_Rhinovirus,
-                                                                           predictinos_Human),axis=0),
+                                                             summary_SARS_CoV_2,
+                                                             concatenate_summaries((
+                                                                           summary_influenza,
+                                                                           summary_Coronaviridae,
+                                                                           summary_Metapneumovirus,
+                                                                           summary_Rhinovirus,
+                                                                           summary_Human)),
                                                                      'plot')
     
     true_Human, false_Human = test_false_positives('Human',
-                                                   predictinos_Human,
-                                                   np.concatenate((
-                                                                   predictinos_influenza,
-                                                                   predictinos_Coronaviridae,
-                                                                   predictinos_Metapneumovirus,
-                                                                   predictinos_Rhinovirus,
-                                                                   predictinos_SARS_CoV_2),axis=0),
+                                                   summary_Human,
+                                                   concatenate_summaries((
+                                                                   summary_influenza,
+                                                                   summary_Coronaviridae,
+                                                                   summary_Metapneumovirus,
+                                                                   summary_Rhinovirus,
+                                                                   summary_SARS_CoV_2)),
                                                            'plot')
 
     #### boostrapping of the FP to set the detection limits using other viruses
     
     other_virus_path = '/media/labuser/Data/COVID-19_classifier/pacific/data/InSilicoSeq_reads/rest_virus/rest_virus.fastq'
-    other_virus = main_illumina(Human_path, 1000000, 150, kmer,'fastq')
-    other_virus_reads = pad_sequences(tokenizer.texts_to_sequences(other_virus), maxlen = max_length, padding = 'post')
-    predictinos_other_virus = model.predict(other_virus_reads)
+    summary_other_virus = summarize_predictions(cached_predict(other_virus_path, model_path, tokenizer_path, 1000000, cache_dir))
 
-    scores = {}
-    for i in predictinos_other_virus:
-        if np.argmax(i) not in scores:
-            scores[np.argmax(i)] = 1
-        else:
-            scores[np.argmax(i)] += 1
+    # number of reads predicted as every class
+    scores = dict(zip(*np.unique(summary_other_virus[0], return_counts=True)))
     
     proportions_Influenza = proportion_distribution('Influenza',
-                                                    np.concatenate((
-                                                               predictinos_Coronaviridae,
-                                                               predictinos_Metapneumovirus,
-                                                               predictinos_Rhinovirus,
-                                                               predictinos_SARS_CoV_2,
-                                                               predictinos_Human
-                                                               predictinos_other_virus),axis=0),
+                                                    concatenate_summaries((
+                                                               summary_Coronaviridae,
+                                                               summary_Metapneumovirus,
+                                                               summary_Rhinovirus,
+                                                               summary_SARS_CoV_2,
+                                                               summary_Human,
+                                                               summary_other_virus)),
                                                      1000,
                                                      0.95)
     
     proportions_Sars_cov_2 = proportion_distribution('Sars_cov_2',
-                                                      np.concatenate((
-                                                               predictinos_influenza,
-                                                               predictinos_Coronaviridae,
-                                                               predictinos_Metapneumovirus,
-                                                               predictinos_Rhinovirus,
-                                                               predictinos_Human,
-                                                               predictinos_other_virus),axis=0),
+                                                      concatenate_summaries((
+                                                               summary_influenza,
+                                                               summary_Coronaviridae,
+                                                               summary_Metapneumovirus,
+                                                               summary_Rhinovirus,
+                                                               summary_Human,
+                                                               summary_other_virus)),
                                                      1000,
                                                      0.95)
     
     
     proportions_Coronaviridae = proportion_distribution('Coronaviridae',
-                                                            np.concatenate((
-                                                              predictinos_influenza,
-                                                              predictinos_Metapneumovirus,
-                                                              predictinos_Rhinovirus,
-                                                              predictinos_SARS_CoV_2,
-                                                              predictinos_Human),axis=0),
+                                                            concatenate_summaries((
+                                                              summary_influenza,
+                                                              summary_Metapneumovirus,
+                                                              summary_Rhinovirus,
+                                                              summary_SARS_CoV_2,
+                                                              summary_Human)),
                                                             1000,
                                                             0.95)
 
     proportions_Rhinovirus = proportion_distribution('Rhinovirus',
-                                                      np.concatenate((
-                                                            edictinos_influenza,
-                                                            predictinos_Coronaviridae,
-                                                            predictinos_Metapneumovirus,
-                                                            predictinos_SARS_CoV_2,
-                                                            predictinos_Human,
-                                                            predictinos_other_virus),axis=0),
+                                                      concatenate_summaries((
+                                                            summary_influenza,
+                                                            summary_Coronaviridae,
+                                                            summary_Metapneumovirus,
+                                                            summary_SARS_CoV_2,
+                                                            summary_Human,
+                                                            summary_other_virus)),
                                                      1000,
                                                      0.95)
     
     proportions_Metapneumovirus = proportion_distribution('Metapneumovirus',
-                                                            np.concatenate((
-                                                            predictinos_influenza,
-                                                            predictinos_Coronaviridae,
-                                                            predictinos_Rhinovirus,
-                                                            predictinos_SARS_CoV_2,
-                                                            predictinos_Human,
-                                                            predictinos_other_virus),axis=0),
+                                                            concatenate_summaries((
+                                                            summary_influenza,
+                                                            summary_Coronaviridae,
+                                                            summary_Rhinovirus,
+                                                            summary_SARS_CoV_2,
+                                                            summary_Human,
+                                                            summary_other_virus)),
                                                             1000,
                                                             0.95)
     
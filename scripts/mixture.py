@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Simulation of human/virus spike-in mixtures from pools of predictions.
+
+Every class pool is predicted once (see prediction_cache.py) and reduced
+to one category per read: 0 when its probability is below the threshold,
+1 + predicted class otherwise. A mixture of depth background (Human) reads
+with int(depth/100*percentage) virus reads is then just the sum of the
+category counts of both samples, so any grid of viruses, spike-in
+percentages, depths and replicates is simulated at once, drawing reads
+with replacement either by index or as multinomial counts.
+
+For every mixture and class the table reports the percentage used by
+human_virus_in_silico_mix.py: reads above the threshold predicted as the
+class over the reads above the threshold predicted as any other class.
+"""
+
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from bootstrap import METHODS, multinomial_counts
+
+
+def pool_categories(summary, threshold):
+    '''
+    category of every read of a pool summary (argmax, max)
+    '''
+    predicted, scores = summary
+    return np.where(scores >= threshold, predicted.astype(np.int64) + 1, 0)
+
+
+def sample_pool(categories, sizes, n_categories, method='multinomial', random_state=None):
+    '''
+    category counts of one sample with replacement per entry of sizes
+    '''
+    if method not in METHODS:
+        raise ValueError('method should be one of '+', '.join(METHODS))
+    if random_state is None:
+        random_state = np.random
+    sizes = np.asarray(sizes, dtype=np.int64)
+    if method == 'multinomial':
+        frequencies = np.bincount(categories, minlength=n_categories)/len(categories)
+        return multinomial_counts(sizes, frequencies, random_state)
+    counts = np.zeros((len(sizes), n_categories), dtype=np.int64)
+    for i, size in enumerate(sizes):
+        sample = categories[random_state.randint(len(categories), size=size)]
+        counts[i] = np.bincount(sample, minlength=n_categories)
+    return counts
+
+
+def simulate_mixtures(pools,
+                      background,
+                      class_labels,
+                      percentages,
+                      depths,
+                      replicates=1,
+                      threshold=0.95,
+                      method='multinomial',
+                      random_state=None,
+                      n_classes=6):
+    '''
+    tidy table of the simulated mixtures
+
+    pools maps every pool name to its (argmax, max) summary, background is
+    the pool the viruses are spiked in and class_labels maps the reported
+    class names to their output index. Returns one row per virus,
+    percentage, depth, replicate and reported class.
+    '''
+    if random_state is None:
+        random_state = np.random
+    n_categories = n_classes + 1
+    categories = {name: pool_categories(summary, threshold) for name, summary in pools.items()}
+    viruses = [i for i in pools if i != background]
+    grid = list(itertools.product(viruses, percentages, depths, range(replicates)))
+    grid_virus = np.array([i[0] for i in grid])
+    grid_percentage = np.array([i[1] for i in grid], dtype=np.float64)
+    grid_depth = np.array([i[2] for i in grid], dtype=np.int64)
+    virus_reads = np.array([int(i[2]/100*i[1]) for i in grid], dtype=np.int64)
+
+    counts = sample_pool(categories[background], grid_depth, n_categories, method, random_state)
+    for virus in viruses:
+        rows = grid_virus == virus
+        counts[rows] += sample_pool(categories[virus], virus_reads[rows], n_categories, method, random_state)
+
+    # reads above the threshold predicted as every class and as any other class
+    above = counts[:, 1:]
+    other = above.sum(axis=1, keepdims=True) - above
+    with np.errstate(divide='ignore', invalid='ignore'):
+        proportions = (100/other)*above
+
+    class_names = list(class_labels)
+    labels = [class_labels[i] for i in class_names]
+    n_reported = len(class_names)
+    return pd.DataFrame({'virus': np.repeat(grid_virus, n_reported),
+                         'percentage': np.repeat(grid_percentage, n_reported),
+                         'depth': np.repeat(grid_depth, n_reported),
+                         'replicate': np.repeat([i[3] for i in grid], n_reported),
+                         'virus_reads': np.repeat(virus_reads, n_reported),
+                         'class': np.tile(class_names, len(grid)),
+                         'predicted_reads': above[:, labels].ravel(),
+                         'proportion': proportions[:, labels].ravel()
+                         })
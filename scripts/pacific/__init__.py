@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+"""
+In-process PACIFIC classification, with the scripts folder on the Python path:
+
+    from pacific import Classifier
+
+    classifier = Classifier('pacific.01.pacific_9mers_nonGPU.h5',
+                            'tokenizer.01.pacific_9mers.pickle',
+                            'label_maker.01.pacific_9mers.pickle')
+    results = classifier.classify(reads)
+    for names, reads, results in classifier.classify_file('reads.fastq', 'fastq'):
+        ...
+
+PACIFIC.py is the command line interface of Classifier.
+"""
+
+from pacific.classifier import Classifier
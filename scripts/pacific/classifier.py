@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+PACIFIC classifier loaded once and used in-process.
+
+Classifier loads the model, tokenizer and label maker of PACIFIC.py (and
+the small model of a cascade) once, then classifies lists of reads or
+read files chunk by chunk. Reads are grouped in length buckets, truncated
+to the bucket length and predicted with one shape per bucket. Reads with
+non-standard nucleotides or shorter than the smallest bucket are
+discarded. They keep their row in the results, with NaN probabilities and
+class -1.
+"""
+
+import os
+import pickle
+from bisect import bisect_right
+
+import numpy as np
+from Bio import SeqIO
+
+from kmer_vocabulary import encode_reads, tokenize_reads, tokenizer_table
+from pacific_summary import new_summary, add_predictions, new_cascade, add_cascade, SHORT_BUCKET
+from prediction_cache import file_hash
+
+
+class Classifier(object):
+    '''
+    PACIFIC model, tokenizer and label maker loaded once
+
+    length_buckets are the read lengths the reads are truncated to (-b),
+    fused predicts with the fused table of the model (-F), and small_model
+    is the fast model of a cascade (-S) that escalates its reads below
+    cascade_confidence to the full model and audits a fraction
+    cascade_audit of the rest, drawn with random_state (a seed, a
+    np.random.RandomState or a np.random.Generator, np.random by default).
+    '''
+
+    def __init__(self,
+                 model,
+                 tokenizer,
+                 label_maker,
+                 threshold=0.95,
+                 length_buckets=(150,),
+                 fused=False,
+                 small_model=None,
+                 cascade_confidence=0.99,
+                 cascade_audit=0.01,
+                 random_state=None):
+        from keras.models import load_model
+        from pacific_models import load_metadata, variable_length_model
+
+        self.model_file = model
+        self.small_model_file = small_model
+        self.threshold = threshold
+        self.length_buckets = sorted(set(int(i) for i in length_buckets))
+        self.fused = fused
+        self.cascade_confidence = cascade_confidence
+        self.cascade_audit = cascade_audit
+        if random_state is None:
+            random_state = np.random
+        elif isinstance(random_state, (int, np.integer)):
+            random_state = np.random.RandomState(random_state)
+        self.random_state = random_state
+        # uniform numbers in [0, 1), Generators only have random
+        self.random_sample = getattr(random_state, 'random_sample', None) or random_state.random
+
+        # model identity of the summaries, hashed once
+        self.model_sha256 = file_hash(model)
+        self.small_model_sha256 = file_hash(small_model) if small_model is not None else None
+
+        # preprocessing used to train the model, older models use 9-mers
+        metadata = load_metadata(model)
+        self.k_mers = metadata.get('k_mers', 9)
+        self.canonical = metadata.get('canonical', False)
+
+        self.model = load_model(model)
+        if self.length_buckets != [self.model.input_shape[1] + self.k_mers - 1]:
+            # every bucket is predicted with its own number of k-mers
+            self.model = variable_length_model(self.model)
+        if fused is True:
+            from fused_inference import load_fused
+            # table memory-mapped from <model>.fused.h5, computed when it is not stored
+            self.tail, self.fused_table = load_fused(self.model, model)
+
+        self.small_model = None
+        if small_model is not None:
+            small_metadata = load_metadata(small_model)
+            if (small_metadata.get('k_mers', 9), small_metadata.get('canonical', False)) != (self.k_mers, self.canonical):
+                raise ValueError(small_model+' uses other k-mers than '+model)
+            self.small_model = load_model(small_model)
+            if self.length_buckets != [self.small_model.input_shape[1] + self.k_mers - 1]:
+                self.small_model = variable_length_model(self.small_model)
+
+        with open(tokenizer, 'rb') as handle:
+            self.kmer_table = tokenizer_table(pickle.load(handle), self.k_mers)
+        with open(label_maker, 'rb') as handle:
+            self.class_names = list(pickle.load(handle).classes_)
+
+    def new_summary(self):
+        '''
+        summary without reads of the runs of this classifier
+        '''
+        summary = new_summary(self.class_names,
+                              self.threshold,
+                              {'file': os.path.basename(self.model_file), 'sha256': self.model_sha256})
+        if self.small_model is not None:
+            summary['model']['small_model'] = {'file': os.path.basename(self.small_model_file),
+                                               'sha256': self.small_model_sha256}
+            summary['cascade'] = new_cascade(self.cascade_confidence, self.cascade_audit)
+        return summary
+
+    def bucket_reads(self, reads):
+        '''
+        positions in reads of the reads without non-standard nucleotides per
+        length bucket, and the discarded reads per bucket
+        '''
+        buckets = {i: [] for i in self.length_buckets}
+        discarded = {i: 0 for i in self.length_buckets}
+        discarded[SHORT_BUCKET] = 0
+        for i in enumerate(reads):
+            # largest bucket length the read reaches
+            index = bisect_right(self.length_buckets, len(i[1]))
+            if index == 0:
+                discarded[SHORT_BUCKET] += 1
+                continue
+            length = self.length_buckets[index - 1]
+            # check the reads does not contain weird characters
+            if all(c in 'AGCT' for c in i[1].upper()):
+                buckets[length].append(i[0])
+            else:
+                discarded[length] += 1
+        return buckets, discarded
+
+    def full_predict(self, kmer_sequences):
+        '''
+        predictions of the full PACIFIC model
+        '''
+        if self.fused is True:
+            from fused_inference import fused_predict
+            return fused_predict(self.tail, kmer_sequences, self.fused_table)
+        return self.model.predict(kmer_sequences)
+
+    def cascade_predict(self, kmer_sequences, summary=None):
+        '''
+        predictions of the small model, replaced by the predictions of the
+        full model for the reads below the cascade confidence
+        '''
+        predictions = self.small_model.predict(kmer_sequences)
+        confident = np.max(predictions, axis=1) >= self.cascade_confidence
+        escalated = ~confident
+        audited = confident & (self.random_sample(len(predictions)) < self.cascade_audit)
+        full_rows = escalated | audited
+        if full_rows.any():
+            full_predictions = self.full_predict(kmer_sequences[full_rows])
+        else:
+            full_predictions = np.zeros((0, predictions.shape[1]), dtype=predictions.dtype)
+        if summary is not None:
+            summary = add_cascade(summary,
+                                  np.argmax(predictions, axis=1),
+                                  np.argmax(full_predictions, axis=1),
+                                  escalated,
+                                  audited)
+        predictions[escalated] = full_predictions[escalated[full_rows]]
+        return predictions
+
+    def classify(self, reads, summary=None):
+        '''
+        class probabilities of a list of reads, with the reads added to
+        summary when given
+
+        returns a dict of arrays with a row per read: probabilities (reads x
+        classes, NaN for discarded reads), predicted (class index, -1 for
+        discarded reads), scores (probability of the predicted class),
+        above_threshold and length (bucket length, 0 for discarded reads)
+        '''
+        n_classes = len(self.class_names)
+        probabilities = np.full((len(reads), n_classes), np.nan, dtype=np.float32)
+        length = np.zeros(len(reads), dtype=np.int32)
+
+        buckets, discarded = self.bucket_reads(reads)
+        if summary is not None:
+            summary = add_predictions(summary, [], [], discarded=discarded[SHORT_BUCKET], bucket=SHORT_BUCKET)
+        for bucket in self.length_buckets:
+            positions = buckets[bucket]
+            if len(positions) > 0:
+                # k-mer token ids from the 2-bit codes of the reads, one shape per bucket
+                kmer_sequences = tokenize_reads(encode_reads([reads[i][:bucket].upper() for i in positions], bucket),
+                                                self.kmer_table,
+                                                self.k_mers,
+                                                self.canonical)
+                if self.small_model is None:
+                    predictions = self.full_predict(kmer_sequences)
+                else:
+                    predictions = self.cascade_predict(kmer_sequences, summary)
+                probabilities[positions] = predictions
+                length[positions] = bucket
+            if summary is not None:
+                summary = add_predictions(summary,
+                                          np.argmax(probabilities[positions], axis=1),
+                                          np.max(probabilities[positions], axis=1),
+                                          discarded=discarded[bucket],
+                                          bucket=bucket)
+
+        valid = length > 0
+        predicted = np.full(len(reads), -1, dtype=np.int64)
+        predicted[valid] = np.argmax(probabilities[valid], axis=1)
+        scores = np.full(len(reads), np.nan, dtype=np.float32)
+        scores[valid] = np.max(probabilities[valid], axis=1)
+        return {'probabilities': probabilities,
+                'predicted': predicted,
+                'scores': scores,
+                'above_threshold': valid & (np.nan_to_num(scores) > self.threshold),
+                'length': length}
+
+    def classify_file(self, path, file_type='fasta', chunk_size=50000, summary=None):
+        '''
+        generator of the read ids, reads and results of classify of every
+        chunk of chunk_size reads of a FASTA/FASTQ file
+        '''
+        names = []
+        reads = []
+        with open(path) as handle:
+            for fasta in SeqIO.parse(handle, file_type):
+                names.append(fasta.id)
+                reads.append(str(fasta.seq))
+                if len(reads) == chunk_size:
+                    yield names, reads, self.classify(reads, summary)
+                    names = []
+                    reads = []
+        if len(reads) > 0:
+            yield names, reads, self.classify(reads, summary)
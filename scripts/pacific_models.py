@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+PACIFIC model definition and CPU benchmarking helpers, shared by
+train_pacific.py and sweep_pacific.py.
+
+The preprocessing a model expects (k-mer size, canonical k-mers) is stored
+as JSON in the attributes of its .h5 file, so PACIFIC.py can read it back.
+"""
+
+import json
+import os
+import tempfile
+import time
+
+import h5py
+import numpy as np
+from keras.models import Sequential
+from keras.layers import Embedding, LSTM, GRU, Dense, Bidirectional, Conv1D, CuDNNLSTM, CuDNNGRU
+from keras.layers import Dropout, Activation, MaxPooling1D, GlobalMaxPooling1D
+
+
+# bilstm: original PACIFIC model
+# small_bilstm: 3x stronger pooling before a BiLSTM of half the size
+# gru: original model with a bidirectional GRU instead of the LSTM
+# cnn: stacked dilated convolutions with global max pooling, no recurrence
+ARCHITECTURES = ('bilstm', 'small_bilstm', 'gru', 'cnn')
+
+
+def build_model(max_features,
+                max_length,
+                architecture='bilstm',
+                gpu=False,
+                kernel_size=3,
+                filters=128,
+                pool_size=3,
+                lstm_output_size=70,
+                n_classes=6):
+    '''
+    define and compile a PACIFIC model
+
+    all architectures take the same padded k-mer token ids and only use
+    standard Keras layers, so PACIFIC.py loads any of them with load_model
+    '''
+    if architecture not in ARCHITECTURES:
+        raise ValueError('architecture should be one of '+', '.join(ARCHITECTURES))
+
+    model = Sequential()
+    model.add(Embedding(max_features, 100, input_length=max_length))
+    model.add(Dropout(0.20))
+    if architecture == 'cnn':
+        # receptive field of 1 + 7*(kernel_size-1) k-mers, computed in parallel over the read
+        for dilation_rate in (1, 2, 4):
+            model.add(Conv1D(filters,
+                             kernel_size,
+                             padding='same',
+                             activation='relu',
+                             dilation_rate=dilation_rate))
+        model.add(GlobalMaxPooling1D())
+    else:
+        model.add(Conv1D(filters,
+                         kernel_size,
+                         padding='same',
+                         activation='relu',
+                         strides=1))
+        if architecture == 'small_bilstm':
+            # fewer and smaller recurrent steps
+            pool_size = pool_size*3
+            lstm_output_size = max(lstm_output_size//2, 1)
+        model.add(MaxPooling1D(pool_size=pool_size))
+        model.add(Dropout(0.1))
+        if architecture == 'gru':
+            if gpu == True:
+                model.add(Bidirectional(CuDNNGRU(lstm_output_size)))
+            else:
+                model.add(Bidirectional(GRU(lstm_output_size)))
+        elif gpu == True:
+            model.add(Bidirectional(CuDNNLSTM(lstm_output_size)))
+        else:
+            model.add(Bidirectional(LSTM(lstm_output_size)))
+    model.add(Dropout(0.1))
+    model.add(Dense(50))
+    model.add(Dense(n_classes))
+
+    model.add(Activation('softmax'))
+    model.compile(loss='categorical_crossentropy',
+                  optimizer='adam',
+                  metrics=['binary_accuracy',
+                           'categorical_accuracy',
+                           ])
+    return model
+
+
+def embedding_rows(model):
+    '''
+    number of rows of the k-mer embedding of a model
+    '''
+    return [i for i in model.layers if isinstance(i, Embedding)][0].input_dim
+
+
+def grow_embedding(model, max_features, init_row=None):
+    '''
+    copy of a Sequential PACIFIC model with max_features embedding rows
+
+    the weights are copied, new rows start from row init_row (the out of
+    vocabulary row) or from the mean embedding. The copy is compiled again,
+    so the optimizer state starts from scratch.
+    '''
+    config = model.get_config()
+    layers = config['layers'] if isinstance(config, dict) else config
+    for layer in layers:
+        if layer['class_name'] == 'Embedding':
+            layer['config']['input_dim'] = max_features
+            break
+    grown = Sequential.from_config(config)
+    for old_layer, new_layer in zip(model.layers, grown.layers):
+        weights = old_layer.get_weights()
+        if isinstance(old_layer, Embedding):
+            embedding = weights[0]
+            if init_row is None:
+                new_row = embedding.mean(axis=0)
+            else:
+                new_row = embedding[init_row]
+            new_rows = np.tile(new_row, (max_features - len(embedding), 1))
+            weights = [np.concatenate((embedding, new_rows))]
+        new_layer.set_weights(weights)
+    grown.compile(loss='categorical_crossentropy',
+                  optimizer='adam',
+                  metrics=['binary_accuracy',
+                           'categorical_accuracy',
+                           ])
+    return grown
+
+
+def variable_length_model(model):
+    '''
+    copy of a Sequential PACIFIC model that takes sequences of k-mer tokens
+    of any length, with the same weights
+
+    none of the architectures has a layer tied to the read length after the
+    embedding, so the copy predicts reads shorter than the training reads
+    without padding them.
+    '''
+    config = model.get_config()
+    layers = config['layers'] if isinstance(config, dict) else config
+    for layer in layers:
+        if layer['class_name'] == 'Embedding':
+            layer['config']['input_length'] = None
+            layer['config']['batch_input_shape'] = [None, None]
+            break
+    variable = Sequential.from_config(config)
+    variable.set_weights(model.get_weights())
+    return variable
+
+
+def distillation_model(model, temperature=1.0, alpha=1.0):
+    '''
+    model sharing the layers of a PACIFIC model, trained on the teacher soft
+    targets at temperature next to the true labels (targets of 2*n_classes
+    columns, see train_pacific.distillation_targets)
+
+    the soft targets are matched by the softmax of the student logits
+    divided by temperature, weighted by alpha*temperature**2, the labels by
+    the ordinary softmax, weighted by 1 - alpha. Training it trains model,
+    which keeps its softmax at temperature 1, so the probabilities of the
+    saved model stay comparable with the thresholds of PACIFIC.py.
+    '''
+    from keras import backend as K
+    from keras.layers import Lambda, Concatenate
+    from keras.models import Model
+
+    if not (isinstance(model.layers[-1], Activation) and model.layers[-1].get_config()['activation'] == 'softmax'):
+        raise ValueError('The last layer of the model is not a softmax Activation')
+    n_classes = model.output_shape[-1]
+    logits = model.layers[-2].output
+    soft = Activation('softmax')(Lambda(lambda x: x/temperature)(logits))
+    distiller = Model(model.input, Concatenate()([soft, model.output]))
+
+    def distillation_loss(y_true, y_pred):
+        soft_loss = K.categorical_crossentropy(y_true[:, :n_classes], y_pred[:, :n_classes])
+        hard_loss = K.categorical_crossentropy(y_true[:, n_classes:], y_pred[:, n_classes:])
+        return alpha*temperature**2*soft_loss + (1 - alpha)*hard_loss
+
+    # metrics of the student predictions against the true labels
+    def binary_accuracy(y_true, y_pred):
+        return K.mean(K.equal(y_true[:, n_classes:], K.round(y_pred[:, n_classes:])), axis=-1)
+
+    def categorical_accuracy(y_true, y_pred):
+        return K.cast(K.equal(K.argmax(y_true[:, n_classes:], axis=-1),
+                              K.argmax(y_pred[:, n_classes:], axis=-1)), K.floatx())
+
+    distiller.compile(loss=distillation_loss,
+                      optimizer='adam',
+                      metrics=[binary_accuracy,
+                               categorical_accuracy,
+                               ])
+    return distiller
+
+
+def reads_per_second(model, sequences, batch_size=32, repeats=3):
+    '''
+    CPU inference throughput, best of several timed predictions after a warm up
+    '''
+    model.predict(sequences[:batch_size], batch_size=batch_size)
+    best = None
+    for _ in range(repeats):
+        start = time.time()
+        model.predict(sequences, batch_size=batch_size)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return len(sequences)/best
+
+
+def model_file_size(model):
+    '''
+    size in bytes of the model saved as .h5 (without optimizer state)
+    '''
+    handle, path = tempfile.mkstemp(suffix='.h5')
+    os.close(handle)
+    try:
+        model.save(path, include_optimizer=False)
+        return os.path.getsize(path)
+    finally:
+        os.remove(path)
+
+
+def save_metadata(path, metadata):
+    '''
+    store the preprocessing options of a model in its .h5 file
+    '''
+    with h5py.File(path, 'a') as handle:
+        handle.attrs['pacific_metadata'] = json.dumps(metadata)
+
+
+def load_metadata(path):
+    '''
+    preprocessing options stored in a model .h5 file, empty for older models
+    '''
+    with h5py.File(path, 'r') as handle:
+        metadata = handle.attrs.get('pacific_metadata')
+    if metadata is None:
+        return {}
+    if isinstance(metadata, bytes):
+        metadata = metadata.decode('utf-8')
+    return json.loads(metadata)
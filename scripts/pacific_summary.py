@@ -0,0 +1,498 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Mergeable summary of a PACIFIC run.
+
+output_PACIFIC.txt holds percentages, which do not add up when a large
+input is split across processes or machines. Every PACIFIC.py run also
+writes summary_PACIFIC.json with the raw numbers:
+
+    version          format version (SUMMARY_VERSION)
+    model            file name and SHA-256 of the model
+    threshold        prediction threshold (-T)
+    classes          class names, in the order of the label maker
+    bins             number of bins of the confidence histograms
+    total_reads      reads in the input
+    discarded_reads  reads too short or with non-standard nucleotides
+    predicted        reads predicted as every class
+    above_threshold  reads predicted as every class above the threshold
+    histograms       reads predicted as every class per bin of the
+                     predicted probability, bin floor(p*bins)
+    buckets          [classified, discarded] reads per read length bucket
+                     (-b), reads shorter than the smallest bucket are
+                     counted in "short"
+    cascade          only in runs with a small model (-S), reads predicted
+                     by the cascade, escalated to the full model, whose
+                     class the full model changed, and confident reads
+                     audited with the full model and their agreement
+
+Summaries of shards of the same input with the same model and threshold
+are merged by adding their counts, and the report of output_PACIFIC.txt
+is computed from the merged counts:
+
+    python pacific_summary.py merge -o <dir> shard_1/summary_PACIFIC.json shard_2/summary_PACIFIC.json ...
+
+With -P, PACIFIC.py also writes the class probabilities of every read:
+
+    probabilities_PACIFIC.f16    float16 rows of len(classes) probabilities
+                                 in the order of the input reads, NaN for
+                                 the discarded reads
+    probabilities_PACIFIC.names  id of the read of every row
+
+and resummarize recomputes the report at another threshold, the reads of
+some classes above it, or a sweep of thresholds from the memory-mapped
+probabilities, without running the model again:
+
+    python pacific_summary.py resummarize -T 0.9 --extract Sars_cov_2 --sweep 0.5,0.9,0.95,0.99 <run dir>
+
+Its files are named by threshold (summary_PACIFIC.T0.9.json,
+output_PACIFIC.T0.9.txt, ...) and written in the run directory unless -o
+is given, next to the summary and report of the run.
+
+Probabilities are rounded to float16 (about 3 decimal digits), reads
+within that distance of the threshold can be counted differently than in
+the run.
+"""
+
+import json
+
+import numpy as np
+import pandas as pd
+
+
+SUMMARY_VERSION = 2
+
+# row order and names of output_PACIFIC.txt
+REPORT_CLASSES = (('Sars_cov_2', 'SARS-CoV-2'),
+                  ('Coronaviridae', 'Coronaviridae'),
+                  ('Influenza', 'Influenza'),
+                  ('Metapneumovirus', 'Metapneumovirus'),
+                  ('Rhinovirus', 'Rhinovirus'),
+                  ('Human', 'Human'))
+
+# keys that have to match to merge summaries
+MERGE_KEYS = ('version', 'model', 'threshold', 'classes', 'bins')
+
+# bucket of the reads shorter than the smallest length bucket
+SHORT_BUCKET = 'short'
+
+SUMMARY_FILE = 'summary_PACIFIC.json'
+PROBABILITIES_FILE = 'probabilities_PACIFIC.f16'
+NAMES_FILE = 'probabilities_PACIFIC.names'
+
+
+def new_summary(class_names, threshold, model=None, bins=100):
+    '''
+    summary without reads
+    '''
+    n_classes = len(class_names)
+    return {'version': SUMMARY_VERSION,
+            'model': model,
+            'threshold': threshold,
+            'classes': list(class_names),
+            'bins': bins,
+            'total_reads': 0,
+            'discarded_reads': 0,
+            'predicted': [0]*n_classes,
+            'above_threshold': [0]*n_classes,
+            'histograms': [[0]*bins for _ in range(n_classes)],
+            'buckets': {}}
+
+
+def add_predictions(summary, predicted, scores, discarded=0, bucket=None):
+    '''
+    add reads predicted as class index predicted with probability scores,
+    and the reads discarded before prediction, to the counts of the run and
+    of the length bucket
+    '''
+    predicted = np.asarray(predicted, dtype=np.int64)
+    scores = np.asarray(scores, dtype=np.float64)
+    n_classes = len(summary['classes'])
+    bins = summary['bins']
+    summary['total_reads'] += len(predicted) + discarded
+    summary['discarded_reads'] += discarded
+    if bucket is not None:
+        counts = summary['buckets'].setdefault(str(bucket), [0, 0])
+        counts[0] += len(predicted)
+        counts[1] += discarded
+
+    predicted_counts = np.bincount(predicted, minlength=n_classes)
+    above_counts = np.bincount(predicted[scores > summary['threshold']], minlength=n_classes)
+    score_bins = np.minimum((scores*bins).astype(np.int64), bins - 1)
+    histograms = np.bincount(predicted*bins + score_bins, minlength=n_classes*bins).reshape(n_classes, bins)
+
+    summary['predicted'] = (np.array(summary['predicted']) + predicted_counts).tolist()
+    summary['above_threshold'] = (np.array(summary['above_threshold']) + above_counts).tolist()
+    summary['histograms'] = (np.array(summary['histograms']) + histograms).tolist()
+    return summary
+
+
+def new_cascade(confidence, audit):
+    '''
+    counts of a cascade that escalates the reads predicted by the small
+    model below confidence, and audits a fraction audit of the rest
+    '''
+    return {'confidence': confidence,
+            'audit': audit,
+            'reads': 0,
+            'escalated': 0,
+            'changed': 0,
+            'audited': 0,
+            'agreed': 0}
+
+
+def add_cascade(summary, small_predicted, full_predicted, escalated, audited):
+    '''
+    add the reads of a cascade, full_predicted holds the classes of the
+    escalated and audited reads, in their order
+    '''
+    cascade = summary['cascade']
+    small_predicted = np.asarray(small_predicted)
+    full_predicted = np.asarray(full_predicted)
+    escalated = np.asarray(escalated, dtype=bool)
+    audited = np.asarray(audited, dtype=bool)
+    full_rows = escalated[escalated | audited]
+    cascade['reads'] += len(small_predicted)
+    cascade['escalated'] += int(escalated.sum())
+    cascade['changed'] += int((small_predicted[escalated] != full_predicted[full_rows]).sum())
+    cascade['audited'] += int(audited.sum())
+    cascade['agreed'] += int((small_predicted[audited] == full_predicted[~full_rows]).sum())
+    return summary
+
+
+def merge_summaries(summaries):
+    '''
+    summary of all the reads of several summaries
+    '''
+    summaries = list(summaries)
+    merged = json.loads(json.dumps(summaries[0]))
+    for summary in summaries[1:]:
+        for key in MERGE_KEYS:
+            if summary[key] != merged[key]:
+                raise ValueError('Summaries with different '+key+' can not be merged: '+
+                                 str(merged[key])+' and '+str(summary[key]))
+        for key in ('total_reads', 'discarded_reads'):
+            merged[key] += summary[key]
+        for key in ('predicted', 'above_threshold', 'histograms'):
+            merged[key] = (np.array(merged[key]) + np.array(summary[key])).tolist()
+        for bucket, counts in summary['buckets'].items():
+            merged_counts = merged['buckets'].setdefault(bucket, [0, 0])
+            merged['buckets'][bucket] = [merged_counts[0] + counts[0], merged_counts[1] + counts[1]]
+        if ('cascade' in merged) != ('cascade' in summary):
+            raise ValueError('Summaries of runs with and without a cascade can not be merged')
+        if 'cascade' in summary:
+            for key in ('confidence', 'audit'):
+                if summary['cascade'][key] != merged['cascade'][key]:
+                    raise ValueError('Summaries with different cascade '+key+' can not be merged: '+
+                                     str(merged['cascade'][key])+' and '+str(summary['cascade'][key]))
+            for key in ('reads', 'escalated', 'changed', 'audited', 'agreed'):
+                merged['cascade'][key] += summary['cascade'][key]
+    merged['shards'] = sum(i.get('shards', 1) for i in summaries)
+    return merged
+
+
+def save_summary(path, summary):
+    with open(path, 'w') as handle:
+        json.dump(summary, handle, separators=(',', ':'))
+
+
+def load_summary(path):
+    with open(path) as handle:
+        summary = json.load(handle)
+    if summary.get('version') != SUMMARY_VERSION:
+        raise ValueError(path+' has summary version '+str(summary.get('version'))+
+                         ', expected '+str(SUMMARY_VERSION))
+    return summary
+
+
+def summary_report(summary):
+    '''
+    table of output_PACIFIC.txt from the counts of a summary
+    '''
+    threshold = summary['threshold']
+    index = {name: i for i, name in enumerate(summary['classes'])}
+    predicted = np.array([summary['predicted'][index[i]] for i, _ in REPORT_CLASSES], dtype=np.float64)
+    above = np.array([summary['above_threshold'][index[i]] for i, _ in REPORT_CLASSES], dtype=np.float64)
+
+    df_results = pd.DataFrame()
+    df_results['Class'] = [i for _, i in REPORT_CLASSES]
+    df_results['# predicted reads'] = predicted.astype(np.int64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        df_results['# predicted reads (%)'] = predicted/predicted.sum()*100
+        df_results['# predicted reads above '+str(threshold)] = above.astype(np.int64)
+        df_results['# predicted reads above '+str(threshold)+' (%)'] = above/above.sum()*100
+    return df_results
+
+
+def bucket_report(summary):
+    '''
+    classified and discarded reads per length bucket of a summary, the
+    reads of a bucket are truncated to its length
+    '''
+    lengths = sorted(int(i) for i in summary['buckets'] if i != SHORT_BUCKET)
+    keys = [str(i) for i in lengths]
+    names = [str(i) for i in lengths]
+    if SHORT_BUCKET in summary['buckets']:
+        keys = [SHORT_BUCKET] + keys
+        names = ['<'+str(lengths[0]) if lengths else SHORT_BUCKET] + names
+    counts = np.array([summary['buckets'][i] for i in keys], dtype=np.int64).reshape(-1, 2)
+
+    df_buckets = pd.DataFrame()
+    df_buckets['Read length'] = names
+    df_buckets['# classified reads'] = counts[:, 0]
+    df_buckets['# discarded reads'] = counts[:, 1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        df_buckets['# classified reads (%)'] = counts[:, 0]/counts.sum(axis=1)*100
+    return df_buckets
+
+
+def cascade_report(summary):
+    '''
+    escalation rate of the cascade of a summary and its agreement with the
+    full model, the agreement of the confident reads is estimated from the
+    audited reads
+    '''
+    cascade = summary['cascade']
+    reads = cascade['reads']
+    confident = reads - cascade['escalated']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        escalation = np.float64(cascade['escalated'])/reads
+        audit_agreement = np.float64(cascade['agreed'])/cascade['audited']
+        rows = [('Reads', reads),
+                ('Confidence', cascade['confidence']),
+                ('Escalated reads', cascade['escalated']),
+                ('Escalated reads (%)', escalation*100),
+                ('Escalated reads changed by the full model (%)',
+                 np.float64(cascade['changed'])/cascade['escalated']*100),
+                ('Audited confident reads', cascade['audited']),
+                ('Audited agreement with the full model (%)', audit_agreement*100),
+                ('Estimated agreement with the full model (%)',
+                 (cascade['escalated'] + confident*audit_agreement)/reads*100)]
+    return pd.DataFrame(rows, columns=['Cascade', 'Value'])
+
+
+def write_probabilities(handle, names_handle, probabilities, names):
+    '''
+    append the float16 probabilities of a chunk of reads and their ids
+    '''
+    np.asarray(probabilities, dtype=np.float16).tofile(handle)
+    for name in names:
+        print(name, file=names_handle)
+
+
+def load_probabilities(folder, n_classes):
+    '''
+    memory-mapped probabilities of the reads of a run, reads x classes
+    '''
+    return np.memmap(folder+'/'+PROBABILITIES_FILE, dtype=np.float16, mode='r').reshape(-1, n_classes)
+
+
+def resummarize(summary, probabilities, threshold, block_size=1000000):
+    '''
+    summary of a run at another threshold from the probabilities of its reads
+    '''
+    resummary = new_summary(summary['classes'], threshold, summary['model'], summary['bins'])
+    for start in range(0, len(probabilities), block_size):
+        block = np.asarray(probabilities[start:start+block_size], dtype=np.float32)
+        valid = ~np.isnan(block[:, 0])
+        resummary = add_predictions(resummary,
+                                    np.argmax(block[valid], axis=1),
+                                    np.max(block[valid], axis=1),
+                                    discarded=int((~valid).sum()))
+    # the length buckets and the cascade do not change with the threshold
+    resummary['buckets'] = json.loads(json.dumps(summary['buckets']))
+    if 'cascade' in summary:
+        resummary['cascade'] = json.loads(json.dumps(summary['cascade']))
+    return resummary
+
+
+def class_reads(probabilities, class_index, threshold, block_size=1000000):
+    '''
+    rows of the reads predicted as class_index above the threshold
+    '''
+    rows = []
+    for start in range(0, len(probabilities), block_size):
+        block = np.asarray(probabilities[start:start+block_size], dtype=np.float32)
+        valid = ~np.isnan(block[:, 0])
+        selected = np.zeros(len(block), dtype=bool)
+        selected[valid] = ((np.argmax(block[valid], axis=1) == class_index) &
+                           (np.max(block[valid], axis=1) > threshold))
+        rows.append(start + np.flatnonzero(selected))
+    if len(rows) == 0:
+        return np.zeros(0, dtype=np.int64)
+    return np.concatenate(rows)
+
+
+def threshold_sweep(summary, probabilities, thresholds, block_size=1000000):
+    '''
+    reads predicted as every class above every threshold
+    '''
+    n_classes = len(summary['classes'])
+    above = np.zeros((len(thresholds), n_classes), dtype=np.int64)
+    for start in range(0, len(probabilities), block_size):
+        block = np.asarray(probabilities[start:start+block_size], dtype=np.float32)
+        block = block[~np.isnan(block[:, 0])]
+        predicted = np.argmax(block, axis=1)
+        scores = np.max(block, axis=1)
+        for i, threshold in enumerate(thresholds):
+            above[i] += np.bincount(predicted[scores > threshold], minlength=n_classes)
+
+    df_sweep = pd.DataFrame()
+    df_sweep['Threshold'] = list(thresholds)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        percentages = above/above.sum(axis=1, keepdims=True)*100
+    for i, name in enumerate(summary['classes']):
+        df_sweep['# '+name] = above[:, i]
+        df_sweep['# '+name+' (%)'] = percentages[:, i]
+    return df_sweep
+
+
+if __name__ == '__main__':
+
+    import argparse
+    import os
+
+    parser = argparse.ArgumentParser(description=
+                                     """
+                                     This script merges the summaries of several PACIFIC runs
+                                     on shards of the same input into the final report, or
+                                     recomputes the report of a run from the probabilities of
+                                     its reads.
+                                     """)
+    subparsers = parser.add_subparsers(dest='command')
+
+    merge_parser = subparsers.add_parser('merge', help='merge summary_PACIFIC.json files')
+
+    OPTIONAL = merge_parser._action_groups.pop()
+    REQUIRED = merge_parser.add_argument_group('required arguments')
+
+    #Inputs
+    REQUIRED.add_argument("summaries",
+                          help="summary_PACIFIC.json files of the shards",
+                          nargs='+')
+
+    #arguments
+    OPTIONAL.add_argument("-o", "--outputdir",
+                          help='Path to output directory [.]',
+                          metavar='<dir>',
+                          default=".")
+
+    merge_parser._action_groups.append(OPTIONAL)
+
+    resummarize_parser = subparsers.add_parser('resummarize',
+                                               help='report of a PACIFIC run made with -P at another threshold')
+
+    OPTIONAL = resummarize_parser._action_groups.pop()
+    REQUIRED = resummarize_parser.add_argument_group('required arguments')
+
+    #Inputs
+    REQUIRED.add_argument("run",
+                          help="output directory of a PACIFIC run with -P")
+
+    #arguments
+    OPTIONAL.add_argument("-T", "--prediction_threshold",
+                          help='Threshold/cutoff for predictions [threshold of the run]',
+                          metavar='<float>',
+                          default=None,
+                          type=float)
+
+    OPTIONAL.add_argument("-o", "--outputdir",
+                          help='Path to output directory, the files are named by threshold (e.g. output_PACIFIC.T0.9.txt) [run directory]',
+                          metavar='<dir>',
+                          default=None)
+
+    OPTIONAL.add_argument("--extract",
+                          help='Write the ids of the reads predicted as this class above the threshold (can be repeated)',
+                          metavar='<class>',
+                          action='append',
+                          default=[])
+
+    OPTIONAL.add_argument("-i", "--input_file",
+                          help='Input file of the run, --extract writes the reads instead of their ids',
+                          default=None)
+
+    OPTIONAL.add_argument("-f", "--file_type",
+                          help='FASTA or FASTQ input file format [fasta]',
+                          metavar='<fasta/fastq>',
+                          default='fasta')
+
+    OPTIONAL.add_argument("--sweep",
+                          help='Comma separated thresholds of a threshold sweep',
+                          metavar='<floats>',
+                          default=None)
+
+    resummarize_parser._action_groups.append(OPTIONAL)
+
+    ARGS = parser.parse_args()
+    if ARGS.command not in ('merge', 'resummarize'):
+        parser.error('a command is required: merge or resummarize')
+
+    if ARGS.command == 'resummarize' and ARGS.outputdir is None:
+        ARGS.outputdir = ARGS.run
+    if os.path.isdir(ARGS.outputdir) is False:
+        os.makedirs(ARGS.outputdir)
+
+    if ARGS.command == 'merge':
+        # the merged summary never replaces the summary of a shard
+        out_summary = os.path.abspath(ARGS.outputdir+'/'+SUMMARY_FILE)
+        if out_summary in [os.path.abspath(i) for i in ARGS.summaries]:
+            parser.error(out_summary+' is one of the merged summaries, choose another --outputdir')
+        suffix = ''
+        summary = merge_summaries([load_summary(i) for i in ARGS.summaries])
+        print()
+        print('From a total of '+str(summary['total_reads'])+' reads in '+str(summary['shards'])+' shards, '+
+              str(summary['discarded_reads'])+' were discarded, (probabbly due to non-standart nucleotides or too short reads)')
+    else:
+        run_summary = load_summary(ARGS.run+'/'+SUMMARY_FILE)
+        for name in ARGS.extract:
+            if name not in run_summary['classes']:
+                parser.error('--extract '+name+' is not a class of the run: '+', '.join(run_summary['classes']))
+        threshold = run_summary['threshold'] if ARGS.prediction_threshold is None else ARGS.prediction_threshold
+        probabilities = load_probabilities(ARGS.run, len(run_summary['classes']))
+        if len(probabilities) != run_summary['total_reads']:
+            raise ValueError(ARGS.run+'/'+PROBABILITIES_FILE+' has '+str(len(probabilities))+
+                             ' reads, the summary '+str(run_summary['total_reads']))
+        summary = resummarize(run_summary, probabilities, threshold)
+        # named by threshold so the summary and report of the run are kept
+        suffix = '.T{:g}'.format(threshold)
+        print()
+        print('From a total of '+str(summary['total_reads'])+' reads, '+
+              str(summary['discarded_reads'])+' were discarded, (probabbly due to non-standart nucleotides or too short reads)')
+
+        for name in ARGS.extract:
+            rows = set(class_reads(probabilities, run_summary['classes'].index(name), threshold).tolist())
+            if ARGS.input_file is not None:
+                from Bio import SeqIO
+                out_file = ARGS.outputdir+'/'+name+'_PACIFIC'+suffix+'.'+ARGS.file_type
+                records = (i[1] for i in enumerate(SeqIO.parse(ARGS.input_file, ARGS.file_type)) if i[0] in rows)
+                SeqIO.write(records, out_file, ARGS.file_type)
+            else:
+                out_file = ARGS.outputdir+'/'+name+'_PACIFIC'+suffix+'.txt'
+                with open(ARGS.run+'/'+NAMES_FILE) as names, open(out_file, 'w') as output:
+                    for i in enumerate(names):
+                        if i[0] in rows:
+                            output.write(i[1])
+            print('Writting '+str(len(rows))+' '+name+' reads in '+out_file)
+
+        if ARGS.sweep is not None:
+            df_sweep = threshold_sweep(summary, probabilities, [float(i) for i in ARGS.sweep.split(',')])
+            print()
+            print(df_sweep)
+            df_sweep.to_csv(ARGS.outputdir+'/threshold_sweep_PACIFIC'+suffix+'.txt')
+
+    save_summary(ARGS.outputdir+'/summary_PACIFIC'+suffix+'.json', summary)
+    print()
+    print('Writting the summary and reports in '+ARGS.outputdir+'/summary_PACIFIC'+suffix+'.json, output_PACIFIC'+suffix+'.txt ...')
+    df_results = summary_report(summary)
+    print()
+    print(df_results)
+    df_results.to_csv(ARGS.outputdir+'/output_PACIFIC'+suffix+'.txt')
+    df_buckets = bucket_report(summary)
+    print()
+    print(df_buckets)
+    df_buckets.to_csv(ARGS.outputdir+'/output_PACIFIC_buckets'+suffix+'.txt')
+    if 'cascade' in summary:
+        df_cascade = cascade_report(summary)
+        print()
+        print(df_cascade)
+        df_cascade.to_csv(ARGS.outputdir+'/output_PACIFIC_cascade'+suffix+'.txt')
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+On-disk cache of PACIFIC predictions shared by the evaluation scripts.
+
+Predictions of a read file are stored once per combination of input file
+content, model and tokenizer content, k-mer size, read length and number
+of reads, under the SHA-256 of that key:
+
+    <cache_dir>/<key[:2]>/<key>.npz
+
+Every entry is a compressed float16 matrix (one row per read, one column
+per class) with its key as JSON. float16 keeps about 3 significant digits,
+enough for argmax and probability thresholds, at a quarter of the float64
+size. File hashes are remembered by path, size and modification time so
+hitting the cache never reads the FASTQ files again.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+from Bio import SeqIO
+
+
+CACHE_VERSION = 1
+
+# model, tokenizer and table loaded once per process
+LOADED = {}
+
+
+def file_hash(path, cache_dir=None, block_size=1 << 20):
+    '''
+    SHA-256 of the content of a file, remembered in cache_dir/file_hashes.json
+    while its size and modification time do not change
+    '''
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    signature = [stat.st_size, stat.st_mtime_ns]
+    memo = {}
+    memo_path = None
+    if cache_dir is not None:
+        memo_path = cache_dir+'/file_hashes.json'
+        if os.path.isfile(memo_path):
+            with open(memo_path) as handle:
+                memo = json.load(handle)
+        if path in memo and memo[path]['signature'] == signature:
+            return memo[path]['sha256']
+
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as handle:
+        for block in iter(lambda: handle.read(block_size), b''):
+            sha256.update(block)
+    digest = sha256.hexdigest()
+
+    if memo_path is not None:
+        memo[path] = {'signature': signature, 'sha256': digest}
+        with open(memo_path+'.tmp.'+str(os.getpid()), 'w') as handle:
+            json.dump(memo, handle, indent=1)
+        os.replace(memo_path+'.tmp.'+str(os.getpid()), memo_path)
+    return digest
+
+
+def prediction_key(input_file, model_file, tokenizer_file, k, read_length, number_reads, cache_dir=None):
+    '''
+    key of the predictions of a read file and its SHA-256
+    '''
+    key = {'version': CACHE_VERSION,
+           'input': file_hash(input_file, cache_dir),
+           'model': file_hash(model_file, cache_dir),
+           'tokenizer': file_hash(tokenizer_file, cache_dir),
+           'k_mers': k,
+           'read_length': read_length,
+           'number_reads': number_reads
+           }
+    return key, hashlib.sha256(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def entry_path(cache_dir, digest):
+    return cache_dir+'/'+digest[:2]+'/'+digest+'.npz'
+
+
+def load_entry(cache_dir, digest):
+    '''
+    cached predictions as float32, None if they are not in the cache
+    '''
+    path = entry_path(cache_dir, digest)
+    if os.path.isfile(path) is False:
+        return None
+    with np.load(path) as entry:
+        return entry['predictions'].astype(np.float32)
+
+
+def save_entry(cache_dir, digest, key, predictions):
+    '''
+    store compressed float16 predictions, written to a temporary file first
+    so concurrent scripts never read a truncated entry
+    '''
+    path = entry_path(cache_dir, digest)
+    if os.path.isdir(os.path.dirname(path)) is False:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path+'.tmp.'+str(os.getpid())
+    with open(tmp_path, 'wb') as handle:
+        np.savez_compressed(handle,
+                            predictions=np.asarray(predictions, dtype=np.float16),
+                            key=np.array(json.dumps(key, sort_keys=True)))
+    os.replace(tmp_path, path)
+
+
+def read_sequences(file, number_reads, read_length, file_type):
+    '''
+    first number_reads reads of at least read_length bp without N, truncated
+    to read_length, as selected by the evaluation scripts
+    '''
+    reads = []
+    with open(file) as handle:
+        for fasta in SeqIO.parse(handle, file_type):
+            sequence = str(fasta.seq)
+            if len(sequence) >= read_length and 'N' not in sequence:
+                reads.append(sequence[:read_length].upper())
+                if len(reads) == number_reads:
+                    break
+    return reads
+
+
+def load_pacific(model_file, tokenizer_file):
+    '''
+    model, k-mer table, k and canonical flag of a PACIFIC model, loaded once
+    '''
+    if (model_file, tokenizer_file) not in LOADED:
+        import pickle
+        from keras.models import load_model
+        from pacific_models import load_metadata
+        from kmer_vocabulary import tokenizer_table
+
+        metadata = load_metadata(model_file)
+        k = metadata.get('k_mers', 9)
+        with open(tokenizer_file, 'rb') as handle:
+            tokenizer = pickle.load(handle)
+        LOADED[(model_file, tokenizer_file)] = (load_model(model_file),
+                                                tokenizer_table(tokenizer, k),
+                                                k,
+                                                metadata.get('canonical', False))
+    return LOADED[(model_file, tokenizer_file)]
+
+
+def cached_predict(input_file,
+                   model_file,
+                   tokenizer_file,
+                   number_reads,
+                   cache_dir,
+                   read_length=150,
+                   file_type='fastq',
+                   batch_size=1024):
+    '''
+    predictions of the first number_reads reads of input_file, computed with
+    the model only when they are not in the cache
+    '''
+    from pacific_models import load_metadata
+
+    if os.path.isdir(cache_dir) is False:
+        os.makedirs(cache_dir, exist_ok=True)
+    k = load_metadata(model_file).get('k_mers', 9)
+    key, digest = prediction_key(input_file,
+                                 model_file,
+                                 tokenizer_file,
+                                 k,
+                                 read_length,
+                                 number_reads,
+                                 cache_dir)
+    predictions = load_entry(cache_dir, digest)
+    if predictions is not None:
+        print('Using cached predictions of '+input_file)
+        return predictions
+
+    from kmer_vocabulary import encode_reads, tokenize_reads
+
+    print('Predicting '+input_file)
+    model, kmer_table, k, canonical = load_pacific(model_file, tokenizer_file)
+    reads = read_sequences(input_file, number_reads, read_length, file_type)
+    sequences = tokenize_reads(encode_reads(reads, read_length), kmer_table, k, canonical)
+    predictions = model.predict(sequences, batch_size=batch_size)
+    save_entry(cache_dir, digest, key, predictions)
+    # return the stored float16 values so a first and a cached run agree
+    return load_entry(cache_dir, digest)
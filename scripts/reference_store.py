@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Packed 2-bit store of reference genomes, memory-mapped for read sampling.
+
+A store <prefix> is made of three files:
+
+    <prefix>.2bit         all genomes concatenated, 4 bases per byte
+                          (A=0, C=1, G=2, T=3, first base in the high bits)
+    <prefix>.index.npz    offset and length of every genome in the
+                          concatenation and the [start, end) runs of
+                          non-standard nucleotides, which 2 bits can not hold
+    <prefix>.genomes.tsv  seqid, length, taxid, organism, lineage and
+                          PACIFIC class of every genome
+
+The classes come from the seqid.vs.genomeinfo table used by
+generaterandomreads.pl (seqid in the third column, then taxid, assembly,
+organism and lineage), matching CLASS_RULES against organism and lineage,
+or are fixed for whole fasta files (e.g. Human). Genomes of no class are
+kept with class "other".
+
+store_references returns the genomes of some classes in the layout of
+synthetic_reads.load_references, backed by the memory map, so
+epoch_plan, sample_reads and kmer_counts sample windows of any number of
+genomes without loading the store in memory.
+
+Build a store with:
+
+    python reference_store.py --fasta virus.genbank.20200324.fa \\
+                              --genome_info seqid.vs.genomeinfo.txt \\
+                              --class_fasta Human:GRCh38.fa.gz \\
+                              --out pacific_references
+"""
+
+import gzip
+import os
+
+import numpy as np
+import pandas as pd
+from Bio import SeqIO
+
+from synthetic_reads import encode_sequence
+
+
+# first match wins, SARS-CoV-2 before the rest of the Coronaviridae
+CLASS_RULES = (('Sars_cov_2', 'Severe acute respiratory syndrome coronavirus 2'),
+               ('Coronaviridae', 'Coronaviridae'),
+               ('Influenza', 'Influenza'),
+               ('Metapneumovirus', 'Metapneumovirus'),
+               ('Rhinovirus', 'Rhinovirus'))
+
+OTHER_CLASS = 'other'
+
+SHIFTS = np.array([6, 4, 2, 0], dtype=np.uint8)
+
+
+def pack_codes(codes):
+    '''
+    pack 2-bit codes, 4 per byte (len(codes) should be a multiple of 4),
+    non-standard nucleotides are packed as A
+    '''
+    codes = (codes & 3).reshape(-1, 4)
+    return (codes << SHIFTS).sum(axis=1).astype(np.uint8)
+
+
+def unpack_bases(packed, positions):
+    '''
+    2-bit code of the bases at positions (any shape) of a packed array
+    '''
+    positions = np.asarray(positions, dtype=np.int64)
+    shifts = (3 - (positions & 3))*2
+    return ((packed[positions >> 2] >> shifts.astype(np.uint8)) & 3).astype(np.uint8)
+
+
+def mask_runs(codes, positions, n_starts, n_ends):
+    '''
+    set to 4 the codes at positions inside the runs of non-standard nucleotides
+    '''
+    if len(n_starts) == 0:
+        return codes
+    run = np.searchsorted(n_ends, positions, side='right')
+    inside = run < len(n_starts)
+    inside[inside] = n_starts[run[inside]] <= positions[inside]
+    codes[inside] = 4
+    return codes
+
+
+def classify_lineage(organism, lineage, rules=CLASS_RULES):
+    '''
+    PACIFIC class of a genome from its organism and lineage
+    '''
+    text = str(organism)+'; '+str(lineage)
+    for class_name, pattern in rules:
+        if pattern in text:
+            return class_name
+    return OTHER_CLASS
+
+
+def read_genome_info(file, rules=CLASS_RULES):
+    '''
+    seqid -> (taxid, organism, lineage, class) of a seqid.vs.genomeinfo table
+    '''
+    table = pd.read_csv(file, sep='\t', dtype=str)
+    table = table[table['V1'] != 'V1']
+    info = {}
+    for seqid, taxid, organism, lineage in zip(table['V3'], table['taxid'], table['organism'], table['lineage']):
+        info[seqid] = (taxid, organism, lineage, classify_lineage(organism, lineage, rules))
+    return info
+
+
+def open_fasta(file):
+    if file.endswith('.gz'):
+        return gzip.open(file, 'rt')
+    return open(file)
+
+
+def build_store(prefix, fasta_files, genome_info=None, class_fastas=(), file_type='fasta', rules=CLASS_RULES):
+    '''
+    pack the genomes of fasta_files, classified with the genome_info table,
+    and of class_fastas, a list of (class name, fasta file), in a store
+    '''
+    info = read_genome_info(genome_info, rules) if genome_info is not None else {}
+    inputs = [(None, i) for i in fasta_files] + list(class_fastas)
+
+    rows = []
+    offsets = []
+    lengths = []
+    n_starts = []
+    n_ends = []
+    position = 0
+    carry = np.zeros(0, dtype=np.uint8)
+    with open(prefix+'.2bit', 'wb') as out:
+        for class_name, file in inputs:
+            with open_fasta(file) as handle:
+                for fasta in SeqIO.parse(handle, file_type):
+                    codes = encode_sequence(str(fasta.seq))
+                    taxid, organism, lineage, genome_class = info.get(fasta.id, ('', '', '', OTHER_CLASS))
+                    if class_name is not None:
+                        genome_class = class_name
+                    rows.append((fasta.id, len(codes), taxid, organism, lineage, genome_class))
+                    offsets.append(position)
+                    lengths.append(len(codes))
+
+                    # runs of non-standard nucleotides in global coordinates
+                    bad = np.concatenate(([0], (codes > 3).astype(np.int8), [0]))
+                    edges = np.flatnonzero(np.diff(bad))
+                    n_starts.append(position + edges[0::2])
+                    n_ends.append(position + edges[1::2])
+
+                    codes = np.concatenate((carry, codes))
+                    full = len(codes) - len(codes) % 4
+                    pack_codes(codes[:full]).tofile(out)
+                    carry = codes[full:]
+                    position += lengths[-1]
+            print('Packed '+file)
+        if len(carry) > 0:
+            pack_codes(np.concatenate((carry, np.zeros(4 - len(carry), dtype=np.uint8)))).tofile(out)
+
+    np.savez(prefix+'.index.npz',
+             offsets=np.array(offsets, dtype=np.int64),
+             lengths=np.array(lengths, dtype=np.int64),
+             n_starts=np.concatenate(n_starts).astype(np.int64) if n_starts else np.zeros(0, dtype=np.int64),
+             n_ends=np.concatenate(n_ends).astype(np.int64) if n_ends else np.zeros(0, dtype=np.int64))
+    table = pd.DataFrame(rows, columns=['seqid', 'length', 'taxid', 'organism', 'lineage', 'class'])
+    table.to_csv(prefix+'.genomes.tsv', sep='\t', index=False)
+    print('Stored '+str(len(rows))+' genomes, '+str(position)+' bp in '+str(os.path.getsize(prefix+'.2bit'))+' bytes')
+    return table
+
+
+def open_store(prefix):
+    '''
+    memory-mapped packed genomes, index and genome table of a store
+    '''
+    with np.load(prefix+'.index.npz') as index:
+        store = {i: index[i] for i in index.files}
+    store['packed'] = np.memmap(prefix+'.2bit', dtype=np.uint8, mode='r')
+    store['table'] = pd.read_csv(prefix+'.genomes.tsv', sep='\t', dtype={'seqid': str, 'taxid': str})
+    return store
+
+
+def store_references(store, class_names):
+    '''
+    genomes of class_names in the layout of synthetic_reads.load_references,
+    classes[i] is the position of the class of genome i in class_names
+    '''
+    table = store['table']
+    selected = np.flatnonzero(table['class'].isin(class_names).values)
+    class_index = {name: i for i, name in enumerate(class_names)}
+    for name in class_names:
+        print('Loaded '+str((table['class'].values[selected] == name).sum())+' '+name+' genomes')
+    return {'packed': store['packed'],
+            'n_starts': store['n_starts'],
+            'n_ends': store['n_ends'],
+            'offsets': store['offsets'][selected],
+            'lengths': store['lengths'][selected],
+            'classes': np.array([class_index[i] for i in table['class'].values[selected]], dtype=np.int64),
+            'names': list(table['seqid'].values[selected]),
+            'class_names': list(class_names)
+            }
+
+
+def packed_bases(references, positions):
+    '''
+    codes of the bases at global positions (array or slice) of the
+    references of a store, 4 for non-standard nucleotides
+    '''
+    if isinstance(positions, slice):
+        positions = np.arange(positions.start, positions.stop, dtype=np.int64)
+    positions = np.asarray(positions, dtype=np.int64)
+    codes = unpack_bases(references['packed'], positions)
+    return mask_runs(codes, positions, references['n_starts'], references['n_ends'])
+
+
+if __name__ == '__main__':
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description=
+                                     """
+                                     This script packs reference genomes in a 2-bit memory-mapped
+                                     store with their taxid, lineage and PACIFIC class.
+                                     """)
+
+    OPTIONAL = parser._action_groups.pop()
+    REQUIRED = parser.add_argument_group('required arguments')
+
+    #Inputs
+    REQUIRED.add_argument("--out",
+                          help="prefix of the store files",
+                          required=True)
+
+    #arguments
+    OPTIONAL.add_argument("--fasta",
+                          help='fasta files (plain or gzip) classified with --genome_info',
+                          action='append',
+                          default=[])
+
+    OPTIONAL.add_argument("--genome_info",
+                          help='seqid.vs.genomeinfo table with the taxid, organism and lineage of every seqid',
+                          default=None)
+
+    OPTIONAL.add_argument("--class_fasta",
+                          help='<class>:<fasta file>, every genome of the file belongs to the class (e.g. Human:GRCh38.fa.gz)',
+                          action='append',
+                          default=[])
+
+    OPTIONAL.add_argument("--file_type",
+                          help='fasta or fastq (all files should have same format)',
+                          default='fasta')
+
+    parser._action_groups.append(OPTIONAL)
+
+    ARGS = parser.parse_args()
+
+    if len(ARGS.fasta) == 0 and len(ARGS.class_fasta) == 0:
+        parser.error('at least one --fasta or --class_fasta is required')
+
+    class_fastas = [tuple(i.split(':', 1)) for i in ARGS.class_fasta]
+    table = build_store(ARGS.out, ARGS.fasta, ARGS.genome_info, class_fastas, ARGS.file_type)
+    print(table.groupby('class')['length'].agg(['count', 'sum']))
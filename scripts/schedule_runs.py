@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Run PACIFIC.py on every run of an SRA run table with local read files.
+
+The manifest is an SRA RunInfo table (e.g. metadata/SRA.RunInfo.20200330.tab),
+the reads of run <Run> are looked up in the data folder as <Run>.<ext> for
+single-end runs and <Run>_1.<ext>, <Run>_2.<ext> for paired-end runs, ext
+being fastq, fq, fasta or fa. Every run gets a read mode from its layout and
+read length (single/paired, short/long: Nanopore and PacBio runs or spots
+longer than --long_reads bp per mate) and a cost from its Bases (file size
+when missing). Jobs start largest first on --workers local slots, which
+keeps the batch from ending on one large run.
+
+The read mode sets the PACIFIC.py arguments of the run (MODE_ARGS, before
+--pacific_args, which override them). Short reads are predicted in length
+buckets, so trimmed reads are not discarded. The models classify 150 bp,
+so long reads are truncated to their first 150 bp and read in smaller
+chunks. Every read file of a run (both mates of paired runs) is predicted
+on its own, then the summaries of the files are merged in the summary and
+report of the run, <out_folder>/<Run>/summary_PACIFIC.json and
+output_PACIFIC.txt, where every mate counts as a read.
+
+The status of every run (pending, running, done, failed, missing), its
+slot, run time, return code and throughput (bases/sec) are kept in a SQLite
+database in the output folder, so an interrupted batch restarts where it
+stopped: finished runs are skipped and runs left running are started again.
+"""
+
+import argparse
+
+parser = argparse.ArgumentParser(description=
+                                 """
+                                 This script runs PACIFIC on every run of an SRA run table
+                                 on several local worker slots, largest runs first, keeping
+                                 the status and throughput of every run in a SQLite database.
+                                 """)
+
+OPTIONAL = parser._action_groups.pop()
+REQUIRED = parser.add_argument_group('required arguments')
+
+#Inputs
+REQUIRED.add_argument("--manifest",
+                      help="SRA RunInfo table (tab separated) of the runs to process",
+                      required=True)
+
+REQUIRED.add_argument("--data_folder",
+                      help="folder with the read files of the runs",
+                      required=True)
+
+REQUIRED.add_argument("-m", "--model",
+                      help="PACIFIC model file path",
+                      required=True)
+
+REQUIRED.add_argument("-t", "--tokenizer",
+                      help="Tokenizer file path",
+                      required=True)
+
+REQUIRED.add_argument("-l", "--label_maker",
+                      help="Label maker object file path",
+                      required=True)
+
+#arguments
+OPTIONAL.add_argument("--out_folder",
+                      help='path to the output folder, one sub folder per run',
+                      default="./")
+
+OPTIONAL.add_argument("--state_db",
+                      help='SQLite database with the status of every run [<out_folder>/pacific_runs.sqlite]',
+                      default=None)
+
+OPTIONAL.add_argument("--workers",
+                      help='Number of runs processed at the same time',
+                      default=2,
+                      type=int)
+
+OPTIONAL.add_argument("--long_reads",
+                      help='Runs with more bp per read (per mate for paired-end runs) are long read runs',
+                      default=400,
+                      type=int)
+
+OPTIONAL.add_argument("--modes",
+                      help='Read modes to process (single_short, single_long, paired_short, paired_long) [all]',
+                      default=None)
+
+OPTIONAL.add_argument("--pacific_args",
+                      help='Extra arguments of PACIFIC.py, e.g. "-T 0.9 -c 20000", they override the arguments of the read mode',
+                      default='')
+
+OPTIONAL.add_argument("--retry_failed",
+                      help='Run again the runs that failed in a previous batch',
+                      default=False,
+                      action='store_true')
+
+OPTIONAL.add_argument("--dry_run",
+                      help='Only print the planned jobs and slots',
+                      default=False,
+                      action='store_true')
+
+parser._action_groups.append(OPTIONAL)
+
+ARGS = parser.parse_args()
+
+import os
+
+# Inputs, absolute because every PACIFIC.py runs in its output folder
+MANIFEST = ARGS.manifest
+DATA_FOLDER = os.path.abspath(ARGS.data_folder)
+MODEL = os.path.abspath(ARGS.model)
+TOKENIZER = os.path.abspath(ARGS.tokenizer)
+LABEL_MAKER = os.path.abspath(ARGS.label_maker)
+
+# Arguments
+OUT_FOLDER = os.path.abspath(ARGS.out_folder)
+STATE_DB = ARGS.state_db if ARGS.state_db is not None else OUT_FOLDER+'/pacific_runs.sqlite'
+WORKERS = ARGS.workers
+LONG_READS = ARGS.long_reads
+MODES = ARGS.modes.split(',') if ARGS.modes is not None else None
+PACIFIC_ARGS = ARGS.pacific_args.split()
+RETRY_FAILED = ARGS.retry_failed
+DRY_RUN = ARGS.dry_run
+
+
+import sqlite3
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from pacific_summary import load_summary, merge_summaries, save_summary, summary_report, bucket_report
+
+
+EXTENSIONS = (('fastq', 'fastq'), ('fq', 'fastq'), ('fasta', 'fasta'), ('fa', 'fasta'))
+
+LONG_PLATFORMS = ('OXFORD_NANOPORE', 'PACBIO_SMRT')
+
+# PACIFIC.py arguments of every read mode
+MODE_ARGS = {'single_short': ['-b', '75,100,125,150'],
+             'paired_short': ['-b', '75,100,125,150'],
+             'single_long': ['-b', '150', '-c', '5000'],
+             'paired_long': ['-b', '150', '-c', '5000']}
+
+if MODES is not None and not set(MODES) <= set(MODE_ARGS):
+    parser.error('Unknown read modes in --modes: '+', '.join(sorted(set(MODES) - set(MODE_ARGS)))+
+                 ' (use '+', '.join(sorted(MODE_ARGS))+')')
+
+PACIFIC = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'PACIFIC.py')
+
+
+def open_state(path):
+    '''
+    SQLite database with one row per run
+    '''
+    connection = sqlite3.connect(path)
+    connection.execute('''CREATE TABLE IF NOT EXISTS runs (
+                              run TEXT PRIMARY KEY,
+                              mode TEXT,
+                              files TEXT,
+                              file_type TEXT,
+                              bases INTEGER,
+                              status TEXT,
+                              slot INTEGER,
+                              started REAL,
+                              finished REAL,
+                              seconds REAL,
+                              bases_per_second REAL,
+                              returncode INTEGER,
+                              log TEXT)''')
+    connection.commit()
+    return connection
+
+
+def read_files(data_folder, run, layout):
+    '''
+    read files of a run and their format, None when they are not found
+    '''
+    names = [run+'_1', run+'_2'] if layout == 'PAIRED' else [run]
+    for extension, file_type in EXTENSIONS:
+        files = [data_folder+'/'+i+'.'+extension for i in names]
+        if all(os.path.isfile(i) for i in files):
+            return files, file_type
+    # paired runs stored as a single (interleaved or merged) file
+    if layout == 'PAIRED':
+        return read_files(data_folder, run, 'SINGLE')
+    return None, None
+
+
+def read_mode(layout, platform, spot_length, long_reads):
+    '''
+    single/paired and short/long read mode of a run
+    '''
+    layout = 'paired' if str(layout).upper() == 'PAIRED' else 'single'
+    read_length = spot_length/2 if layout == 'paired' else spot_length
+    if str(platform).upper() in LONG_PLATFORMS or read_length > long_reads:
+        return layout+'_long'
+    return layout+'_short'
+
+
+def read_manifest(manifest, data_folder, long_reads):
+    '''
+    runs of the manifest with their read mode, files and cost
+    '''
+    table = pd.read_csv(manifest, sep='\t', low_memory=False)
+    runs = []
+    for _, row in table.iterrows():
+        files, file_type = read_files(data_folder, row['Run'], row.get('LibraryLayout', 'SINGLE'))
+        bases = row.get('Bases', np.nan)
+        if pd.isnull(bases) and files is not None:
+            bases = sum(os.path.getsize(i) for i in files)
+        runs.append({'run': row['Run'],
+                     'mode': read_mode(row.get('LibraryLayout', 'SINGLE'),
+                                       row.get('Platform', ''),
+                                       row.get('AvgSpotLen', 0) if pd.notnull(row.get('AvgSpotLen', 0)) else 0,
+                                       long_reads),
+                     'files': files,
+                     'file_type': file_type,
+                     'bases': int(bases) if pd.notnull(bases) else 0})
+    return runs
+
+
+def update_state(connection, runs, retry_failed):
+    '''
+    add the new runs to the database, runs left running by an interrupted
+    batch (and failed runs with retry_failed) become pending again
+    '''
+    for run in runs:
+        status = 'pending' if run['files'] is not None else 'missing'
+        connection.execute('''INSERT OR IGNORE INTO runs (run, mode, files, file_type, bases, status)
+                              VALUES (?, ?, ?, ?, ?, ?)''',
+                           (run['run'], run['mode'], ','.join(run['files'] or []), run['file_type'], run['bases'], status))
+        if run['files'] is not None:
+            connection.execute('''UPDATE runs SET files = ?, file_type = ?, status = 'pending'
+                                  WHERE run = ? AND status = 'missing' ''',
+                               (','.join(run['files']), run['file_type'], run['run']))
+    connection.execute("UPDATE runs SET status = 'pending' WHERE status = 'running'")
+    if retry_failed:
+        connection.execute("UPDATE runs SET status = 'pending' WHERE status = 'failed'")
+    connection.commit()
+
+
+def pending_jobs(connection, runs, modes):
+    '''
+    pending runs of the manifest, largest first
+    '''
+    names = set(i['run'] for i in runs)
+    rows = connection.execute('''SELECT run, mode, files, file_type, bases FROM runs
+                                 WHERE status = 'pending' ORDER BY bases DESC''').fetchall()
+    return [{'run': run, 'mode': mode, 'files': files.split(','), 'file_type': file_type, 'bases': bases}
+            for run, mode, files, file_type, bases in rows
+            if run in names and (modes is None or mode in modes)]
+
+
+def plan_slots(jobs, workers):
+    '''
+    slot of every job when the largest pending job always starts on the
+    least loaded slot, and the planned load of every slot
+    '''
+    load = np.zeros(workers)
+    slots = []
+    for job in jobs:
+        slot = int(np.argmin(load))
+        slots.append(slot)
+        load[slot] += job['bases']
+    return slots, load
+
+
+def job_commands(job):
+    '''
+    PACIFIC.py command of every read file of a job
+    '''
+    commands = []
+    for file in job['files']:
+        name = os.path.basename(file).split('.')[0]
+        out_dir = OUT_FOLDER+'/'+job['run']+'/'+name
+        commands.append((out_dir, [sys.executable, PACIFIC,
+                                   '-i', os.path.abspath(file),
+                                   '-m', MODEL,
+                                   '-t', TOKENIZER,
+                                   '-l', LABEL_MAKER,
+                                   '-f', job['file_type'],
+                                   '-o', out_dir] + MODE_ARGS[job['mode']] + PACIFIC_ARGS))
+    return commands
+
+
+def merge_run(job):
+    '''
+    summary and report of a run from the summaries of its read files
+    '''
+    summary = merge_summaries([load_summary(i+'/summary_PACIFIC.json') for i in job['out_dirs']])
+    run_dir = OUT_FOLDER+'/'+job['run']
+    save_summary(run_dir+'/summary_PACIFIC.json', summary)
+    summary_report(summary).to_csv(run_dir+'/output_PACIFIC.txt')
+    bucket_report(summary).to_csv(run_dir+'/output_PACIFIC_buckets.txt')
+    return summary
+
+
+def start_command(job):
+    '''
+    start the next command of a job, its output goes to the job log
+    '''
+    out_dir, command = job['commands'].pop(0)
+    if os.path.isdir(out_dir) is False:
+        os.makedirs(out_dir)
+    if 'log_handle' not in job:
+        job['log_handle'] = open(job['log'], 'a')
+    print(' '.join(command), file=job['log_handle'], flush=True)
+    job['process'] = subprocess.Popen(command, stdout=job['log_handle'], stderr=subprocess.STDOUT, cwd=out_dir)
+
+
+def run_jobs(connection, jobs, workers, poll=5):
+    '''
+    run the jobs on the worker slots, largest first, recording their status
+    '''
+    queue = list(jobs)
+    running = {}
+    while len(queue) > 0 or len(running) > 0:
+        for slot in range(workers):
+            if slot in running or len(queue) == 0:
+                continue
+            job = queue.pop(0)
+            job['commands'] = job_commands(job)
+            job['out_dirs'] = [i[0] for i in job['commands']]
+            job['log'] = OUT_FOLDER+'/'+job['run']+'.log'
+            if os.path.isdir(OUT_FOLDER+'/'+job['run']) is False:
+                os.makedirs(OUT_FOLDER+'/'+job['run'])
+            job['started'] = time.time()
+            connection.execute('''UPDATE runs SET status = 'running', slot = ?, started = ?, log = ?
+                                  WHERE run = ?''', (slot, job['started'], job['log'], job['run']))
+            connection.commit()
+            print('Starting '+job['run']+' ('+job['mode']+', '+str(job['bases'])+' bases) on slot '+str(slot))
+            start_command(job)
+            running[slot] = job
+
+        time.sleep(poll)
+        for slot, job in list(running.items()):
+            returncode = job['process'].poll()
+            if returncode is None:
+                continue
+            if returncode == 0 and len(job['commands']) > 0:
+                start_command(job)
+                continue
+            if returncode == 0:
+                try:
+                    merge_run(job)
+                except (IOError, ValueError) as error:
+                    print('Merging the summaries failed: '+str(error), file=job['log_handle'], flush=True)
+                    returncode = -1
+            job['log_handle'].close()
+            finished = time.time()
+            seconds = finished - job['started']
+            status = 'done' if returncode == 0 else 'failed'
+            connection.execute('''UPDATE runs SET status = ?, finished = ?, seconds = ?,
+                                  bases_per_second = ?, returncode = ? WHERE run = ?''',
+                               (status, finished, seconds, job['bases']/max(seconds, 1e-9), returncode, job['run']))
+            connection.commit()
+            print(job['run']+' '+status+' in '+str(round(seconds, 1))+' s')
+            del running[slot]
+
+
+if __name__ == '__main__':
+
+    if os.path.isdir(OUT_FOLDER) is False:
+        os.makedirs(OUT_FOLDER)
+
+    runs = read_manifest(MANIFEST, DATA_FOLDER, LONG_READS)
+    connection = open_state(STATE_DB)
+    update_state(connection, runs, RETRY_FAILED)
+
+    summary = pd.read_sql_query('SELECT mode, status, COUNT(*) AS runs, SUM(bases) AS bases FROM runs GROUP BY mode, status',
+                                connection)
+    print(summary)
+
+    jobs = pending_jobs(connection, runs, MODES)
+    slots, load = plan_slots(jobs, WORKERS)
+    print(str(len(jobs))+' runs to process on '+str(WORKERS)+' slots')
+    if DRY_RUN is True:
+        for job, slot in zip(jobs, slots):
+            print(job['run']+'\t'+job['mode']+'\t'+str(job['bases'])+'\tslot '+str(slot))
+        print('Planned bases per slot: '+', '.join(str(int(i)) for i in load))
+        sys.exit()
+
+    run_jobs(connection, jobs, WORKERS)
+
+    throughput = pd.read_sql_query('''SELECT mode, COUNT(*) AS runs, SUM(bases)/SUM(seconds) AS bases_per_second
+                                      FROM runs WHERE status = 'done' GROUP BY mode''', connection)
+    print(throughput)
+    connection.close()
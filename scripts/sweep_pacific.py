@@ -0,0 +1,473 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Hyperparameter sweep of PACIFIC.
+
+Trains a grid or a random sample of configurations (architecture, kernel
+size, filters, pool size, LSTM size, batch size, k-mer size and k-mer
+vocabulary) in parallel worker processes on a shared cached dataset. For
+every trial it records the validation accuracy and the model size, then
+loads the saved model in a fresh process to measure the load time, the
+inference memory and the CPU throughput (reads/sec), and writes the
+latency/accuracy Pareto front to choose a faster production model.
+
+Vocabularies are given as full, observed, observed:<min_count> (rarer
+k-mers share the out of vocabulary row) or hashed:<buckets>.
+"""
+
+import argparse
+
+parser = argparse.ArgumentParser(description=
+                                 """
+                                 This script runs a hyperparameter sweep of PACIFIC
+                                 and reports validation accuracy, CPU reads/sec and model size
+                                 of every trial with the accuracy/throughput Pareto front.
+                                 Parameter values are given as comma separated lists.
+                                 """)
+
+OPTIONAL = parser._action_groups.pop()
+REQUIRED = parser.add_argument_group('required arguments')
+
+#Inputs
+REQUIRED.add_argument("--Coronaviridae_reads",
+                      help="file path to folder containing Coronaviridae fasta files",
+                      required=True)
+
+REQUIRED.add_argument("--Influenza_reads",
+                      help="file path to folder containing Influenza fasta files",
+                      required=True)
+
+REQUIRED.add_argument("--Metapneumovirus_reads",
+                      help="file path to folder containing Metapneumovirus fasta files",
+                      required=True)
+
+REQUIRED.add_argument("--Rhinovirus_reads",
+                      help="file path to folder containing Rhinovirus fasta files",
+                      required=True)
+
+REQUIRED.add_argument("--Sars_cov_2_reads",
+                      help="file path to folder containing SARS-CoV-2 fasta files",
+                      required=True)
+
+REQUIRED.add_argument("--Human_reads",
+                      help="file path to folder containing Human fasta files",
+                      required=True)
+
+#arguments
+OPTIONAL.add_argument("--out_folder",
+                      help='path to the output folder',
+                      default="./")
+
+OPTIONAL.add_argument("--cache_dir",
+                      help='folder of the cached dataset shared by the trials [<out_folder>/sweep_cache]',
+                      default=None)
+
+OPTIONAL.add_argument("--file_type",
+                      help='fasta or fastq training files format (all files should have same format)',
+                      default='fasta')
+
+OPTIONAL.add_argument("--class_cap",
+                      help='Number of reads sampled per class for the sweep dataset',
+                      default=20000,
+                      type=int)
+
+OPTIONAL.add_argument("--read_length",
+                      help='Reads are truncated to this length, shorter reads are discarded',
+                      default=150,
+                      type=int)
+
+OPTIONAL.add_argument("--k_mers",
+                      help='K-mer sizes',
+                      default='9')
+
+OPTIONAL.add_argument("--vocabulary",
+                      help='K-mer vocabularies (full, observed, observed:<min_count>, hashed:<buckets>)',
+                      default='observed')
+
+OPTIONAL.add_argument("--architecture",
+                      help='Model architectures (bilstm, small_bilstm, gru, cnn)',
+                      default='bilstm')
+
+OPTIONAL.add_argument("--kernel_size",
+                      help='Convolution kernel sizes',
+                      default='3')
+
+OPTIONAL.add_argument("--filters",
+                      help='Numbers of convolution filters',
+                      default='128')
+
+OPTIONAL.add_argument("--pool_size",
+                      help='Max pooling sizes',
+                      default='3')
+
+OPTIONAL.add_argument("--lstm_output_size",
+                      help='LSTM sizes',
+                      default='70')
+
+OPTIONAL.add_argument("--batch_size",
+                      help='Training batch sizes',
+                      default='30')
+
+OPTIONAL.add_argument("--search",
+                      help='grid: every combination, random: --n_trials random combinations',
+                      default='grid',
+                      choices=['grid', 'random'])
+
+OPTIONAL.add_argument("--n_trials",
+                      help='Number of trials of the random search',
+                      default=20,
+                      type=int)
+
+OPTIONAL.add_argument("--epochs",
+                      help='Training epochs per trial',
+                      default=1,
+                      type=int)
+
+OPTIONAL.add_argument("--validation_split",
+                      help='Fraction of the dataset used to measure accuracy',
+                      default=0.10,
+                      type=float)
+
+OPTIONAL.add_argument("--workers",
+                      help='Number of trials trained in parallel',
+                      default=2,
+                      type=int)
+
+OPTIONAL.add_argument("--threads_per_trial",
+                      help='TensorFlow threads used by every trial',
+                      default=4,
+                      type=int)
+
+OPTIONAL.add_argument("--benchmark_reads",
+                      help='Number of validation reads used to measure the inference throughput',
+                      default=10000,
+                      type=int)
+
+OPTIONAL.add_argument("--predict_batch_size",
+                      help='Batch size of the inference benchmark (PACIFIC.py uses the Keras default, 32)',
+                      default=32,
+                      type=int)
+
+parser._action_groups.append(OPTIONAL)
+
+ARGS = parser.parse_args()
+
+# Inputs
+CORONAVIRIDAE_READS = ARGS.Coronaviridae_reads
+INFLUENZA_READS = ARGS.Influenza_reads
+METAPMEUMOVIRUS_READS = ARGS.Metapneumovirus_reads
+RHINOVIRUS_READS = ARGS.Rhinovirus_reads
+SARS_COV_2_READS = ARGS.Sars_cov_2_reads
+HUMAN_READS = ARGS.Human_reads
+
+# Arguments
+OUT_FOLDER = ARGS.out_folder
+CACHE_DIR = ARGS.cache_dir if ARGS.cache_dir is not None else ARGS.out_folder+'/sweep_cache'
+FILE_TYPE = ARGS.file_type
+CLASS_CAP = ARGS.class_cap
+READ_LENGTH = ARGS.read_length
+SEARCH = ARGS.search
+N_TRIALS = ARGS.n_trials
+EPOCHS = ARGS.epochs
+VALIDATION_SPLIT = ARGS.validation_split
+WORKERS = ARGS.workers
+THREADS_PER_TRIAL = ARGS.threads_per_trial
+BENCHMARK_READS = ARGS.benchmark_reads
+PREDICT_BATCH_SIZE = ARGS.predict_batch_size
+
+PARAMETERS = {'architecture': ARGS.architecture.split(','),
+              'k_mers': [int(i) for i in ARGS.k_mers.split(',')],
+              'vocabulary': ARGS.vocabulary.split(','),
+              'kernel_size': [int(i) for i in ARGS.kernel_size.split(',')],
+              'filters': [int(i) for i in ARGS.filters.split(',')],
+              'pool_size': [int(i) for i in ARGS.pool_size.split(',')],
+              'lstm_output_size': [int(i) for i in ARGS.lstm_output_size.split(',')],
+              'batch_size': [int(i) for i in ARGS.batch_size.split(',')]
+              }
+
+
+import itertools
+import json
+import multiprocessing
+import os
+import resource
+import time
+
+import numpy as np
+import pandas as pd
+
+from synthetic_reads import encode_sequence
+from class_sampler import stream_reads, reservoir_sample
+from kmer_vocabulary import count_kmers, full_vocabulary, observed_vocabulary, hashed_vocabulary, tokenize_reads
+
+
+def reads_path(cache_dir, read_length):
+    return cache_dir+'/reads.l'+str(read_length)+'.npy'
+
+
+def labels_path(cache_dir, read_length):
+    return cache_dir+'/labels.l'+str(read_length)+'.npy'
+
+
+def tokens_path(cache_dir, read_length, k, vocabulary):
+    return cache_dir+'/tokens.k'+str(k)+'.'+vocabulary.replace(':', '')+'.l'+str(read_length)+'.npy'
+
+
+def model_path(model_folder, trial_id):
+    return model_folder+'/trial_'+str(trial_id)+'.h5'
+
+
+def build_dataset(cache_dir, class_folders, file_type, class_cap, read_length, seed):
+    '''
+    sample and encode the reads of every class once, trials share the cache
+    '''
+    if os.path.isfile(reads_path(cache_dir, read_length)) and os.path.isfile(labels_path(cache_dir, read_length)):
+        print('Using cached reads in '+cache_dir)
+        return
+    reads = []
+    labels = []
+    for class_index, (class_name, directory) in enumerate(class_folders):
+        class_reads, seen = reservoir_sample(stream_reads(directory, file_type),
+                                             class_cap,
+                                             np.random.RandomState(seed))
+        class_reads = [i[:read_length] for i in class_reads if len(i) >= read_length]
+        print('Sampled '+str(len(class_reads))+' of '+str(seen)+' '+class_name+' reads')
+        reads += class_reads
+        labels += [class_index]*len(class_reads)
+    encoded = np.zeros((len(reads), read_length), dtype=np.uint8)
+    for i, read in enumerate(reads):
+        encoded[i] = encode_sequence(read)
+    np.save(reads_path(cache_dir, read_length), encoded)
+    np.save(labels_path(cache_dir, read_length), np.array(labels, dtype=np.int8))
+
+
+def vocabulary_table(reads, k, vocabulary):
+    '''
+    vocabulary table of a sweep vocabulary (full, observed[:min_count] or
+    hashed[:buckets])
+    '''
+    name, _, value = vocabulary.partition(':')
+    if name == 'full':
+        return full_vocabulary(k)
+    if name == 'observed':
+        return observed_vocabulary(count_kmers(reads, k), int(value) if value else 1)
+    if name == 'hashed':
+        return hashed_vocabulary(k, int(value) if value else 65536)
+    raise ValueError('Unknown vocabulary '+vocabulary+', use full, observed[:min_count] or hashed[:buckets]')
+
+
+def tokenize_dataset(cache_dir, read_length, k, vocabulary):
+    '''
+    convert the cached reads into k-mer token ids of a vocabulary
+    '''
+    if os.path.isfile(tokens_path(cache_dir, read_length, k, vocabulary)):
+        return
+    reads = np.load(reads_path(cache_dir, read_length))
+    table = vocabulary_table(reads, k, vocabulary)
+    np.save(tokens_path(cache_dir, read_length, k, vocabulary), tokenize_reads(reads, table, k))
+
+
+def split_dataset(n_reads, validation_split, seed):
+    '''
+    indices of the training and validation reads, the same in every trial
+    '''
+    order = np.random.RandomState(seed).permutation(n_reads)
+    n_val = int(n_reads*validation_split)
+    return order[n_val:], np.sort(order[:n_val])
+
+
+def trial_grid(parameters, search, n_trials, seed):
+    '''
+    list of the configurations to train
+    '''
+    names = sorted(parameters)
+    grid = [dict(zip(names, values)) for values in itertools.product(*[parameters[i] for i in names])]
+    if search == 'random' and n_trials < len(grid):
+        random_state = np.random.RandomState(seed)
+        grid = [grid[i] for i in sorted(random_state.choice(len(grid), n_trials, replace=False))]
+    return grid
+
+
+def set_threads(threads, seed):
+    '''
+    limit TensorFlow to a number of threads and seed it, in a worker process
+    '''
+    import tensorflow as tf
+    from keras import backend as K
+
+    config = tf.ConfigProto(intra_op_parallelism_threads=threads,
+                            inter_op_parallelism_threads=1)
+    K.set_session(tf.Session(config=config))
+    np.random.seed(seed)
+    tf.set_random_seed(seed)
+
+
+def run_trial(task):
+    '''
+    train one configuration and save the model, runs in its own worker process
+    '''
+    trial_id, trial, settings = task
+    from keras import backend as K
+    from keras.utils import to_categorical
+    from pacific_models import build_model
+
+    set_threads(settings['threads'], settings['seed'])
+
+    tokens = np.load(tokens_path(settings['cache_dir'], settings['read_length'], trial['k_mers'], trial['vocabulary']),
+                     mmap_mode='r')
+    labels = np.load(labels_path(settings['cache_dir'], settings['read_length']))
+    train, val = split_dataset(len(labels), settings['validation_split'], settings['seed'])
+    X_val, y_val = tokens[val], labels[val]
+    X_train, y_train = tokens[train], labels[train]
+
+    model = build_model(int(tokens.max())+1,
+                        tokens.shape[1],
+                        architecture=trial['architecture'],
+                        kernel_size=trial['kernel_size'],
+                        filters=trial['filters'],
+                        pool_size=trial['pool_size'],
+                        lstm_output_size=trial['lstm_output_size'])
+    start = time.time()
+    model.fit(X_train, to_categorical(y_train, 6),
+              batch_size=trial['batch_size'],
+              epochs=settings['epochs'],
+              verbose=0)
+    training_time = time.time() - start
+
+    predictions = model.predict(X_val, batch_size=1024)
+    result = dict(trial)
+    result['trial'] = trial_id
+    result['val_accuracy'] = float(np.mean(np.argmax(predictions, axis=1) == y_val))
+    result['parameters'] = int(model.count_params())
+    result['embedding_rows'] = int(tokens.max())+1
+    result['training_time'] = training_time
+    model.save(model_path(settings['model_folder'], trial_id), include_optimizer=False)
+    result['model_size_MB'] = os.path.getsize(model_path(settings['model_folder'], trial_id))/1e6
+    K.clear_session()
+    return result
+
+
+def benchmark_trial(task):
+    '''
+    load time, inference memory and CPU throughput of a saved trial model,
+    in a fresh worker process so the memory of the training is not counted
+    '''
+    result, settings = task
+    from keras.models import load_model
+    from pacific_models import reads_per_second
+
+    set_threads(settings['threads'], settings['seed'])
+
+    tokens = np.load(tokens_path(settings['cache_dir'], settings['read_length'], result['k_mers'], result['vocabulary']),
+                     mmap_mode='r')
+    _, val = split_dataset(len(tokens), settings['validation_split'], settings['seed'])
+    X_benchmark = np.array(tokens[val[:settings['benchmark_reads']]])
+
+    # ru_maxrss is the peak resident memory of the process, in KB on Linux
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    model = load_model(model_path(settings['model_folder'], result['trial']))
+    result = dict(result)
+    result['load_time'] = time.time() - start
+    result['reads_per_second'] = reads_per_second(model,
+                                                  X_benchmark,
+                                                  batch_size=settings['predict_batch_size'])
+    rss_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    result['inference_memory_MB'] = (rss_peak - rss_before)/1024
+    result['peak_rss_MB'] = rss_peak/1024
+    return result
+
+
+def pareto_front(df, maximize):
+    '''
+    rows not dominated by any other row in all the maximized columns
+    '''
+    values = df[maximize].values
+    front = []
+    for i in range(len(values)):
+        dominated = np.any(np.all(values >= values[i], axis=1) & np.any(values > values[i], axis=1))
+        front.append(not dominated)
+    return np.array(front)
+
+
+if __name__ == '__main__':
+
+    seed_value = 42
+
+    model_folder = OUT_FOLDER+'/sweep_models'
+    for folder in (OUT_FOLDER, CACHE_DIR, model_folder):
+        if os.path.isdir(folder) is False:
+            print('Creating output folder '+folder)
+            os.makedirs(folder)
+
+    class_folders = [('Coronaviridae', CORONAVIRIDAE_READS),
+                     ('Influenza', INFLUENZA_READS),
+                     ('Metapneumovirus', METAPMEUMOVIRUS_READS),
+                     ('Rhinovirus', RHINOVIRUS_READS),
+                     ('Sars_cov_2', SARS_COV_2_READS),
+                     ('Human', HUMAN_READS)]
+
+    build_dataset(CACHE_DIR, class_folders, FILE_TYPE, CLASS_CAP, READ_LENGTH, seed_value)
+    for k in PARAMETERS['k_mers']:
+        for vocabulary in PARAMETERS['vocabulary']:
+            print('Tokenizing the sweep dataset with k-mers of lenght '+str(k)+' and '+vocabulary+' vocabulary')
+            tokenize_dataset(CACHE_DIR, READ_LENGTH, k, vocabulary)
+
+    trials = trial_grid(PARAMETERS, SEARCH, N_TRIALS, seed_value)
+    settings = {'cache_dir': CACHE_DIR,
+                'model_folder': model_folder,
+                'read_length': READ_LENGTH,
+                'validation_split': VALIDATION_SPLIT,
+                'epochs': EPOCHS,
+                'threads': THREADS_PER_TRIAL,
+                'benchmark_reads': BENCHMARK_READS,
+                'predict_batch_size': PREDICT_BATCH_SIZE,
+                'seed': seed_value
+                }
+    print('Running '+str(len(trials))+' trials on '+str(WORKERS)+' workers')
+    with open(OUT_FOLDER+'/sweep_trials.json', 'w') as handle:
+        json.dump({'trials': trials, 'settings': settings}, handle, indent=1)
+
+    trained = []
+    # spawn a fresh process per trial so TensorFlow state never leaks between trials
+    pool = multiprocessing.get_context('spawn').Pool(WORKERS, maxtasksperchild=1)
+    for result in pool.imap_unordered(run_trial, [(i, trial, settings) for i, trial in enumerate(trials)]):
+        trained.append(result)
+        print('Trial '+str(len(trained))+'/'+str(len(trials))+': '+str(result))
+        pd.DataFrame(trained).to_csv(OUT_FOLDER+'/sweep_results.csv', index=False)
+    pool.close()
+    pool.join()
+
+    print()
+    print('Benchmarking the inference of '+str(len(trained))+' models')
+    results = []
+    # one model at a time, so the memory and throughput are not shared with other trials
+    pool = multiprocessing.get_context('spawn').Pool(1, maxtasksperchild=1)
+    for result in pool.imap_unordered(benchmark_trial, [(i, settings) for i in trained]):
+        results.append(result)
+        print('Benchmark '+str(len(results))+'/'+str(len(trained))+': '+str(result))
+    pool.close()
+    pool.join()
+
+    df_results = pd.DataFrame(results)
+    df_results['pareto'] = pareto_front(df_results, ['val_accuracy', 'reads_per_second'])
+    df_results = df_results.sort_values('reads_per_second', ascending=False)
+    df_results.to_csv(OUT_FOLDER+'/sweep_results.csv', index=False)
+
+    # compact model report: size, load time, memory and accuracy per vocabulary
+    df_vocabulary = df_results.groupby(['vocabulary', 'k_mers'])[['embedding_rows',
+                                                                   'model_size_MB',
+                                                                   'load_time',
+                                                                   'inference_memory_MB',
+                                                                   'reads_per_second',
+                                                                   'val_accuracy']].median()
+    df_vocabulary.to_csv(OUT_FOLDER+'/sweep_vocabulary.csv')
+    print()
+    print('Median of the trials per vocabulary')
+    print(df_vocabulary.to_string())
+
+    df_pareto = df_results[df_results['pareto']].drop(columns='pareto')
+    df_pareto.to_csv(OUT_FOLDER+'/sweep_pareto.csv', index=False)
+    print()
+    print('Accuracy / throughput Pareto front')
+    print(df_pareto.to_string(index=False))
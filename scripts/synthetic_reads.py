@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Sample synthetic reads on the fly from reference genomes held in memory.
+
+The sampling follows generatetrainingdata.pl and generaterandomreads.pl:
+every genome gets reads until depth * genome length bases are sampled,
+starts are uniform in [0, length - read length] and, with strand "both",
+reads starting at an odd position are reverse complemented.
+
+Bases are stored as 2-bit codes (A=0, C=1, G=2, T=3) and any other
+character as 4, so reads with non-standard nucleotides can be discarded
+the same way process_reads does for read files.
+"""
+
+import gzip
+import os
+
+import numpy as np
+from Bio import SeqIO
+
+
+ENCODING = np.full(256, 4, dtype=np.uint8)
+for code, base in enumerate('ACGT'):
+    ENCODING[ord(base)] = code
+    ENCODING[ord(base.lower())] = code
+
+COMPLEMENT = np.array([3, 2, 1, 0, 4], dtype=np.uint8)
+
+STRANDS = ('both', 'sense', 'antisense')
+
+
+def encode_sequence(sequence):
+    '''
+    convert a nucleotide string into an array of 2-bit codes
+    '''
+    return ENCODING[np.frombuffer(sequence.encode('ascii'), dtype=np.uint8)]
+
+
+def reverse_complement(reads):
+    '''
+    reverse complement encoded reads (last axis)
+    '''
+    return COMPLEMENT[reads[..., ::-1]]
+
+
+def read_references(file, file_type='fasta'):
+    '''
+    read every genome of a fasta file (plain or gzip), returns names and codes
+    '''
+    if file.endswith('.gz'):
+        handle = gzip.open(file, 'rt')
+    else:
+        handle = open(file)
+    names = []
+    genomes = []
+    with handle:
+        for fasta in SeqIO.parse(handle, file_type):
+            names.append(fasta.id)
+            genomes.append(encode_sequence(str(fasta.seq)))
+    return names, genomes
+
+
+def load_references(class_directories, file_type='fasta'):
+    '''
+    load the reference genomes of every class in memory
+
+    class_directories is a list of (class name, folder with fasta files).
+    The genomes are concatenated in one array, genome i is
+    codes[offsets[i]:offsets[i]+lengths[i]] and belongs to classes[i],
+    the position of its class in class_directories.
+    '''
+    names = []
+    genomes = []
+    classes = []
+    for class_index, (class_name, directory) in enumerate(class_directories):
+        for file in sorted(os.listdir(directory)):
+            file_names, file_genomes = read_references(directory+'/'+file, file_type)
+            names += file_names
+            genomes += file_genomes
+            classes += [class_index]*len(file_genomes)
+        print('Loaded '+str(classes.count(class_index))+' '+class_name+' genomes')
+
+    lengths = np.array([len(i) for i in genomes], dtype=np.int64)
+    offsets = np.concatenate(([0], np.cumsum(lengths)[:-1])).astype(np.int64)
+    if len(genomes) > 0:
+        codes = np.concatenate(genomes)
+    else:
+        codes = np.zeros(0, dtype=np.uint8)
+    return {'codes': codes,
+            'offsets': offsets,
+            'lengths': lengths,
+            'classes': np.array(classes, dtype=np.int64),
+            'names': names,
+            'class_names': [i[0] for i in class_directories]
+            }
+
+
+def reference_bases(references, positions):
+    '''
+    codes of the bases at global positions (array or slice) of references
+    held in memory or in a packed store (reference_store.py)
+    '''
+    if 'packed' in references:
+        from reference_store import packed_bases
+        return packed_bases(references, positions)
+    return references['codes'][positions]
+
+
+def reads_per_genome(lengths, depth, read_length):
+    '''
+    number of reads per genome to reach the depth, as in the perl scripts
+    genomes shorter than the reads are not sampled
+    '''
+    n_reads = np.ceil(lengths*depth/read_length).astype(np.int64)
+    n_reads[lengths < read_length] = 0
+    return n_reads
+
+
+def epoch_plan(references, depth, read_length, random_state):
+    '''
+    shuffled genome index of every read sampled in one epoch
+    '''
+    n_reads = reads_per_genome(references['lengths'], depth, read_length)
+    genomes = np.repeat(np.arange(len(n_reads)), n_reads)
+    random_state.shuffle(genomes)
+    return genomes
+
+
+def sample_reads(references, genomes, read_length, strand, random_state):
+    '''
+    sample one read per entry of genomes, all reads at once
+
+    returns the encoded reads (n x read_length), their start in the genome
+    and their strand (1 or -1)
+    '''
+    if strand not in STRANDS:
+        raise ValueError('strand should be one of '+', '.join(STRANDS))
+    max_start = references['lengths'][genomes] - read_length + 1
+    starts = (random_state.random_sample(len(genomes)) * max_start).astype(np.int64)
+    positions = references['offsets'][genomes] + starts
+    reads = reference_bases(references, positions[:, None] + np.arange(read_length))
+
+    if strand == 'both':
+        strands = np.where(starts % 2 == 0, 1, -1)
+    elif strand == 'antisense':
+        strands = -np.ones(len(genomes), dtype=np.int64)
+    else:
+        strands = np.ones(len(genomes), dtype=np.int64)
+    minus = strands < 0
+    reads[minus] = reverse_complement(reads[minus])
+    return reads, starts, strands
+
+
+def valid_reads(reads):
+    '''
+    reads without non-standard nucleotides
+    '''
+    return (reads < 4).all(axis=1)
+
+
+def kmer_codes(reads, k):
+    '''
+    integer code (2 bits per base) of every k-mer of the encoded reads
+    k-mers containing non-standard nucleotides get meaningless (but valid)
+    codes, use valid_kmers to mask them
+    '''
+    reads = np.atleast_2d(reads)
+    n_kmers = max(reads.shape[1] - k + 1, 0)
+    codes = np.zeros((reads.shape[0], n_kmers), dtype=np.int64)
+    for j in range(k):
+        codes = codes*4 + (reads[:, j:j+n_kmers] & 3)
+    return codes
+
+
+def valid_kmers(reads, k):
+    '''
+    mask of the k-mers without non-standard nucleotides
+    '''
+    reads = np.atleast_2d(reads)
+    bad = np.cumsum(reads > 3, axis=1)
+    bad = np.concatenate((np.zeros((reads.shape[0], 1), dtype=bad.dtype), bad), axis=1)
+    return (bad[:, k:] - bad[:, :-k]) == 0
+
+
+def kmer_counts(references, k, strand='both', block_size=10000000):
+    '''
+    count every k-mer of the reference genomes on the sampled strands
+    '''
+    if strand not in STRANDS:
+        raise ValueError('strand should be one of '+', '.join(STRANDS))
+    counts = np.zeros(4**k, dtype=np.int64)
+    for offset, length in zip(references['offsets'], references['lengths']):
+        for start in range(0, max(length - k + 1, 0), block_size):
+            block = reference_bases(references, slice(offset+start, offset+min(start+block_size+k-1, length)))
+            blocks = []
+            if strand != 'antisense':
+                blocks.append(block)
+            if strand != 'sense':
+                blocks.append(reverse_complement(block))
+            for sequence in blocks:
+                block_codes = kmer_codes(sequence, k)[valid_kmers(sequence, k)]
+                counts += np.bincount(block_codes, minlength=4**k)
+    return counts
+
+
+def kmer_lookup(word_index, k, unknown=0):
+    '''
+    table from k-mer code to token id of a tokenizer word_index, unknown
+    (0 by default) for the k-mers not in word_index
+    '''
+    table = np.full(4**k, unknown, dtype=np.int32)
+    for word, index in word_index.items():
+        if len(word) != k:
+            continue
+        word_codes = encode_sequence(word)
+        if (word_codes < 4).all():
+            table[kmer_codes(word_codes, k)[0, 0]] = index
+    return table
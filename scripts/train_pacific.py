@@ -24,28 +24,28 @@ REQUIRED = parser.add_argument_group('required arguments')
 
 #Inputs
 REQUIRED.add_argument("--Coronaviridae_reads",
-                      help="file path to folder containing Coronaviridae fasta files to train PACIFIC",
-                      required=True)
+                      help="file path to folder containing Coronaviridae fasta files to train PACIFIC (not used with --reference_store)",
+                      default=None)
 
 REQUIRED.add_argument("--Influenza_reads",
-                      help="file path to folder containing Influenza fasta files to train PACIFIC",
-                      required=True)
+                      help="file path to folder containing Influenza fasta files to train PACIFIC (not used with --reference_store)",
+                      default=None)
 
 REQUIRED.add_argument("--Metapneumovirus_reads",
-                      help="file path to folder containing Metapneumovirus fasta files to train PACIFIC",
-                      required=True)
+                      help="file path to folder containing Metapneumovirus fasta files to train PACIFIC (not used with --reference_store)",
+                      default=None)
 
 REQUIRED.add_argument("--Rhinovirus_reads",
-                      help="file path to folder containing Rhinovirus fasta files to train PACIFIC",
-                      required=True)
+                      help="file path to folder containing Rhinovirus fasta files to train PACIFIC (not used with --reference_store)",
+                      default=None)
 
 REQUIRED.add_argument("--Sars_cov_2_reads",
-                      help="file path to folder containing SARS-CoV-2 fasta files to train PACIFIC",
-                      required=True)
+                      help="file path to folder containing SARS-CoV-2 fasta files to train PACIFIC (not used with --reference_store)",
+                      default=None)
 
 REQUIRED.add_argument("--Human_reads",
-                      help="file path to folder containing Human fasta files to train PACIFIC",
-                      required=True)
+                      help="file path to folder containing Human fasta files to train PACIFIC (not used with --reference_store)",
+                      default=None)
 
 
 #arguments
@@ -62,13 +62,161 @@ OPTIONAL.add_argument("--model_name",
                       help='Name used to save the model',
                       default="PACIFIC")
 
+OPTIONAL.add_argument("--architecture",
+                      help='Model architecture: bilstm (original PACIFIC), small_bilstm, gru or cnn (fastest on CPU) [bilstm, cnn when distilling]',
+                      default=None,
+                      choices=['bilstm', 'small_bilstm', 'gru', 'cnn'])
+
+OPTIONAL.add_argument("--teacher_model",
+                      help='PACIFIC .h5 model to distill, the new model is trained on its soft targets',
+                      default=None)
+
+OPTIONAL.add_argument("--teacher_tokenizer",
+                      help='Tokenizer of the teacher model, reused by the distilled model (required with --teacher_model)',
+                      default=None)
+
+OPTIONAL.add_argument("--distillation_temperature",
+                      help='Temperature of the teacher and student softmax during distillation, the saved model predicts at temperature 1',
+                      default=1.0,
+                      type=float)
+
+OPTIONAL.add_argument("--distillation_alpha",
+                      help='Weight of the teacher soft targets, 1 - alpha is the weight of the true labels',
+                      default=1.0,
+                      type=float)
+
+OPTIONAL.add_argument("--kernel_size",
+                      help='Size of the convolution kernel',
+                      default=3,
+                      type=int)
+
+OPTIONAL.add_argument("--filters",
+                      help='Number of convolution filters',
+                      default=128,
+                      type=int)
+
+OPTIONAL.add_argument("--pool_size",
+                      help='Size of the max pooling after the convolution',
+                      default=3,
+                      type=int)
+
+OPTIONAL.add_argument("--lstm_output_size",
+                      help='Number of units of each direction of the LSTM',
+                      default=70,
+                      type=int)
+
+OPTIONAL.add_argument("--batch_size",
+                      help='Training batch size',
+                      default=30,
+                      type=int)
+
 OPTIONAL.add_argument("--stop_chunk",
-                      help='Chunk number to stop the training',
-                      default=15,
+                      help='Number of chunks to train per epoch (all chunks if not given)',
+                      default=None,
+                      type=int)
+
+OPTIONAL.add_argument("--chunk_size",
+                      help='Number of reads per training chunk',
+                      default=200000,
+                      type=int)
+
+OPTIONAL.add_argument("--epochs",
+                      help='Number of epochs over all the training chunks',
+                      default=1,
+                      type=int)
+
+OPTIONAL.add_argument("--validation_split",
+                      help='Fraction of the reads held out to compute the validation loss',
+                      default=0.10,
+                      type=float)
+
+OPTIONAL.add_argument("--checkpoint_every",
+                      help='Save a model and optimizer checkpoint every n chunks',
+                      default=1,
+                      type=int)
+
+OPTIONAL.add_argument("--patience",
+                      help='Number of epochs without improvement of the validation loss before stopping',
+                      default=3,
                       type=int)
 
+OPTIONAL.add_argument("--resume",
+                      help='Resume the training from the latest checkpoint in the output folder',
+                      default=False,
+                      action='store_true')
+
+OPTIONAL.add_argument("--init_model",
+                      help='PACIFIC .h5 model fine-tuned on the new reads instead of training a model from scratch',
+                      default=None)
+
+OPTIONAL.add_argument("--init_tokenizer",
+                      help='Tokenizer of the initial model, new k-mers are added to it (required with --init_model)',
+                      default=None)
+
+OPTIONAL.add_argument("--replay_reads",
+                      help='Folder with one subfolder per class (Coronaviridae, Influenza, Metapneumovirus, Rhinovirus, Sars_cov_2, Human) of old training reads, a sample is mixed with the new reads when fine-tuning',
+                      default=None)
+
+OPTIONAL.add_argument("--replay_cap",
+                      help='Maximum number of old reads per class sampled from --replay_reads',
+                      default=10000,
+                      type=int)
+
+OPTIONAL.add_argument("--vocabulary",
+                      help='K-mer vocabulary: full (every 4^k k-mer, id = 2-bit code + 1), observed (k-mers in the training data, ids in code order) or hashed (k-mers hashed into --hash_buckets rows)',
+                      default='full',
+                      choices=['full', 'observed', 'hashed'])
+
+OPTIONAL.add_argument("--min_count",
+                      help='With --vocabulary observed, k-mers seen fewer times share one out of vocabulary embedding row',
+                      default=1,
+                      type=int)
+
+OPTIONAL.add_argument("--hash_buckets",
+                      help='Number of embedding rows of the hashed vocabulary',
+                      default=65536,
+                      type=int)
+
+OPTIONAL.add_argument("--canonical",
+                      help='Give every k-mer and its reverse complement the same token (stored in the model, PACIFIC.py applies it)',
+                      default=False,
+                      action='store_true')
+
+OPTIONAL.add_argument("--class_cap",
+                      help='Maximum number of reads per class, reservoir sampled while streaming the class folder',
+                      default=None,
+                      type=int)
+
+OPTIONAL.add_argument("--class_weights",
+                      help='Target class proportions in every training chunk, e.g. Human:1,Sars_cov_2:2 (missing classes get 1)',
+                      default=None)
+
+OPTIONAL.add_argument("--reference_genomes",
+                      help='If given, the class folders contain reference genomes and reads are sampled from them on the fly',
+                      default=False,
+                      action='store_true')
+
+OPTIONAL.add_argument("--reference_store",
+                      help='Prefix of a packed reference store (reference_store.py), reads are sampled on the fly from its genomes of every class instead of the class folders',
+                      default=None)
+
+OPTIONAL.add_argument("--depth",
+                      help='Sequencing depth sampled from every reference genome per epoch (with --reference_genomes)',
+                      default=30,
+                      type=float)
+
+OPTIONAL.add_argument("--read_length",
+                      help='Length of the reads sampled from the reference genomes (with --reference_genomes)',
+                      default=150,
+                      type=int)
+
+OPTIONAL.add_argument("--strand",
+                      help='Strand of the reads sampled from the reference genomes: both, sense or antisense (with --reference_genomes)',
+                      default='both',
+                      choices=['both', 'sense', 'antisense'])
+
 OPTIONAL.add_argument("--GPU",
-                      help='If True  PACIFIC will be train using CuDNNLSTM',
+                      help='If True  PACIFIC will be train using CuDNNLSTM (CuDNNGRU for the gru architecture)',
                       default=False,
                       )
 
@@ -94,7 +242,60 @@ HUMAN_READS = ARGS.Human_reads
 OUT_FOLDER = ARGS.out_folder
 K_MERS = ARGS.k_mers
 MODEL_NAME = ARGS.model_name
+TEACHER_MODEL = ARGS.teacher_model
+TEACHER_TOKENIZER = ARGS.teacher_tokenizer
+DISTILLATION_TEMPERATURE = ARGS.distillation_temperature
+DISTILLATION_ALPHA = ARGS.distillation_alpha
+if ARGS.architecture is not None:
+    ARCHITECTURE = ARGS.architecture
+elif TEACHER_MODEL is not None:
+    ARCHITECTURE = 'cnn'
+else:
+    ARCHITECTURE = 'bilstm'
+if TEACHER_MODEL is not None and TEACHER_TOKENIZER is None:
+    parser.error('--teacher_tokenizer is required with --teacher_model')
+KERNEL_SIZE = ARGS.kernel_size
+FILTERS = ARGS.filters
+POOL_SIZE = ARGS.pool_size
+LSTM_OUTPUT_SIZE = ARGS.lstm_output_size
+BATCH_SIZE = ARGS.batch_size
 STOP_CHUNK = ARGS.stop_chunk
+CHUNK_SIZE = ARGS.chunk_size
+EPOCHS = ARGS.epochs
+VALIDATION_SPLIT = ARGS.validation_split
+CHECKPOINT_EVERY = ARGS.checkpoint_every
+PATIENCE = ARGS.patience
+RESUME = ARGS.resume
+INIT_MODEL = ARGS.init_model
+INIT_TOKENIZER = ARGS.init_tokenizer
+REPLAY_READS = ARGS.replay_reads
+REPLAY_CAP = ARGS.replay_cap
+if INIT_MODEL is not None and INIT_TOKENIZER is None:
+    parser.error('--init_tokenizer is required with --init_model')
+if INIT_MODEL is not None and TEACHER_MODEL is not None:
+    parser.error('--init_model and --teacher_model can not be used together')
+if REPLAY_READS is not None and INIT_MODEL is None:
+    parser.error('--replay_reads is only used with --init_model')
+VOCABULARY = ARGS.vocabulary
+MIN_COUNT = ARGS.min_count
+HASH_BUCKETS = ARGS.hash_buckets
+CANONICAL = ARGS.canonical
+CLASS_CAP = ARGS.class_cap
+CLASS_WEIGHTS = ARGS.class_weights
+REFERENCE_STORE = ARGS.reference_store
+REFERENCE_GENOMES = ARGS.reference_genomes or REFERENCE_STORE is not None
+if REFERENCE_STORE is None and None in (ARGS.Coronaviridae_reads,
+                                        ARGS.Influenza_reads,
+                                        ARGS.Metapneumovirus_reads,
+                                        ARGS.Rhinovirus_reads,
+                                        ARGS.Sars_cov_2_reads,
+                                        ARGS.Human_reads):
+    parser.error('every class folder is required without --reference_store')
+if REPLAY_READS is not None and REFERENCE_GENOMES is True:
+    parser.error('--replay_reads can not be used with --reference_genomes')
+DEPTH = ARGS.depth
+READ_LENGTH = ARGS.read_length
+STRAND = ARGS.strand
 GPU = ARGS.GPU
 FILE_TYPE = ARGS.file_type
 
@@ -105,25 +306,31 @@ import os
 
 from sklearn.preprocessing import LabelBinarizer
 import numpy as np
-from keras.preprocessing.text import Tokenizer
+import pandas as pd
 
 from sklearn.model_selection import train_test_split
-from keras.preprocessing.sequence import pad_sequences
 
-from keras.models import Sequential
-from keras.layers import Embedding, LSTM, Dense, Bidirectional, Conv1D, CuDNNLSTM
-from keras.layers import Dropout, Activation, MaxPooling1D
 import tensorflow as tf
 
 from numpy.random import seed
 from tensorflow import set_random_seed
 import pickle
+import json
 import time
-from sklearn.utils import shuffle
 from keras.models import load_model
 import matplotlib.pyplot as plt
 import seaborn as sns
 
+from synthetic_reads import load_references, epoch_plan, reads_per_genome, sample_reads
+from reference_store import open_store, store_references
+from synthetic_reads import valid_reads, kmer_codes, kmer_counts
+from kmer_vocabulary import encode_reads, count_kmers, full_vocabulary, observed_vocabulary, hashed_vocabulary
+from kmer_vocabulary import tokenize_reads, vocabulary_tokenizer, tokenizer_table, canonical_codes, canonical_counts
+from kmer_vocabulary import grow_vocabulary
+from pacific_models import build_model, reads_per_second, save_metadata, load_metadata
+from pacific_models import embedding_rows, grow_embedding, distillation_model
+from class_sampler import stream_reads, reservoir_sample, parse_class_weights, class_caps, balanced_order
+
 
 def prepare_read(trancriptome, file_type):
     '''
@@ -137,27 +344,25 @@ def prepare_read(trancriptome, file_type):
     return sequences
 
 
-def process_reads(sequences, length, kmer):
+def process_reads(sequences):
     '''
     '''
     r_reads = []
     for i in enumerate(sequences):
         # check the reads does not contain weird characters
         if all(c in 'AGCT' for c in i[1].upper()):
-            r_reads.append(' '.join(i[1][x:x+kmer].upper() for x in range(len(i[1]) - kmer + 1)))
+            r_reads.append(i[1].upper())
     return r_reads
 
 
-def main(directory, size_lenght, k_mer_size, file_type):
+def main(directory, file_type):
     '''
     '''
     files = os.listdir(directory)
     reads = []
     for file in files:
         all_transcripts = prepare_read(directory+'/'+file, file_type)
-        reads += process_reads(all_transcripts, 
-                               size_lenght,
-                               k_mer_size)
+        reads += process_reads(all_transcripts)
     return reads 
 
 def accuracy(labels, predictions):
@@ -176,6 +381,166 @@ def accuracy(labels, predictions):
     return correct/len(labels)
 
 
+def synthetic_chunk(references, genomes, kmer_table, label_maker, random_state):
+    '''
+    sample the reads of a chunk from the reference genomes and convert them
+    into k-mer token ids and labels
+    '''
+    reads, _, _ = sample_reads(references, genomes, READ_LENGTH, STRAND, random_state)
+    valid = valid_reads(reads)
+    codes = kmer_codes(reads[valid], K_MERS)
+    if CANONICAL is True:
+        codes = canonical_codes(codes, K_MERS)
+    sequences = kmer_table[codes]
+    labels = np.array(references['class_names'])[references['classes'][genomes[valid]]]
+    return sequences, label_maker.transform(labels)
+
+
+def replay_sample(folder, class_names, cap, file_type, seed):
+    '''
+    sample of at most cap old reads of every class subfolder of folder
+    '''
+    reads = []
+    labels = []
+    for class_name in class_names:
+        directory = folder+'/'+class_name
+        if os.path.isdir(directory) is False:
+            print('No replay reads for '+class_name+' in '+folder)
+            continue
+        class_reads, seen = reservoir_sample(stream_reads(directory, file_type),
+                                             cap,
+                                             np.random.RandomState(seed))
+        print('Replaying '+str(len(class_reads))+' of '+str(seen)+' old '+class_name+' reads')
+        reads += class_reads
+        labels += [class_name]*len(class_reads)
+    return reads, labels
+
+
+def new_kmers(tokenizer, counts, k, min_count):
+    '''
+    vocabulary table of a tokenizer with the new k-mers of counts added
+    '''
+    table = tokenizer_table(tokenizer, k)
+    unknown = tokenizer.word_index.get(getattr(tokenizer, 'oov_token', None), 0)
+    grown = grow_vocabulary(table, counts, unknown, min_count)
+    print('Added '+str(int(grown.max() - table.max()))+' new k-mers to the vocabulary')
+    return grown
+
+
+def validation_metrics(model, X_val, y_val, batch_size, class_names):
+    '''
+    loss, accuracies and recall per class of the validation set in one pass
+    '''
+    predictions = model.predict(X_val, batch_size=batch_size)
+    epsilon = 1e-7
+    probabilities = np.clip(predictions/predictions.sum(axis=1, keepdims=True), epsilon, 1 - epsilon)
+    predicted = np.argmax(predictions, axis=1)
+    true = np.argmax(y_val, axis=1)
+    metrics = {'loss': float(np.mean(-np.sum(y_val*np.log(probabilities), axis=1))),
+               'binary_accuracy': float(np.mean(np.round(predictions) == y_val)),
+               'categorical_accuracy': float(np.mean(predicted == true))
+               }
+    for class_index, class_name in enumerate(class_names):
+        in_class = true == class_index
+        if in_class.any():
+            metrics['recall_'+class_name] = float(np.mean(predicted[in_class] == class_index))
+    return metrics
+
+
+def distillation_targets(teacher, sequences, labels, temperature, batch_size):
+    '''
+    soft targets of the teacher model at the temperature (softmax of the
+    teacher logits divided by it) next to the true labels, the targets of
+    pacific_models.distillation_model
+    '''
+    soft_targets = teacher.predict(sequences, batch_size=batch_size)
+    if temperature != 1:
+        soft_targets = np.power(np.clip(soft_targets, 1e-7, 1), 1.0/temperature)
+        soft_targets = soft_targets/soft_targets.sum(axis=1, keepdims=True)
+    return np.concatenate((soft_targets, labels), axis=1)
+
+
+def distillation_report(teacher, student, sequences, class_names, benchmark_reads=10000):
+    '''
+    agreement of the student with the teacher per class predicted by the
+    teacher, and CPU reads/sec of both models
+    '''
+    teacher_predicted = np.argmax(teacher.predict(sequences, batch_size=1024), axis=1)
+    student_predicted = np.argmax(student.predict(sequences, batch_size=1024), axis=1)
+    rows = []
+    for class_index, class_name in enumerate(class_names):
+        in_class = teacher_predicted == class_index
+        rows.append([class_name,
+                     int(in_class.sum()),
+                     float(np.mean(student_predicted[in_class] == class_index)) if in_class.any() else np.nan])
+    rows.append(['All', len(teacher_predicted), float(np.mean(student_predicted == teacher_predicted))])
+    df_report = pd.DataFrame(rows, columns=['Class', '# teacher predicted reads', 'agreement with teacher'])
+    df_report['teacher reads/sec'] = reads_per_second(teacher, sequences[:benchmark_reads])
+    df_report['student reads/sec'] = reads_per_second(student, sequences[:benchmark_reads])
+    return df_report
+
+
+def checkpoint_paths(out_folder, model_name):
+    '''
+    paths to the latest checkpoint, its training state and the best model so far
+    '''
+    checkpoint_folder = out_folder+'/checkpoints'
+    return (checkpoint_folder+'/'+model_name+'.checkpoint.h5',
+            checkpoint_folder+'/'+model_name+'.checkpoint.json',
+            checkpoint_folder+'/'+model_name+'.best.h5')
+
+
+def save_model_atomic(model, path, metadata):
+    '''
+    save the model (weights and optimizer state) and its preprocessing
+    metadata to a temporary file first, so an interrupted job never leaves
+    a truncated checkpoint behind
+    '''
+    model.save(path+'.tmp')
+    save_metadata(path+'.tmp', metadata)
+    os.replace(path+'.tmp', path)
+
+
+def save_checkpoint(model, state, metadata, out_folder, model_name):
+    '''
+    save the model, optimizer and scheduler state to resume the training
+    '''
+    model_path, state_path, _ = checkpoint_paths(out_folder, model_name)
+    if os.path.isdir(os.path.dirname(model_path)) is False:
+        os.mkdir(os.path.dirname(model_path))
+    save_model_atomic(model, model_path, metadata)
+    with open(state_path+'.tmp', 'w') as handle:
+        json.dump(state, handle, indent=1)
+    os.replace(state_path+'.tmp', state_path)
+    print('Saved checkpoint epoch '+str(state['epoch'])+' chunk '+str(state['chunk']))
+
+
+def load_checkpoint(out_folder, model_name):
+    '''
+    load the latest checkpoint, returns (None, None) if there is no checkpoint
+    '''
+    model_path, state_path, _ = checkpoint_paths(out_folder, model_name)
+    if os.path.isfile(model_path) is False or os.path.isfile(state_path) is False:
+        return None, None
+    with open(state_path) as handle:
+        state = json.load(handle)
+    return load_model(model_path), state
+
+
+def plot_history(x, series, ylabel, file_name):
+    '''
+    plot training curves, series is a list of (values, label)
+    '''
+    f, ax = plt.subplots( figsize=(13,9))
+    for values, label in series:
+        sns.lineplot(x=np.array(x), y=np.array(values), palette="tab10", linewidth=2.5, label=label)
+    plt.ylabel(ylabel)
+    plt.savefig(file_name,
+                format='pdf',
+                dpi=1200,
+                bbox_inches='tight', pad_inches=0)
+
+
 if __name__ == '__main__':
     
     seed_value = 42
@@ -187,276 +552,401 @@ if __name__ == '__main__':
     config.gpu_options.allow_growth = True
     sess = tf.Session(config=config)
     '''
-    kmers = K_MERS
-    
     # Create output folder if it does not exist
     if os.path.isdir(OUT_FOLDER) is False:
         print('Creating output folder '+OUT_FOLDER)
         os.mkdir(OUT_FOLDER)
 
     
-    # Read lenght
-    read_lenght = 150
-    
-    # get synthetic reads
-    print('Loading Coronaviridae reads')
+    labels_to_fit = ['Coronaviridae','Influenza',"Metapneumovirus","Rhinovirus","Sars_cov_2", 'Human']
+    label_maker = LabelBinarizer()
+    transfomed_label = label_maker.fit(labels_to_fit)
     
-    Coronaviridae_reads = main(CORONAVIRIDAE_READS,
-                               read_lenght, 
-                               kmers,
-                               FILE_TYPE,
-                              )
+    # save label_maker
+    print('Saving object to convert output to labels '+ OUT_FOLDER+'/label_maker.'+MODEL_NAME+'.pickle')
+
+    with open(OUT_FOLDER+'/label_maker.'+MODEL_NAME+'.pickle', 'wb') as handle:
+        pickle.dump(label_maker, handle, protocol=pickle.HIGHEST_PROTOCOL)
     
-    print('Loading Influenza reads')
+    teacher = None
+    if TEACHER_MODEL is not None:
+        print('Loading teacher model '+TEACHER_MODEL)
+        teacher = load_model(TEACHER_MODEL)
+        with open(TEACHER_TOKENIZER, 'rb') as handle:
+            teacher_tokenizer = pickle.load(handle)
+        # the student reads the k-mers the same way as the teacher
+        teacher_metadata = load_metadata(TEACHER_MODEL)
+        K_MERS = teacher_metadata.get('k_mers', K_MERS)
+        CANONICAL = teacher_metadata.get('canonical', False)
+        print('Distilling with k-mers of lenght '+str(K_MERS)+', canonical k-mers: '+str(CANONICAL))
+    
+    init_model = None
+    if INIT_MODEL is not None:
+        print('Loading model to fine-tune '+INIT_MODEL)
+        init_model = load_model(INIT_MODEL)
+        with open(INIT_TOKENIZER, 'rb') as handle:
+            init_tokenizer = pickle.load(handle)
+        init_metadata = load_metadata(INIT_MODEL)
+        # keep the preprocessing of the initial model
+        K_MERS = init_metadata.get('k_mers', K_MERS)
+        CANONICAL = init_metadata.get('canonical', False)
+        print('Fine-tuning with k-mers of lenght '+str(K_MERS)+', canonical k-mers: '+str(CANONICAL))
+    
+    model_metadata = {'k_mers': K_MERS,
+                      'canonical': CANONICAL,
+                      'vocabulary': VOCABULARY,
+                      'min_count': MIN_COUNT,
+                      'hash_buckets': HASH_BUCKETS if VOCABULARY == 'hashed' else None}
+    if init_model is not None:
+        model_metadata.update(init_metadata)
+        model_metadata['fine_tuned_from'] = os.path.abspath(INIT_MODEL)
+    
+    class_folders = [('Coronaviridae', CORONAVIRIDAE_READS),
+                     ('Influenza', INFLUENZA_READS),
+                     ('Metapneumovirus', METAPMEUMOVIRUS_READS),
+                     ('Rhinovirus', RHINOVIRUS_READS),
+                     ('Sars_cov_2', SARS_COV_2_READS),
+                     ('Human', HUMAN_READS)]
+    
+    balanced = CLASS_CAP is not None or CLASS_WEIGHTS is not None
+    # weights in the order of the label_maker outputs
+    class_weights = parse_class_weights(CLASS_WEIGHTS, list(label_maker.classes_))
+    
+    if REFERENCE_GENOMES is True:
+        print('Loading reference genomes')
+        if REFERENCE_STORE is not None:
+            references = store_references(open_store(REFERENCE_STORE), [i[0] for i in class_folders])
+        else:
+            references = load_references(class_folders, FILE_TYPE)
+        
+        # Tokenize the vocabulary
+        if teacher is not None:
+            kmer_table = tokenizer_table(teacher_tokenizer, K_MERS)
+        elif init_model is not None:
+            print('Counting k-mers of lenght '+str(K_MERS)+' in the reference genomes')
+            counts = kmer_counts(references, K_MERS, STRAND)
+            if CANONICAL is True:
+                counts = canonical_counts(counts, K_MERS)
+            kmer_table = new_kmers(init_tokenizer, counts, K_MERS, MIN_COUNT)
+        elif VOCABULARY == 'observed':
+            print('Counting k-mers of lenght '+str(K_MERS)+' in the reference genomes')
+            counts = kmer_counts(references, K_MERS, STRAND)
+            if CANONICAL is True:
+                counts = canonical_counts(counts, K_MERS)
+            kmer_table = observed_vocabulary(counts, MIN_COUNT)
+        elif VOCABULARY == 'hashed':
+            kmer_table = hashed_vocabulary(K_MERS, HASH_BUCKETS, CANONICAL)
+        else:
+            kmer_table = full_vocabulary(K_MERS, CANONICAL)
+        
+        epoch_reads = int(reads_per_genome(references['lengths'], DEPTH, READ_LENGTH).sum())
+        print(str(epoch_reads)+' reads will be sampled per epoch')
+        
+        # hold out a fixed validation set to follow the loss across epochs
+        val_genomes = epoch_plan(references, DEPTH, READ_LENGTH, np.random.RandomState(seed_value))
+        val_genomes = val_genomes[:int(epoch_reads*VALIDATION_SPLIT)]
+        X_val, y_val = synthetic_chunk(references,
+                                       val_genomes,
+                                       kmer_table,
+                                       label_maker,
+                                       np.random.RandomState(seed_value))
+        n_train = epoch_reads
+        max_length = READ_LENGTH - K_MERS + 1
+        if teacher is not None and teacher.input_shape[1] != max_length:
+            raise ValueError('The teacher model expects '+str(teacher.input_shape[1])+
+                             ' k-mers per read, reads of '+str(READ_LENGTH)+' bp give '+str(max_length))
+        if init_model is not None and init_model.input_shape[1] != max_length:
+            raise ValueError('The initial model expects '+str(init_model.input_shape[1])+
+                             ' k-mers per read, reads of '+str(READ_LENGTH)+' bp give '+str(max_length))
     
-    Influenza_reads = main(INFLUENZA_READS,
-                           read_lenght,
-                           kmers,
-                           FILE_TYPE
-                          )
+    else:
+        if balanced is True:
+            # stream every class folder keeping at most a capped sample of reads
+            caps = class_caps(CLASS_CAP, parse_class_weights(CLASS_WEIGHTS, labels_to_fit))
+            total_sequences = []
+            labels = []
+            for (class_name, directory), cap in zip(class_folders, caps):
+                print('Sampling '+class_name+' reads')
+                class_reads, seen = reservoir_sample(stream_reads(directory, FILE_TYPE),
+                                                     cap,
+                                                     np.random.RandomState(seed_value))
+                print('Kept '+str(len(class_reads))+' of '+str(seen)+' '+class_name+' reads')
+                total_sequences += process_reads(class_reads)
+                labels += [class_name]*len(class_reads)
+        
+        else:
+            # get synthetic reads
+            print('Loading Coronaviridae reads')
+    
+            Coronaviridae_reads = main(CORONAVIRIDAE_READS,
+                                       FILE_TYPE,
+                                      )
     
-    print('Loading Metapneumovirus reads')
+            print('Loading Influenza reads')
     
-    Metapneumovirus_reads = main(METAPMEUMOVIRUS_READS,
-                                 read_lenght, 
-                                 kmers,
-                                 FILE_TYPE
-                                 )
+            Influenza_reads = main(INFLUENZA_READS,
+                                   FILE_TYPE
+                                  )
     
-    print('Loading Rhinovirus reads')
+            print('Loading Metapneumovirus reads')
     
-    Rhinovirus_reads = main(RHINOVIRUS_READS,
-                            read_lenght, 
-                            kmers,
-                            FILE_TYPE
-                           )
+            Metapneumovirus_reads = main(METAPMEUMOVIRUS_READS,
+                                         FILE_TYPE
+                                         )
     
-    print('Loading SARS-CoV-2 reads')
+            print('Loading Rhinovirus reads')
     
-    Sars_cov_2_reads = main(SARS_COV_2_READS,
-                            read_lenght, 
-                            kmers,
-                            FILE_TYPE
-                            )
+            Rhinovirus_reads = main(RHINOVIRUS_READS,
+                                    FILE_TYPE
+                                   )
     
-    print('Loading Human reads')
+            print('Loading SARS-CoV-2 reads')
     
-    Human = main(HUMAN_READS,
-                 read_lenght,
-                 kmers,
-                 FILE_TYPE
-                 )
+            Sars_cov_2_reads = main(SARS_COV_2_READS,
+                                    FILE_TYPE
+                                    )
     
-    total_sequences =  Coronaviridae_reads + \
-                       Influenza_reads +\
-                       Metapneumovirus_reads +\
-                       Rhinovirus_reads +\
-                       Sars_cov_2_reads +\
-                       Human
+            print('Loading Human reads')
     
+            Human = main(HUMAN_READS,
+                         FILE_TYPE
+                         )
     
-    labels_to_fit = ['Coronaviridae','Influenza',"Metapneumovirus","Rhinovirus","Sars_cov_2", 'Human']
-    label_maker = LabelBinarizer()
-    transfomed_label = label_maker.fit(labels_to_fit)
+            total_sequences =  Coronaviridae_reads + \
+                               Influenza_reads +\
+                               Metapneumovirus_reads +\
+                               Rhinovirus_reads +\
+                               Sars_cov_2_reads +\
+                               Human
     
-    # save label_maker
-    print('Saving object to convert output to labels '+ OUT_FOLDER+'/label_maker.'+MODEL_NAME+'.pickle')
-
-    with open(OUT_FOLDER+'/label_maker.'+MODEL_NAME+'.pickle', 'wb') as handle:
-        pickle.dump(label_maker, handle, protocol=pickle.HIGHEST_PROTOCOL)
     
-    labels = list(np.repeat('Coronaviridae',len(Coronaviridae_reads))) + \
-             list(np.repeat('Influenza',len(Influenza_reads))) + \
-             list(np.repeat('Metapneumovirus',len(Metapneumovirus_reads))) + \
-             list(np.repeat('Rhinovirus',len(Rhinovirus_reads))) + \
-             list(np.repeat('Sars_cov_2',len(Sars_cov_2_reads))) + \
-             list(np.repeat('Human',len(Human)))
+            labels = list(np.repeat('Coronaviridae',len(Coronaviridae_reads))) + \
+                     list(np.repeat('Influenza',len(Influenza_reads))) + \
+                     list(np.repeat('Metapneumovirus',len(Metapneumovirus_reads))) + \
+                     list(np.repeat('Rhinovirus',len(Rhinovirus_reads))) + \
+                     list(np.repeat('Sars_cov_2',len(Sars_cov_2_reads))) + \
+                     list(np.repeat('Human',len(Human)))
              
-    labels_proces = label_maker.transform(labels)
-    
-    # Tokenize the vocabulary
-    tokenizer = Tokenizer()
-    tokenizer.fit_on_texts(total_sequences)
-    print('Converting reads into k-mers of lenght '+str(K_MERS))
-    sequences_preproces = tokenizer.texts_to_sequences(total_sequences)
-    
-    max_length = max([len(s.split()) for s in total_sequences])
-    # pad sequences
-    sequences_preproces = pad_sequences(sequences_preproces, maxlen = max_length, padding = 'post')
+        if REPLAY_READS is not None:
+            # mix old reads with the new ones so the fine-tuned model does not forget them
+            replay_reads, replay_labels = replay_sample(REPLAY_READS,
+                                                        labels_to_fit,
+                                                        REPLAY_CAP,
+                                                        FILE_TYPE,
+                                                        seed_value)
+            total_sequences += replay_reads
+            labels += replay_labels
+        
+        labels_proces = label_maker.transform(labels)
+    
+        # encode the reads in 2-bit codes padded at the end
+        if teacher is not None:
+            encoded_reads = encode_reads(total_sequences, teacher.input_shape[1] + K_MERS - 1)
+        elif init_model is not None:
+            encoded_reads = encode_reads(total_sequences, init_model.input_shape[1] + K_MERS - 1)
+        else:
+            encoded_reads = encode_reads(total_sequences)
+        del total_sequences
+    
+        # Tokenize the vocabulary
+        if teacher is not None:
+            kmer_table = tokenizer_table(teacher_tokenizer, K_MERS)
+        elif init_model is not None:
+            print('Counting k-mers of lenght '+str(K_MERS))
+            counts = count_kmers(encoded_reads, K_MERS)
+            if CANONICAL is True:
+                counts = canonical_counts(counts, K_MERS)
+            kmer_table = new_kmers(init_tokenizer, counts, K_MERS, MIN_COUNT)
+        elif VOCABULARY == 'observed':
+            print('Counting k-mers of lenght '+str(K_MERS))
+            counts = count_kmers(encoded_reads, K_MERS)
+            if CANONICAL is True:
+                counts = canonical_counts(counts, K_MERS)
+            kmer_table = observed_vocabulary(counts, MIN_COUNT)
+        elif VOCABULARY == 'hashed':
+            kmer_table = hashed_vocabulary(K_MERS, HASH_BUCKETS, CANONICAL)
+        else:
+            kmer_table = full_vocabulary(K_MERS, CANONICAL)
+        print('Converting reads into k-mers of lenght '+str(K_MERS))
+        sequences_preproces = tokenize_reads(encoded_reads, kmer_table, K_MERS, CANONICAL)
+        max_length = sequences_preproces.shape[1]
+        del encoded_reads
+        
+        # hold out a fixed validation set to follow the loss across epochs
+        X_train, X_val, y_train, y_val = train_test_split(sequences_preproces,
+                                                          labels_proces,
+                                                          test_size=VALIDATION_SPLIT,
+                                                          random_state=seed_value)
+        n_train = len(X_train)
+    
+    if teacher is not None:
+        tokenizer = teacher_tokenizer
+    elif init_model is not None:
+        tokenizer = vocabulary_tokenizer(kmer_table, K_MERS, getattr(init_tokenizer, 'oov_token', None) is not None)
+    else:
+        tokenizer = vocabulary_tokenizer(kmer_table, K_MERS, VOCABULARY == 'observed')
     
     print('Saving tokenizer object '+ OUT_FOLDER+'/tokenizer.'+MODEL_NAME+'.pickle')
     with open(OUT_FOLDER+'/tokenizer.'+MODEL_NAME+'.pickle', 'wb') as handle:
         pickle.dump(tokenizer, handle, protocol=pickle.HIGHEST_PROTOCOL)
     
-    sequences_preproces, labels_proces = shuffle(sequences_preproces, labels_proces)
-    
-    max_features = len(tokenizer.word_index)+1
-    
-    # Convolution
-    kernel_size = 3
-    filters = 128
-    pool_size = 3
-    
-    # LSTM
-    lstm_output_size = 70
+    # hashed vocabularies share ids between k-mers, size the embedding on the largest id
+    max_features = int(kmer_table.max())+1
     
     # Training
-    batch_size = 30
-    epochs = 1
-    
-    
-    # Define the model the model
-    model = Sequential()
-    model.add(Embedding(max_features, 100, input_length=sequences_preproces.shape[1]))
-    model.add(Dropout(0.20))
-    model.add(Conv1D(filters,
-                     kernel_size,
-                     padding='same',
-                     activation='relu',
-                     strides=1))
-    model.add(MaxPooling1D(pool_size=pool_size))
-    model.add(Dropout(0.1))
-    if GPU == True:
-        model.add(Bidirectional(CuDNNLSTM(lstm_output_size)))
-    else:
-        model.add(Bidirectional(LSTM(lstm_output_size)))    
-    model.add(Dropout(0.1))
-    model.add(Dense(50))
-    model.add(Dense(6))
-
-    model.add(Activation('softmax'))
-    model.compile(loss='categorical_crossentropy',
-                  optimizer='adam',
-                  metrics=['binary_accuracy', 
-                           'categorical_accuracy',
-                           ])
+    batch_size = BATCH_SIZE
+    
+    model_path, state_path, best_path = checkpoint_paths(OUT_FOLDER, MODEL_NAME)
+    model, state = None, None
+    if RESUME is True:
+        model, state = load_checkpoint(OUT_FOLDER, MODEL_NAME)
+        if model is None:
+            print('No checkpoint found in '+OUT_FOLDER+'/checkpoints, starting a new training')
+        else:
+            print('Resuming training from epoch '+str(state['epoch'])+' chunk '+str(state['chunk']))
+    
+    if model is None and init_model is not None:
+        model = init_model
+        if max_features > embedding_rows(model):
+            print('Growing the embedding from '+str(embedding_rows(model))+' to '+str(max_features)+' rows')
+            oov_index = tokenizer.word_index.get(getattr(tokenizer, 'oov_token', None))
+            model = grow_embedding(model, max_features, oov_index)
+    elif model is None:
+        model = build_model(max_features,
+                            max_length,
+                            gpu=GPU,
+                            kernel_size=KERNEL_SIZE,
+                            filters=FILTERS,
+                            pool_size=POOL_SIZE,
+                            lstm_output_size=LSTM_OUTPUT_SIZE,
+                            architecture=ARCHITECTURE)
+    
+    if state is None:
+        state = {'epoch': 0,
+                 'chunk': 0,
+                 'best_val_loss': None,
+                 'epochs_without_improvement': 0,
+                 'stopped_early': False,
+                 'training_time': 0.0,
+                 'history': [],
+                 'val_history': []
+                 }
     model.summary()
     
+    # the student is trained through a model that shares its layers
+    fit_model = model
+    if teacher is not None:
+        fit_model = distillation_model(model, DISTILLATION_TEMPERATURE, DISTILLATION_ALPHA)
+    
+    n_chunks = int(np.ceil(n_train/CHUNK_SIZE))
+    if STOP_CHUNK is not None:
+        n_chunks = min(n_chunks, STOP_CHUNK)
+    
     # training time
-    start = time.process_time()
+    training_start = time.time() - state['training_time']
     
-    histories = []
     print('Train...')
-    for epoch in range(epochs):
+    for epoch in range(state['epoch'], EPOCHS):
+        if state['stopped_early'] is True:
+            break
         print("epoch %d" %epoch)
-        #train in batches of 200k sequences
-        for chunks in range(0, len(sequences_preproces), 200000):
-            start, end = chunks, chunks+200000
-            if end > len(sequences_preproces):
-                end = len(sequences_preproces)
-            print('chunk: ',start, end)
-            training_batch = sequences_preproces[start:end]
-            labels_batch = labels_proces[start:end] 
-            X_train,X_test,y_train,y_test = train_test_split(training_batch, 
-                                                             labels_batch,
-                                                             test_size=0.10, 
-                                                             random_state=42)
-            chunk_history = model.fit(X_train, y_train,
+        # same order for an epoch when the training is resumed
+        if REFERENCE_GENOMES is True:
+            order = epoch_plan(references, DEPTH, READ_LENGTH, np.random.RandomState(seed_value + epoch))
+        elif balanced is True:
+            order = balanced_order(np.argmax(y_train, axis=1),
+                                   class_weights,
+                                   n_train,
+                                   np.random.RandomState(seed_value + epoch))
+        else:
+            order = np.random.RandomState(seed_value + epoch).permutation(n_train)
+        for chunk in range(state['chunk'], n_chunks):
+            start, end = chunk*CHUNK_SIZE, min((chunk+1)*CHUNK_SIZE, n_train)
+            print('chunk: ', chunk, start, end)
+            if REFERENCE_GENOMES is True:
+                X_chunk, y_chunk = synthetic_chunk(references,
+                                                   order[start:end],
+                                                   kmer_table,
+                                                   label_maker,
+                                                   np.random.RandomState([seed_value, epoch, chunk]))
+            else:
+                X_chunk, y_chunk = X_train[order[start:end]], y_train[order[start:end]]
+            if teacher is not None:
+                y_chunk = distillation_targets(teacher,
+                                               X_chunk,
+                                               y_chunk,
+                                               DISTILLATION_TEMPERATURE,
+                                               batch_size=1024)
+            chunk_history = fit_model.fit(X_chunk, y_chunk,
                                       batch_size=batch_size,
-                                      epochs=1,
-                                      validation_data=(X_test, y_test)
+                                      epochs=1
                                       )
-
-            histories.append(chunk_history)
-            if chunks == STOP_CHUNK:
-                break
-            break
-    
-    end = time.process_time()
-    print('Traning time:', start  - end)
-    
-    # save keras model
+            state['history'].append({metric: float(values[0]) 
+                                     for metric, values in chunk_history.history.items()})
+            state['chunk'] = chunk + 1
+            state['training_time'] = time.time() - training_start
+            if state['chunk'] % CHECKPOINT_EVERY == 0 and state['chunk'] < n_chunks:
+                save_checkpoint(model, state, model_metadata, OUT_FOLDER, MODEL_NAME)
+        
+        val_metrics = validation_metrics(model, X_val, y_val, batch_size, label_maker.classes_)
+        state['val_history'].append(val_metrics)
+        print('validation: '+str(val_metrics))
+        
+        # early stopping on the validation loss
+        if state['best_val_loss'] is None or val_metrics['loss'] < state['best_val_loss']:
+            state['best_val_loss'] = val_metrics['loss']
+            state['epochs_without_improvement'] = 0
+            save_model_atomic(model, best_path, model_metadata)
+        else:
+            state['epochs_without_improvement'] += 1
+            if state['epochs_without_improvement'] >= PATIENCE:
+                print('Validation loss did not improve in '+str(PATIENCE)+' epochs, stopping')
+                state['stopped_early'] = True
+        
+        state['epoch'] = epoch + 1
+        state['chunk'] = 0
+        state['training_time'] = time.time() - training_start
+        save_checkpoint(model, state, model_metadata, OUT_FOLDER, MODEL_NAME)
+    
+    print('Traning time:', state['training_time'])
+    
+    # save keras model with the best validation loss
+    if os.path.isfile(best_path):
+        model = load_model(best_path)
     model.save(OUT_FOLDER+'/'+MODEL_NAME+".h5")
+    save_metadata(OUT_FOLDER+'/'+MODEL_NAME+".h5", model_metadata)
     print("Saved model to disk")
-
-    #### plot the accuracies and losses
-    bi_acc = []
-    cat_acc = []
-    loss = []
-    val_bi_acc = []
-    val_cat_acc = []
-    val_loss = []
-    for i in histories:
-        bi_acc.append(i.history['binary_accuracy'][0])
-        cat_acc.append(i.history['categorical_accuracy'][0])
-        loss.append(i.history['loss'][0])
-        val_bi_acc.append(i.history['val_binary_accuracy'][0])
-        val_cat_acc.append(i.history['val_categorical_accuracy'][0])
-        val_loss.append(i.history['val_loss'][0])
-
-    f, ax = plt.subplots( figsize=(13,9))
-    sns.lineplot(x=np.arange(len(histories)), y=np.array(bi_acc), palette="tab10", linewidth=2.5, label='Binary accuracy')
-    sns.lineplot(x=np.arange(len(histories)), y=np.array(cat_acc), palette="tab10", linewidth=2.5, label='Categorical accuracy')
-    plt.ylabel('Accuracies')
-    plt.ylabel('Accuracies')
-    plt.savefig(OUT_FOLDER+'/trainning_accuracy_'+MODEL_NAME+'.pdf',
-                format='pdf',
-                dpi=1200,
-                bbox_inches='tight', pad_inches=0)
-    
-    f, ax = plt.subplots( figsize=(13,9))
-    sns.lineplot(x=np.arange(len(histories)), y=np.array(loss), palette="tab10", linewidth=2.5, label='loss')
-    plt.ylabel('Loss')
-    plt.savefig(OUT_FOLDER+'/training_loss_'+MODEL_NAME+'.pdf',
-                format='pdf',
-                dpi=1200,
-                bbox_inches='tight', pad_inches=0)
-    
-    f, ax = plt.subplots( figsize=(13,9))
-    sns.lineplot(x=np.arange(len(histories)), y=np.array(val_bi_acc), palette="tab10", linewidth=2.5, label='Validation binary accuracy')
-    sns.lineplot(x=np.arange(len(histories)), y=np.array(val_cat_acc), palette="tab10", linewidth=2.5, label='Validation categorical accuracy')
-    plt.ylabel('Percentage of predicted reads')
-    plt.savefig(OUT_FOLDER+'/val_training_accuracy_'+MODEL_NAME+'.pdf',
-                format='pdf',
-                dpi=1200,
-                bbox_inches='tight', pad_inches=0)
-    
-    f, ax = plt.subplots( figsize=(13,9))
-    sns.lineplot(x=np.arange(len(histories)), y=np.array(val_loss), palette="tab10", linewidth=2.5, label='Validation loss')
-    plt.ylabel('Loss')
-    plt.savefig(OUT_FOLDER+'/val_loss_'+MODEL_NAME+'.pdf',
-                format='pdf',
-                dpi=1200,
-                bbox_inches='tight', pad_inches=0)
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
     
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-    
-
-
-
+    if teacher is not None:
+        df_report = distillation_report(teacher, model, X_val, label_maker.classes_)
+        print()
+        print(df_report)
+        df_report.to_csv(OUT_FOLDER+'/distillation_report_'+MODEL_NAME+'.csv', index=False)
 
+    #### plot the accuracies and losses
+    history = state['history']
+    val_history = state['val_history']
+    chunks_x = np.arange(len(history))
+    epochs_x = np.arange(len(val_history))
+    
+    plot_history(chunks_x,
+                 [([i['binary_accuracy'] for i in history], 'Binary accuracy'),
+                  ([i['categorical_accuracy'] for i in history], 'Categorical accuracy')],
+                 'Accuracies',
+                 OUT_FOLDER+'/trainning_accuracy_'+MODEL_NAME+'.pdf')
+    
+    plot_history(chunks_x,
+                 [([i['loss'] for i in history], 'loss')],
+                 'Loss',
+                 OUT_FOLDER+'/training_loss_'+MODEL_NAME+'.pdf')
+    
+    plot_history(epochs_x,
+                 [([i['binary_accuracy'] for i in val_history], 'Validation binary accuracy'),
+                  ([i['categorical_accuracy'] for i in val_history], 'Validation categorical accuracy')],
+                 'Percentage of predicted reads',
+                 OUT_FOLDER+'/val_training_accuracy_'+MODEL_NAME+'.pdf')
+    
+    plot_history(epochs_x,
+                 [([i['loss'] for i in val_history], 'Validation loss')],
+                 'Loss',
+                 OUT_FOLDER+'/val_loss_'+MODEL_NAME+'.pdf')